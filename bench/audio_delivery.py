@@ -0,0 +1,113 @@
+"""
+Benchmark: ยิง /audio/<file> ไฟล์เดียวกันพร้อมกันหลาย connection (จำลองคนในกลุ่มกดฟังพร้อมกัน)
+
+ใช้งาน:
+    python bench/audio_delivery.py                       # เปิด bot.py ในเครื่อง (werkzeug threaded)
+    python bench/audio_delivery.py --url https://x/audio/<file>.mp3 --concurrency 50 --requests 2000
+
+รายงาน requests/sec และ p50/p99 latency
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, int(round(pct / 100.0 * len(values))) - 1))
+    return values[idx]
+
+
+def start_local_server(size_bytes: int):
+    """เปิด bot.app ในเครื่อง แล้วสร้างไฟล์ mp3 ขนาด size_bytes ไว้ทดสอบ"""
+    import logging
+    from werkzeug.serving import make_server
+    import bot
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    fname = "b" * 64 + ".mp3"
+    with open(os.path.join(bot.AUDIO_DIR, fname), "wb") as f:
+        f.write(b"ID3" + os.urandom(max(0, size_bytes - 3)))
+
+    srv = make_server("127.0.0.1", 0, bot.app, threaded=True)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://127.0.0.1:{srv.server_port}/audio/{fname}"
+
+
+def run(url: str, concurrency: int, total: int, headers=None) -> dict:
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = [total]
+
+    def worker():
+        sess = requests.Session()
+        local = []
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            t0 = time.perf_counter()
+            try:
+                r = sess.get(url, headers=headers, timeout=30)
+                r.content
+                if r.status_code not in (200, 206, 304):
+                    raise RuntimeError(r.status_code)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            local.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", help="URL ของไฟล์เสียง (ไม่ใส่ = เปิด bot ในเครื่อง)")
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--requests", type=int, default=1000)
+    ap.add_argument("--size", type=int, default=300 * 1024, help="ขนาดไฟล์ทดสอบ (byte) ตอนเปิดในเครื่อง")
+    ap.add_argument("--no-mem-cache", action="store_true", help="ปิด memory cache (ส่งจากดิสก์ทุกครั้ง)")
+    args = ap.parse_args()
+
+    if args.no_mem_cache:
+        os.environ["AUDIO_MEM_CACHE_BYTES"] = "0"
+
+    url = args.url
+    if not url:
+        _, url = start_local_server(args.size)
+
+    print(f"GET {url} x{args.requests} (concurrency {args.concurrency})")
+    print("full     :", run(url, args.concurrency, args.requests))
+    print("range 64K:", run(url, args.concurrency, args.requests, headers={"Range": "bytes=0-65535"}))
+
+
+if __name__ == "__main__":
+    main()
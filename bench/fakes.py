@@ -0,0 +1,284 @@
+"""
+Server จำลองสำหรับ load test (ไม่ต้องยิง API จริง)
+
+- FakeMiniMax: /v1/t2a_v2 (sync + stream SSE), /v1/get_voice, /v1/user/balance
+               (สุ่มตอบ 503 / ช้าผิดปกติได้ ไว้ทดสอบ retry / hedge / circuit breaker)
+- FakeSheet:   CSV ดับไฟ (รองรับ ETag / 304)
+- FakeLine:    /v2/bot/message/reply, /push, /multicast, /broadcast (จดทุก request ไว้ให้ load test ตรวจ, retry key ซ้ำตอบ 409)
+- FakeObjectStore: GET/PUT/HEAD/DELETE ต่อ key + ETag / If-None-Match: * / If-Match (STORAGE_BACKEND=http)
+
+ทุกตัวตั้ง latency ได้ และ start() คืน base URL (http://127.0.0.1:<port>)
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# MPEG1 Layer III 128kbps 32kHz: 576 byte / frame, 36ms / frame
+MP3_FRAME = bytes([0xFF, 0xFB, 0x98, 0x04]) + bytes(572)
+MP3_FRAME_MS = 36
+# bitrate index ของ MPEG1 Layer III (kbps -> index ใน header)
+_MP3_BITRATE_INDEX = {32: 1, 40: 2, 48: 3, 56: 4, 64: 5, 80: 6, 96: 7, 112: 8, 128: 9}
+
+
+def _mp3_frame(bitrate: int, channels: int) -> bytes:
+    kbps = bitrate // 1000
+    if kbps == 128 and channels == 2:
+        return MP3_FRAME
+    # ทุก bitrate ใช้ 32kHz ความยาว frame เท่ากัน (36ms) ขนาด frame = 144 * bitrate / 32000
+    header = bytes([0xFF, 0xFB, (_MP3_BITRATE_INDEX[kbps] << 4) | 0x08, 0xC4 if channels == 1 else 0x04])
+    return header + bytes(144 * bitrate // 32000 - 4)
+
+
+def fake_mp3(size_bytes: int, bitrate: int = 128000, channels: int = 2) -> bytes:
+    """เสียงยาวเท่ากับ size_bytes ที่ 128kbps (bitrate ต่ำลง = ไฟล์เล็กลง ความยาวเท่าเดิม)"""
+    frames = max(1, size_bytes // len(MP3_FRAME))
+    return _mp3_frame(bitrate, channels) * frames
+
+
+class _Server:
+    """ThreadingHTTPServer + handler ที่เรียก self.route(handler, method)"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.httpd = None
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def start(self) -> str:
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self, method):
+                with owner._lock:
+                    owner.requests += 1
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if owner.latency:
+                    time.sleep(owner.latency)
+                owner.route(self, method, body)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_PUT(self):
+                self._handle("PUT")
+
+            def do_HEAD(self):
+                self._handle("HEAD")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def stop(self) -> None:
+        if self.httpd:
+            self.httpd.shutdown()
+
+    def route(self, h, method, body):
+        raise NotImplementedError
+
+    @staticmethod
+    def send(h, status=200, body=b"", content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        h.send_response(status)
+        h.send_header("Content-Type", content_type)
+        h.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            h.send_header(k, v)
+        h.end_headers()
+        if h.command != "HEAD":
+            h.wfile.write(body)
+
+
+class FakeMiniMax(_Server):
+    def __init__(self, latency: float = 1.0, audio_bytes: int = 200 * 1024, voices: int = 50,
+                 stream_chunks: int = 10, error_rate: float = 0.0, slow_rate: float = 0.0, slow_factor: float = 10.0):
+        super().__init__(latency=0.0)
+        self.t2a_latency = latency
+        self.audio_bytes = audio_bytes
+        self.voices = voices
+        self.stream_chunks = stream_chunks
+        # สัดส่วนคำขอที่ตอบ 503 / ช้ากว่าปกติ slow_factor เท่า
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.credit = 100000.0
+        self.t2a_calls = 0
+        self.t2a_errors = 0
+
+    def route(self, h, method, body):
+        path = h.path.split("?", 1)[0]
+        if path == "/v1/t2a_v2":
+            return self._t2a(h, json.loads(body or b"{}"))
+        if path == "/v1/get_voice":
+            voices = [{"voice_id": f"bench_voice_{i}", "voice_name": f"Bench Voice {i}"} for i in range(self.voices)]
+            return self.send(h, body={"system_voice": voices, "base_resp": {"status_code": 0}})
+        if path == "/v1/user/balance":
+            return self.send(h, body={"credit_balance": round(self.credit, 2)})
+        return self.send(h, 404, {"error": "not found"})
+
+    def _t2a(self, h, payload):
+        with self._lock:
+            self.t2a_calls += 1
+            self.credit -= len(payload.get("text") or "") * 0.01
+            failed = random.random() < self.error_rate
+            if failed:
+                self.t2a_errors += 1
+        if failed:
+            time.sleep(self.t2a_latency / 10)
+            return self.send(h, 503, {"error": "service unavailable"})
+        latency = self.t2a_latency * (self.slow_factor if random.random() < self.slow_rate else 1)
+        setting = payload.get("audio_setting") or {}
+        audio = fake_mp3(self.audio_bytes, int(setting.get("bitrate") or 128000), int(setting.get("channel") or 2))
+
+        if not payload.get("stream"):
+            time.sleep(latency)
+            return self.send(h, body={"data": {"audio": audio.hex(), "status": 2},
+                                      "base_resp": {"status_code": 0, "status_msg": "success"}})
+
+        # stream: แบ่ง latency ให้ chunk ละเท่าๆ กัน ส่งแบบ chunked SSE
+        h.send_response(200)
+        h.send_header("Content-Type", "text/event-stream")
+        h.send_header("Transfer-Encoding", "chunked")
+        h.end_headers()
+        n = max(1, self.stream_chunks)
+        frame = len(_mp3_frame(int(setting.get("bitrate") or 128000), int(setting.get("channel") or 2)))
+        step = max(frame, (len(audio) // n) // frame * frame)
+        for i in range(0, len(audio), step):
+            time.sleep(latency / n)
+            event = {"data": {"audio": audio[i:i + step].hex(), "status": 1}}
+            self._write_chunk(h, b"data: " + json.dumps(event).encode() + b"\n\n")
+        final = {"data": {"audio": "", "status": 2}, "base_resp": {"status_code": 0}}
+        self._write_chunk(h, b"data: " + json.dumps(final).encode() + b"\n\n")
+        h.wfile.write(b"0\r\n\r\n")
+
+    @staticmethod
+    def _write_chunk(h, data: bytes):
+        h.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        h.wfile.flush()
+
+
+class FakeSheet(_Server):
+    def __init__(self, latency: float = 0.3, rows: int = 30):
+        super().__init__(latency=latency)
+        self.set_rows(rows)
+
+    def set_rows(self, rows: int) -> None:
+        lines = ["date,start,end,area,detail,status"]
+        for i in range(rows):
+            lines.append(f"2026-11-{i % 28 + 1:02d},08:30,17:00,พื้นที่ทดสอบ {i},รายละเอียด {i},active")
+        self.csv = ("\ufeff" + "\n".join(lines) + "\n").encode("utf-8")
+        self.etag = f'"{hash(self.csv) & 0xFFFFFFFF:x}"'
+
+    def route(self, h, method, body):
+        if h.headers.get("If-None-Match") == self.etag:
+            return self.send(h, 304, b"", headers={"ETag": self.etag})
+        return self.send(h, body=self.csv, content_type="text/csv; charset=utf-8", headers={"ETag": self.etag})
+
+
+class FakeLine(_Server):
+    """จดทุกข้อความที่บอทส่งออก: (เวลา, ชนิด, key, body) key = replyToken หรือ to"""
+
+    def __init__(self, latency: float = 0.05):
+        super().__init__(latency=latency)
+        self.received = []
+        self.retry_keys = set()
+        self._cond = threading.Condition()
+
+    def route(self, h, method, body):
+        path = h.path.split("?", 1)[0]
+        data = json.loads(body or b"{}")
+        kind = path.rsplit("/", 1)[-1]
+        if kind == "reply":
+            keys = [data.get("replyToken")]
+        elif kind == "push":
+            keys = [data.get("to")]
+        elif kind == "multicast":
+            keys = list(data.get("to") or [])
+        elif kind == "broadcast":
+            keys = ["*"]
+        else:
+            return self.send(h, body={})
+        # retry key ซ้ำ = ส่งไปแล้ว ตอบ 409 แบบ LINE จริง
+        retry_key = h.headers.get("X-Line-Retry-Key")
+        if retry_key:
+            with self._cond:
+                duplicate = retry_key in self.retry_keys
+                self.retry_keys.add(retry_key)
+            if duplicate:
+                return self.send(h, 409, {"message": "The retry key is already accepted"},
+                                 headers={"X-Line-Accepted-Request-Id": retry_key})
+        now = time.perf_counter()
+        with self._cond:
+            for key in keys:
+                self.received.append((now, kind, key, data))
+            self._cond.notify_all()
+        return self.send(h, body={})
+
+    def wait_for(self, predicate, timeout: float):
+        """รอจนมีข้อความที่ predicate(kind, key, data) เป็นจริง คืนเวลาที่ได้รับ (perf_counter) หรือ None"""
+        deadline = time.perf_counter() + timeout
+        seen = 0
+        with self._cond:
+            while True:
+                for ts, kind, key, data in self.received[seen:]:
+                    if predicate(kind, key, data):
+                        return ts
+                seen = len(self.received)
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+
+class FakeObjectStore(_Server):
+    """object store ในหน่วยความจำ (ใช้แทน S3/GCS ตอนทดสอบหลาย instance)"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency=latency)
+        self.objects = {}  # key -> (etag, bytes)
+        self._seq = 0
+
+    def route(self, h, method, body):
+        key = h.path.split("?", 1)[0].lstrip("/")
+        with self._lock:
+            current = self.objects.get(key)
+            if method in ("GET", "HEAD"):
+                if current is None:
+                    return self.send(h, 404, {"error": "not found"})
+                etag, data = current
+                return self.send(h, body=data, content_type="application/octet-stream", headers={"ETag": etag})
+
+            if_match = h.headers.get("If-Match")
+            if h.headers.get("If-None-Match") == "*" and current is not None:
+                return self.send(h, 412, {"error": "exists"})
+            if if_match and if_match != "*" and (current is None or current[0] != if_match):
+                return self.send(h, 412, {"error": "etag mismatch"})
+
+            if method == "PUT":
+                self._seq += 1
+                etag = f'"{self._seq}"'
+                self.objects[key] = (etag, body)
+                return self.send(h, 200, {}, headers={"ETag": etag})
+            if method == "DELETE":
+                if current is None:
+                    return self.send(h, 404, {"error": "not found"})
+                del self.objects[key]
+                return self.send(h, 204, b"")
+        return self.send(h, 405, {"error": "method not allowed"})
@@ -0,0 +1,325 @@
+"""
+Load test แบบ offline: เปิดบอทเป็น process แยก ชี้ไปที่ server จำลอง (bench/fakes.py)
+แล้วยิง webhook ที่เซ็น X-Line-Signature ถูกต้องเข้า /callback
+
+scenario:
+    tts     "เสียง <ข้อความไม่ซ้ำ>" วัดจากยิง webhook จนถึง LINE จำลองได้รับ push เสียง
+    tts_same "เสียง <ข้อความเดียวกันทุก event>" วัดการรวมงานซ้ำ (ดู fake_calls.minimax_t2a)
+    outage  "ดับไฟ" วัดจนได้รับ reply
+    voices  "/voices" วัดจนได้รับ reply
+    audio   GET /audio/<ไฟล์จาก scenario tts> พร้อมกันหลาย connection
+
+--instances N: webhook / audio กระจายแบบ round-robin ไปทุก instance
+
+ผลลัพธ์ (throughput, p50/p99, peak RSS ของ process บอท) เขียนเป็น JSON ไว้เทียบกันข้ามรุ่น
+
+ตัวอย่าง:
+    python bench/loadtest.py --events 50 --out bench_results.json
+    python bench/loadtest.py --scenarios tts --env MINIMAX_STREAM=1 --out stream.json
+    python bench/loadtest.py --server gunicorn
+    python bench/loadtest.py --env IO_MODE=asyncio --out asyncio.json   # เทียบกับ IO_MODE=threads
+    python bench/loadtest.py --instances 2   # 2 process แยก AUDIO_DIR ใช้ FakeObjectStore ร่วมกัน (STORAGE_BACKEND=http)
+    python bench/loadtest.py --scenarios tts --minimax-slow-rate 0.1 --env MINIMAX_HEDGE=1   # hedge ตัดหาง latency
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import requests
+
+from audio_delivery import percentile, run as run_audio
+from fakes import FakeLine, FakeMiniMax, FakeObjectStore, FakeSheet
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHANNEL_SECRET = "bench-secret"
+
+
+def sign(body: str) -> str:
+    digest = hmac.new(CHANNEL_SECRET.encode(), body.encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def text_event(text: str, group_id: str, reply_token: str) -> dict:
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "webhookEventId": uuid.uuid4().hex,
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": reply_token,
+        # ผู้ใช้ไม่ซ้ำต่อ event ไม่ให้ติด admission ต่อผู้ใช้ (TTS_USER_RATE_PER_MIN)
+        "source": {"type": "group", "groupId": group_id, "userId": "U" + group_id[1:]},
+        "message": {"type": "text", "id": uuid.uuid4().hex, "text": text},
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _peak_rss_kb(pid: int):
+    """VmHWM ของ process (Linux) ไม่มีคืน None"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class BotProcess:
+    def __init__(self, env: dict, server: str):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        if server == "gunicorn":
+            cmd = [sys.executable, "-m", "gunicorn", "-w", "1", "--threads", "16",
+                   "-b", f"127.0.0.1:{self.port}", "bot:app"]
+        else:
+            cmd = [sys.executable, "-c",
+                   "import logging, bot; logging.getLogger('werkzeug').setLevel(logging.WARNING); "
+                   f"bot.app.run(host='127.0.0.1', port={self.port}, threaded=True)"]
+        self.proc = subprocess.Popen(cmd, cwd=REPO_DIR, env=env,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                requests.get(self.url + "/", timeout=1)
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError("bot did not start")
+
+    def peak_rss_kb(self):
+        return _peak_rss_kb(self.proc.pid)
+
+    def stop(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+def run_webhook_scenario(bots, line, make_text, done_predicate, events, concurrency, timeout):
+    """
+    ยิง event ละ 1 webhook (พร้อมกันไม่เกิน concurrency) แล้วรอผลจาก LINE จำลอง
+    คืน latency ของ ack (/callback ตอบ) และ end-to-end ต่อ event
+    """
+    ack, e2e, errors = [], [], [0]
+    lock = threading.Lock()
+    sem = threading.Semaphore(concurrency)
+    sess = requests.Session()
+
+    def one(i):
+        with sem:
+            group_id = f"Gbench{uuid.uuid4().hex[:12]}"
+            token = f"rt{uuid.uuid4().hex}"
+            body = json.dumps({"destination": "Ubot", "events": [text_event(make_text(i), group_id, token)]},
+                              ensure_ascii=False)
+            bot = bots[i % len(bots)]
+            t0 = time.perf_counter()
+            try:
+                r = sess.post(bot.url + "/callback", data=body.encode("utf-8"),
+                              headers={"X-Line-Signature": sign(body), "Content-Type": "application/json"},
+                              timeout=timeout)
+                r.raise_for_status()
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                return
+            t_ack = time.perf_counter()
+            done = line.wait_for(lambda kind, key, data: done_predicate(kind, key, data, group_id, token),
+                                 timeout)
+        with lock:
+            ack.append(t_ack - t0)
+            if done is None:
+                errors[0] += 1
+            else:
+                e2e.append(done - t0)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=one, args=(i,)) for i in range(events)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "events": events,
+        "completed": len(e2e),
+        "errors": errors[0],
+        "throughput_per_sec": round(len(e2e) / elapsed, 2) if elapsed else 0.0,
+        "ack_p50_ms": round(percentile(ack, 50) * 1000, 2),
+        "ack_p99_ms": round(percentile(ack, 99) * 1000, 2),
+        "p50_ms": round(percentile(e2e, 50) * 1000, 2),
+        "p99_ms": round(percentile(e2e, 99) * 1000, 2),
+    }
+
+
+def _is_audio_push(kind, key, data, group_id, token):
+    # cache hit ตอบเสียงด้วย reply token ทันที ไม่ใช่ push
+    if key not in (group_id, token):
+        return False
+    return any(m.get("type") == "audio" for m in data.get("messages") or [])
+
+
+def _is_reply(kind, key, data, group_id, token):
+    return key in (token, group_id)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scenarios", default="tts,outage,voices,audio")
+    ap.add_argument("--events", type=int, default=30, help="จำนวน webhook ต่อ scenario")
+    ap.add_argument("--concurrency", type=int, default=10)
+    ap.add_argument("--timeout", type=float, default=120)
+    ap.add_argument("--audio-requests", type=int, default=500)
+    ap.add_argument("--minimax-latency", type=float, default=1.0)
+    ap.add_argument("--minimax-error-rate", type=float, default=0.0, help="สัดส่วนคำขอ MiniMax ที่ตอบ 503")
+    ap.add_argument("--minimax-slow-rate", type=float, default=0.0, help="สัดส่วนคำขอ MiniMax ที่ช้ากว่าปกติ 10 เท่า")
+    ap.add_argument("--audio-bytes", type=int, default=200 * 1024)
+    ap.add_argument("--sheet-latency", type=float, default=0.3)
+    ap.add_argument("--sheet-rows", type=int, default=30)
+    ap.add_argument("--line-latency", type=float, default=0.05)
+    ap.add_argument("--server", choices=["werkzeug", "gunicorn"], default="werkzeug")
+    ap.add_argument("--instances", type=int, default=1, help="จำนวน process บอท (>1 ใช้ object store ร่วม)")
+    ap.add_argument("--env", action="append", default=[], help="ENV เพิ่มให้บอท เช่น MINIMAX_STREAM=1")
+    ap.add_argument("--out", default="bench_results.json")
+    args = ap.parse_args()
+
+    minimax = FakeMiniMax(latency=args.minimax_latency, audio_bytes=args.audio_bytes,
+                          error_rate=args.minimax_error_rate, slow_rate=args.minimax_slow_rate)
+    sheet = FakeSheet(latency=args.sheet_latency, rows=args.sheet_rows)
+    line = FakeLine(latency=args.line_latency)
+    minimax_url, sheet_url, line_url = minimax.start(), sheet.start(), line.start()
+    store = FakeObjectStore() if args.instances > 1 else None
+
+    workdir = tempfile.mkdtemp(prefix="pea-bench-")
+    env = dict(os.environ)
+    env.update({
+        "TTS_JOURNAL_PATH": os.path.join(workdir, "journal.sqlite3"),
+        "LINE_CHANNEL_SECRET": CHANNEL_SECRET,
+        "LINE_CHANNEL_ACCESS_TOKEN": "bench-token",
+        "LINE_API_ENDPOINT": line_url,
+        "MINIMAX_API_KEY": "bench-key",
+        "MINIMAX_BASE_URL": minimax_url,
+        "SHEET_CSV_URL": sheet_url + "/sheet.csv",
+        "BASE_URL": "https://bench.invalid",
+        "AUDIO_DIR": os.path.join(workdir, "audio"),
+        "SETTINGS_PATH": os.path.join(workdir, "settings.json"),
+        "VOICE_CATALOG_PATH": os.path.join(workdir, "voices.json"),
+    })
+    extra_env = {}
+    for item in args.env:
+        k, _, v = item.partition("=")
+        extra_env[k] = v
+    if store is not None:
+        env.update({"STORAGE_BACKEND": "http", "STORAGE_URL": store.start()})
+    env.update(extra_env)
+
+    bots = []
+    for i in range(max(1, args.instances)):
+        inst_env = dict(env)
+        if i:
+            inst_env["AUDIO_DIR"] = os.path.join(workdir, f"audio{i}")
+            inst_env["TTS_JOURNAL_PATH"] = os.path.join(workdir, f"journal{i}.sqlite3")
+        bots.append(BotProcess(inst_env, args.server))
+    results = {}
+    try:
+        scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+        run_id = uuid.uuid4().hex[:6]
+
+        if "tts" in scenarios:
+            results["tts"] = run_webhook_scenario(
+                bots, line, lambda i: f"เสียง ประกาศทดสอบ {run_id} หมายเลข {i}", _is_audio_push,
+                args.events, args.concurrency, args.timeout)
+        if "tts_same" in scenarios:
+            results["tts_same"] = run_webhook_scenario(
+                bots, line, lambda i: f"เสียง ประกาศซ้ำ {run_id}", _is_audio_push,
+                args.events, args.concurrency, args.timeout)
+        if "outage" in scenarios:
+            results["outage"] = run_webhook_scenario(
+                bots, line, lambda i: "ดับไฟ", _is_reply, args.events, args.concurrency, args.timeout)
+        if "voices" in scenarios:
+            results["voices"] = run_webhook_scenario(
+                bots, line, lambda i: "/voices", _is_reply, args.events, args.concurrency, args.timeout)
+        if "audio" in scenarios:
+            fname = None
+            for _, kind, key, data in list(line.received):
+                for m in data.get("messages") or []:
+                    if m.get("type") == "audio":
+                        fname = m["originalContentUrl"].rsplit("/", 1)[-1]
+            if fname is None:
+                # ไม่ได้รัน tts: ทำไฟล์ 1 ไฟล์ก่อน
+                run_webhook_scenario(bots, line, lambda i: f"เสียง ไฟล์ทดสอบ {run_id}", _is_audio_push,
+                                     1, 1, args.timeout)
+                for _, kind, key, data in list(line.received):
+                    for m in data.get("messages") or []:
+                        if m.get("type") == "audio":
+                            fname = m["originalContentUrl"].rsplit("/", 1)[-1]
+            if fname:
+                # instance สุดท้าย: ถ้าไฟล์ถูกทำที่ instance อื่นจะต้องดึงจาก store
+                results["audio"] = run_audio(f"{bots[-1].url}/audio/{fname}", args.concurrency, args.audio_requests)
+
+        peak_rss = max((bot.peak_rss_kb() or 0) for bot in bots) or None
+    finally:
+        for bot in bots:
+            bot.stop()
+        for srv in (minimax, sheet, line, store):
+            if srv is not None:
+                srv.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    try:
+        rev = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except Exception:
+        rev = None
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_rev": rev,
+        "config": {
+            "server": args.server,
+            "instances": args.instances,
+            "events": args.events,
+            "concurrency": args.concurrency,
+            "minimax_latency": args.minimax_latency,
+            "minimax_error_rate": args.minimax_error_rate,
+            "minimax_slow_rate": args.minimax_slow_rate,
+            "audio_bytes": args.audio_bytes,
+            "sheet_latency": args.sheet_latency,
+            "sheet_rows": args.sheet_rows,
+            "line_latency": args.line_latency,
+            "env": extra_env,
+        },
+        "bot_peak_rss_kb": peak_rss,
+        "fake_calls": {"minimax_t2a": minimax.t2a_calls, "minimax_t2a_errors": minimax.t2a_errors, "sheet": sheet.requests, "line": line.requests,
+                       "object_store": store.requests if store is not None else 0},
+        "scenarios": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
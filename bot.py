@@ -1,19 +1,43 @@
 import os
 import time
+import asyncio
+import contextvars
 import uuid
 import threading
+import functools
+import bisect
+import math
+import random
+import sys
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as futures_wait
+from concurrent.futures import TimeoutError as FutureTimeout
+import queue
+import atexit
 import json  # ✅ LOCK: เพิ่ม
+import hashlib
+import fcntl
+import hmac
 import re
+import unicodedata
 import csv
 import io
-from datetime import datetime
+import sqlite3
+import socket
+from collections import Counter as _FrameCounter, OrderedDict, deque
+from datetime import date, datetime, timedelta, timezone
 
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
 from flask import Flask, request, abort, send_file, Response  # ✅ เพิ่ม Response
 
 from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
+from linebot.exceptions import InvalidSignatureError, LineBotApiError
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+from linebot.models.error import Error as LineError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage, AudioSendMessage  # ✅ เพิ่ม
+from linebot.models import UnfollowEvent, LeaveEvent
 
 app = Flask(__name__)
 
@@ -26,6 +50,10 @@ CHANNEL_SECRET = os.getenv("LINE_CHANNEL_SECRET", "")
 BASE_URL = os.getenv("BASE_URL", "").rstrip("/")  # เช่น https://pea-linebot.onrender.com
 MINIMAX_API_KEY = os.getenv("MINIMAX_API_KEY", "")
 
+# ✅ เพิ่ม: เปลี่ยนปลายทาง API ได้ (ใช้กับ server จำลองใน bench/ ตอน load test)
+MINIMAX_BASE_URL = os.getenv("MINIMAX_BASE_URL", "https://api.minimax.io").rstrip("/")
+LINE_API_ENDPOINT = os.getenv("LINE_API_ENDPOINT", "https://api.line.me").rstrip("/")
+
 # =======================
 # ✅ Admin / Limits (เพิ่มตามที่ขอ)
 # =======================
@@ -33,11 +61,31 @@ MINIMAX_API_KEY = os.getenv("MINIMAX_API_KEY", "")
 ADMIN_USER_IDS = set([u.strip() for u in os.getenv("ADMIN_USER_IDS", "").split(",") if u.strip()])
 
 # จำกัดความยาวข้อความ TTS
-MAX_TTS_CHARS = int(os.getenv("MAX_TTS_CHARS", "1200"))
+# ✅ แก้: ข้อความยาวจะแบ่งเป็นท่อนๆ ทำเสียงพร้อมกัน เลยเพิ่มค่าเริ่มต้นจาก 1200
+MAX_TTS_CHARS = int(os.getenv("MAX_TTS_CHARS", "4000"))
+# ข้อความยาวกว่านี้แบ่งท่อน (ตัดตามบรรทัด/ประโยค/ช่องว่าง) แล้วเรียก MiniMax พร้อมกัน
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "500"))
 
 # อายุไฟล์เสียงที่เก็บไว้ (วินาที) ค่าเริ่มต้น 6 ชั่วโมง
 AUDIO_MAX_AGE_SEC = int(os.getenv("AUDIO_MAX_AGE_SEC", str(6 * 3600)))
 
+# ✅ เพิ่ม: จำนวน thread ทำงานเบื้องหลัง
+# TTS_WORKERS = จำนวนงานที่เรียก MiniMax พร้อมกันได้, WEBHOOK_WORKERS = thread ที่จัดการ event จาก LINE
+TTS_WORKERS = max(1, int(os.getenv("TTS_WORKERS", "2")))
+WEBHOOK_WORKERS = max(1, int(os.getenv("WEBHOOK_WORKERS", "2")))
+# TTS_CHUNK_WORKERS = จำนวนท่อนที่ทำเสียงพร้อมกัน (ใช้ร่วมกันทุกงาน)
+TTS_CHUNK_WORKERS = max(1, int(os.getenv("TTS_CHUNK_WORKERS", "3")))
+
+# ✅ NEW: IO_MODE = threads (ค่าเดิม: requests บน worker thread) หรือ asyncio (aiohttp บน event loop เดียว)
+# โหมด asyncio: งานทำเสียงไม่กิน thread, ASYNC_TTS_MAX_INFLIGHT = งานที่ค้างพร้อมกันได้, ASYNC_HTTP_LIMIT = connection สูงสุด
+IO_MODE = os.getenv("IO_MODE", "threads").strip().lower()
+ASYNC_MODE = IO_MODE == "asyncio"
+ASYNC_TTS_MAX_INFLIGHT = max(1, int(os.getenv("ASYNC_TTS_MAX_INFLIGHT", "500")))
+ASYNC_HTTP_LIMIT = max(1, int(os.getenv("ASYNC_HTTP_LIMIT", "200")))
+
+# ✅ เพิ่ม: ขนาดรวมสูงสุดของไฟล์เสียงใน AUDIO_DIR (byte) ค่าเริ่มต้น 300MB, 0 = ไม่จำกัด
+AUDIO_MAX_TOTAL_BYTES = int(os.getenv("AUDIO_MAX_TOTAL_BYTES", str(300 * 1024 * 1024)))
+
 # =======================
 # ✅ NEW: Google Sheet CSV (สำหรับคำสั่ง "ดับไฟ")
 # =======================
@@ -71,41 +119,1073 @@ def build_https_url(base_url: str, path: str) -> str:
     return b + p
 
 
+# =======================
+# ✅ NEW: Metrics (Prometheus text format ที่ /metrics)
+# =======================
+# เก็บค่าแยกต่อ thread (shard) ไม่ต้อง lock ตอนบันทึก รวมกันตอนมีคนขอ /metrics เท่านั้น
+# shard ของ thread ที่จบไปแล้วจะถูกรวมเข้า "retired" ตอน scrape
+_metrics_lock = threading.Lock()
+_metrics_all = []
+
+# ขอบ bucket (วินาที) สำหรับ latency
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, label: str = ""):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self._local = threading.local()
+        self._shards = []  # [(thread, shard)]
+        self._retired = {}
+        with _metrics_lock:
+            _metrics_all.append(self)
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with _metrics_lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _new_cell(self) -> list:
+        """cell = list ของตัวเลขต่อ label (ค่าเริ่มต้น: ค่าเดียว) subclass ที่เก็บหลายค่า override ตรงนี้"""
+        return [0]
+
+    def _merge(self, into: list, cell: list) -> None:
+        for i, v in enumerate(cell):
+            into[i] += v
+
+    def _collect(self) -> dict:
+        """รวมทุก shard -> {label_value: cell}"""
+        with _metrics_lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    for lv, cell in list(shard.items()):
+                        self._merge(self._retired.setdefault(lv, self._new_cell()), cell)
+            self._shards = alive
+            shards = [shard for _, shard in alive]
+            total = {}
+            for lv, cell in self._retired.items():
+                self._merge(total.setdefault(lv, self._new_cell()), cell)
+        for shard in shards:
+            for lv, cell in list(shard.items()):
+                self._merge(total.setdefault(lv, self._new_cell()), cell)
+        return total
+
+    def _labels(self, lv: str, extra: str = "") -> str:
+        parts = []
+        if self.label:
+            parts.append(f'{self.label}="{lv}"')
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> list:
+        return [f"{self.name}{self._labels(lv)} {cell[0]}" for lv, cell in sorted(self._collect().items())]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, label_value: str = "", n: int = 1) -> None:
+        shard = self._shard()
+        cell = shard.get(label_value)
+        if cell is None:
+            cell = shard[label_value] = self._new_cell()
+        cell[0] += n
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label: str = "", buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, label_value: str = "") -> None:
+        shard = self._shard()
+        cell = shard.get(label_value)
+        if cell is None:
+            cell = shard[label_value] = self._new_cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def _new_cell(self) -> list:
+        # [count ต่อ bucket..., +Inf, sum]
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def render(self) -> list:
+        lines = []
+        for lv, cell in sorted(self._collect().items()):
+            acc = 0
+            for bound, n in zip(self.buckets, cell):
+                acc += n
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{self._labels(lv, le)} {acc}")
+            acc += cell[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{self._labels(lv, le)} {acc}")
+            lines.append(f"{self.name}_sum{self._labels(lv)} {cell[-1]:.6f}")
+            lines.append(f"{self.name}_count{self._labels(lv)} {acc}")
+        return lines
+
+
+def timed(hist: Histogram, label_value: str = ""):
+    """decorator จับเวลาฟังก์ชันลง histogram"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    hist.observe(time.perf_counter() - t0, label_value)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - t0, label_value)
+        return wrapper
+    return decorator
+
+
+H_CALLBACK = Histogram("pea_callback_seconds", "เวลาจัดการ /callback")
+H_MINIMAX_T2A = Histogram("pea_minimax_t2a_seconds", "เวลาเรียก MiniMax t2a_v2", "mode")
+H_SHEET_FETCH = Histogram("pea_sheet_fetch_seconds", "เวลาโหลด Google Sheet CSV")
+H_LINE_API = Histogram("pea_line_api_seconds", "เวลาเรียก LINE reply/push", "call")
+H_AUDIO_SERVE = Histogram("pea_audio_serve_seconds", "เวลาส่งไฟล์ /audio")
+C_COMMANDS = Counter("pea_commands_total", "จำนวนคำสั่งแยกตามชนิด", "command")
+C_ERRORS = Counter("pea_errors_total", "จำนวน error แยกตามชนิด exception", "type")
+
+# gauge: คำนวณตอน scrape (name, help, ฟังก์ชันคืนค่า) ลงทะเบียนเพิ่มด้วย register_gauge
+_gauges = []
+
+
+def register_gauge(name: str, help_text: str, func) -> None:
+    _gauges.append((name, help_text, func))
+
+
+def count_error(e: BaseException) -> None:
+    C_ERRORS.inc(e.__class__.__name__)
+
+
+def render_metrics() -> str:
+    lines = []
+    with _metrics_lock:
+        metrics = list(_metrics_all)
+    for m in metrics:
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        lines += m.render()
+    for name, help_text, func in _gauges:
+        try:
+            value = func()
+        except Exception:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# =======================
+# ✅ NEW: Tracing ต่อ event (callback -> handle_message -> tts_background_job)
+# =======================
+# event ที่ใช้เวลารวมเกิน TRACE_SLOW_MS จะถูกเขียนเป็น JSON 1 บรรทัดลง TRACE_LOG_PATH ("-" = stdout)
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "3000"))
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "-")
+
+# ContextVar: แยกกันทั้งต่อ thread และต่อ asyncio task (โหมด IO_MODE=asyncio)
+_current_traces = contextvars.ContextVar("pea_traces", default=())
+_trace_log_lock = threading.Lock()
+
+
+class Trace:
+    """span ของ event เดียว (อาจข้ามหลาย thread) จบเมื่อทุกคนที่ hold ไว้ release ครบ"""
+
+    def __init__(self, event_id: str = "", t0: float = None):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.event_id = event_id
+        self.command = ""
+        self.t0 = t0 if t0 is not None else time.perf_counter()
+        self.mark = self.t0
+        self.spans = []
+        self.pending = 1
+        self.lock = threading.Lock()
+
+    def add(self, name: str, start: float, end: float) -> None:
+        with self.lock:
+            self.spans.append((name, start, end, threading.current_thread().name))
+
+    def hold(self) -> None:
+        with self.lock:
+            self.pending += 1
+
+    def release(self) -> None:
+        with self.lock:
+            self.pending -= 1
+            done = self.pending == 0
+        if done:
+            self._finish()
+
+    def _finish(self) -> None:
+        end = max([self.t0] + [sp[2] for sp in self.spans])
+        total_ms = (end - self.t0) * 1000
+        if total_ms < TRACE_SLOW_MS:
+            return
+        record = {
+            "ts": time.time(),
+            "trace_id": self.trace_id,
+            "event_id": self.event_id,
+            "command": self.command,
+            "total_ms": round(total_ms, 2),
+            "spans": [
+                {"name": name, "start_ms": round((a - self.t0) * 1000, 2),
+                 "ms": round((b - a) * 1000, 2), "thread": thread}
+                for name, a, b, thread in sorted(self.spans, key=lambda sp: sp[1])
+            ],
+        }
+        line = json.dumps(record, ensure_ascii=False)
+        with _trace_log_lock:
+            if TRACE_LOG_PATH == "-":
+                print(line, flush=True)
+            else:
+                with open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+
+
+def current_traces() -> tuple:
+    return _current_traces.get()
+
+
+@contextmanager
+def use_traces(traces):
+    """ให้ span() ใน thread / task นี้บันทึกลง traces ที่ให้มา"""
+    token = _current_traces.set(tuple(traces))
+    try:
+        yield
+    finally:
+        _current_traces.reset(token)
+
+
+@contextmanager
+def span(name: str):
+    traces = current_traces()
+    if not traces:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        t1 = time.perf_counter()
+        for tr in traces:
+            tr.add(name, t0, t1)
+
+
+def trace_command(command: str) -> None:
+    for tr in current_traces():
+        tr.command = command
+
+
+# =======================
+# ✅ NEW: Sampling profiler (สั่งได้เฉพาะแอดมิน)
+# =======================
+# /debug/profile?seconds=N&token=PROFILE_TOKEN หรือ /profile N ใน LINE (แอดมิน)
+# ผลเป็น folded stacks ("thread;frame;frame count") ใช้กับ flamegraph.pl / speedscope ได้เลย
+# ผลของ /profile ใน LINE ดูที่ /debug/profile/<id>?token=... (token สุ่มต่อผล แนบไปกับลิงก์ที่ส่งให้)
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_MAX_SEC = int(os.getenv("PROFILE_MAX_SEC", "60"))
+PROFILE_INTERVAL_SEC = float(os.getenv("PROFILE_INTERVAL_SEC", "0.005"))
+
+_profile_lock = threading.Lock()  # จับได้ทีละ 1 profile
+_profile_results_lock = threading.Lock()
+_profile_results = OrderedDict()  # profile_id -> (token, folded stacks)
+
+
+def sample_profile(seconds: float) -> str:
+    """สุ่ม stack ทุก thread ทุก PROFILE_INTERVAL_SEC เป็นเวลา seconds วินาที (ทีละ 1 profile)"""
+    seconds = max(1.0, min(float(seconds), PROFILE_MAX_SEC))
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("มี profile กำลังทำงานอยู่")
+    try:
+        me = threading.get_ident()
+        names = {}
+        stacks = _FrameCounter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for t in threading.enumerate():
+                names[t.ident] = t.name
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                parts = []
+                while frame is not None:
+                    code = frame.f_code
+                    parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                parts.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(parts))] += 1
+            time.sleep(PROFILE_INTERVAL_SEC)
+        return "\n".join(f"{stack} {n}" for stack, n in stacks.most_common()) + "\n"
+    finally:
+        _profile_lock.release()
+
+
+def store_profile(folded: str) -> tuple:
+    """เก็บผลไว้ดูทีหลัง คืน (profile_id, token) ลิงก์ผลต้องแนบ token นี้ (หรือ PROFILE_TOKEN)"""
+    profile_id = uuid.uuid4().hex
+    token = uuid.uuid4().hex
+    with _profile_results_lock:
+        _profile_results[profile_id] = (token, folded)
+        while len(_profile_results) > 5:
+            _profile_results.popitem(last=False)
+    return profile_id, token
+
+
+# =======================
+# ✅ NEW: HTTP sessions (ใช้ connection ซ้ำต่อ host ไม่ต้อง TCP+TLS ใหม่ทุกครั้ง)
+# =======================
+# ขนาด pool ต่อ host: พอสำหรับ TTS worker + chunk worker + webhook worker + งานเบื้องหลังอื่นๆ
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", str(TTS_WORKERS + TTS_CHUNK_WORKERS + WEBHOOK_WORKERS + 4)))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+
+# (connect, read) timeout แยกตาม endpoint
+HTTP_TIMEOUTS = {
+    "minimax_t2a": (HTTP_CONNECT_TIMEOUT, 120),
+    "minimax_voices": (HTTP_CONNECT_TIMEOUT, 60),
+    "minimax_balance": (HTTP_CONNECT_TIMEOUT, 10),
+    "sheet": (HTTP_CONNECT_TIMEOUT, 20),
+    "line": (HTTP_CONNECT_TIMEOUT, 30),
+    "storage": (HTTP_CONNECT_TIMEOUT, 30),
+}
+
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+
+
+def http_session(name: str) -> requests.Session:
+    """
+    Session ต่อ host (minimax / sheets / line) ใช้ร่วมกันทุก thread
+    ห้ามแก้ state ของ session (headers/cookies) ตอนใช้งาน ให้ส่ง headers ต่อ request แทน
+    """
+    sess = _http_sessions.get(name)
+    if sess is not None:
+        return sess
+    with _http_sessions_lock:
+        sess = _http_sessions.get(name)
+        if sess is None:
+            sess = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_MAXSIZE, pool_block=False)
+            sess.mount("https://", adapter)
+            sess.mount("http://", adapter)
+            _http_sessions[name] = sess
+        return sess
+
+
+def http_pool_stats() -> dict:
+    """จำนวน request / connection ที่เปิดใหม่ ต่อ session (reuse = 1 - connections/requests)"""
+    out = {}
+    with _http_sessions_lock:
+        items = list(_http_sessions.items())
+    for name, sess in items:
+        n_req = n_conn = 0
+        for adapter in set(sess.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                n_req += pool.num_requests
+                n_conn += pool.num_connections
+        out[name] = {
+            "requests": n_req,
+            "connections": n_conn,
+            "reuse": round(1 - n_conn / n_req, 3) if n_req else 0.0,
+        }
+    return out
+
+
+class PooledLineHttpClient(RequestsHttpClient):
+    """HttpClient ของ line-bot-sdk ที่ใช้ session ร่วม แทน requests.get/post แบบเปิด connection ใหม่"""
+
+    def __init__(self, timeout=None):
+        # LineBotApi ส่ง timeout=5 มาเสมอ ใช้ค่าของ endpoint "line" แทน
+        super().__init__(timeout=HTTP_TIMEOUTS["line"])
+
+    def _request(self, method, url, timeout=None, **kwargs):
+        response = http_session("line").request(method, url, timeout=timeout or self.timeout, **kwargs)
+        return RequestsHttpResponse(response)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._request("GET", url, headers=headers, params=params, stream=stream, timeout=timeout)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._request("POST", url, headers=headers, data=data, timeout=timeout)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._request("DELETE", url, headers=headers, data=data, timeout=timeout)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._request("PUT", url, headers=headers, data=data, timeout=timeout)
+
+
 # =======================
 # LINE
 # =======================
-line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN)
+line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN, endpoint=LINE_API_ENDPOINT, http_client=PooledLineHttpClient)
 handler = WebhookHandler(CHANNEL_SECRET)
 
+
+def push_message(to: str, messages: list, retry_key: str = None) -> None:
+    """
+    แทน line_bot_api.push_message(retry_key=...) ที่เก็บ X-Line-Retry-Key ไว้ใน line_bot_api.headers
+    (key ค้างไปกับทุก call หลังจากนั้น + แย่งกันข้าม thread) ที่นี่ส่ง header ต่อ request
+    """
+    data = {"to": to, "messages": [m.as_json_dict() for m in messages], "notificationDisabled": False}
+    headers = {"Content-Type": "application/json"}
+    if retry_key:
+        headers["X-Line-Retry-Key"] = retry_key
+    line_bot_api._post("/v2/bot/message/push", data=json.dumps(data), headers=headers)
+
+
+def multicast_message(to: list, messages: list, retry_key: str = None) -> None:
+    """multicast ได้ครั้งละไม่เกิน LINE_MULTICAST_MAX_TO userId (ส่ง retry key ต่อ request เหมือน push_message)"""
+    data = {"to": list(to), "messages": [m.as_json_dict() for m in messages], "notificationDisabled": False}
+    headers = {"Content-Type": "application/json"}
+    if retry_key:
+        headers["X-Line-Retry-Key"] = retry_key
+    line_bot_api._post("/v2/bot/message/multicast", data=json.dumps(data), headers=headers)
+
+
+def broadcast_message(messages: list, retry_key: str = None) -> None:
+    data = {"messages": [m.as_json_dict() for m in messages], "notificationDisabled": False}
+    headers = {"Content-Type": "application/json"}
+    if retry_key:
+        headers["X-Line-Retry-Key"] = retry_key
+    line_bot_api._post("/v2/bot/message/broadcast", data=json.dumps(data), headers=headers)
+
 # =======================
 # Storage (Render: /tmp)
 # =======================
-AUDIO_DIR = "/tmp/audio"
+AUDIO_DIR = os.getenv("AUDIO_DIR", "/tmp/audio")
 os.makedirs(AUDIO_DIR, exist_ok=True)
+# ชื่อไฟล์เสียงที่ /audio และ /play ยอมเสิร์ฟ: sha256 ของ payload + .mp3 เท่านั้น
+AUDIO_NAME_RE = re.compile(r"[0-9a-f]{64}\.mp3")
 
 
 # =======================
-# ✅ เพิ่ม: ลบไฟล์ mp3 เก่าอัตโนมัติ (กันดิสก์เต็ม)
+# ✅ NEW: Shared storage (หลาย instance ใช้ไฟล์เสียง / settings ร่วมกัน)
 # =======================
-def cleanup_old_audio(max_age_sec: int = 6 * 3600):
-    """ลบไฟล์ mp3 ที่เก่ากว่า max_age_sec"""
+# STORAGE_BACKEND:
+#   local (ค่าเดิม) = ไฟล์เสียงและ settings อยู่ในเครื่องนี้เท่านั้น
+#   dir   = โฟลเดอร์ที่ทุก instance mount ร่วมกัน (STORAGE_DIR)
+#   http  = object store แบบ GET/PUT/HEAD/DELETE ต่อ key (STORAGE_URL + STORAGE_TOKEN)
+#           ต้องรองรับ If-None-Match: * / If-Match (conditional PUT) ใช้ทำ lease
+#           ทดสอบในเครื่องได้ด้วย FakeObjectStore ใน bench/fakes.py
+# AUDIO_DIR ยังเป็น cache ในเครื่อง (serve เร็ว + janitor) ไฟล์ที่ไม่มีในเครื่องดึงจาก store มาเก็บไว้
+# งานทำเสียงข้อความเดียวกันจากหลาย instance: ใครได้ lease ก่อนทำ ที่เหลือรอไฟล์ขึ้น store
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").strip().lower()
+STORAGE_DIR = os.getenv("STORAGE_DIR", "")
+STORAGE_URL = os.getenv("STORAGE_URL", "").rstrip("/")
+STORAGE_TOKEN = os.getenv("STORAGE_TOKEN", "")
+# lease ต้องนานกว่าเวลาทำเสียง 1 งาน (timeout MiniMax 120 วินาที)
+STORAGE_LEASE_SEC = int(os.getenv("STORAGE_LEASE_SEC", "180"))
+STORAGE_POLL_SEC = float(os.getenv("STORAGE_POLL_SEC", "0.5"))
+
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _lease_body(owner: str, ttl: int) -> bytes:
+    return json.dumps({"owner": owner, "expires": time.time() + ttl}).encode("utf-8")
+
+
+def _lease_expired(raw: bytes, age_sec: float = None, ttl: int = 0) -> bool:
+    """
+    lease อ่านไม่ออก/ว่าง ถือว่ายังมีคนถืออยู่จนกว่าจะเก่ากว่า ttl
+    (ไม่รู้อายุ age_sec=None ถือว่าหมดอายุแล้ว)
+    """
     try:
-        now = time.time()
-        for fn in os.listdir(AUDIO_DIR):
-            if not fn.lower().endswith(".mp3"):
-                continue
-            fp = os.path.join(AUDIO_DIR, fn)
-            if not os.path.isfile(fp):
-                continue
+        return float(json.loads(raw).get("expires", 0)) < time.time()
+    except (ValueError, TypeError, AttributeError):
+        return age_sec is None or age_sec > ttl
+
+
+def _lease_owner(raw: bytes) -> str:
+    try:
+        return json.loads(raw or b"{}").get("owner", "")
+    except (ValueError, AttributeError):
+        return ""
+
+
+class DirStore:
+    """store บนโฟลเดอร์ร่วม (NFS / volume ที่ mount ทุก instance)"""
+
+    name = "dir"
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.join(self.root, *key.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def get(self, key: str):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def version(self, key: str):
+        try:
+            st = os.stat(self._path(key))
+            return f"{st.st_ino}:{st.st_mtime_ns}:{st.st_size}"
+        except OSError:
+            return None
+
+    def claim(self, key: str, owner: str, ttl: int) -> bool:
+        """
+        เขียน lease ลงไฟล์ชั่วคราวให้ครบก่อน แล้ว os.link เข้าที่ (มีไฟล์อยู่แล้ว link ไม่ได้ = ได้คนเดียว
+        และไม่มีใครเห็น lease ว่าง) lease หมดอายุ: os.replace ทับ แล้วอ่านซ้ำว่าเป็นของเราจริง
+        """
+        path = self._path(key)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_lease_body(owner, ttl))
+        try:
+            for _ in range(2):
+                try:
+                    os.link(tmp, path)
+                    return True
+                except FileExistsError:
+                    pass
+                try:
+                    age = time.time() - os.stat(path).st_mtime
+                except FileNotFoundError:
+                    # เพิ่งถูกปล่อย ลอง link ใหม่
+                    continue
+                if not _lease_expired(self.get(key), age, ttl):
+                    return False
+                # ยึด lease ที่หมดอายุ: แข่งกัน replace ได้หลายคน คนที่ replace ทีหลังสุดเป็นเจ้าของ
+                os.replace(tmp, path)
+                return _lease_owner(self.get(key)) == owner
+            return False
+        finally:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+
+    def release(self, key: str, owner: str) -> None:
+        if _lease_owner(self.get(key)) == owner:
+            self.delete(key)
+
+    def prune(self, prefix: str, max_age_sec: int) -> int:
+        """ลบ object ใต้ prefix ที่เก่ากว่า max_age_sec (ทุก instance เรียกได้ ลบซ้ำไม่เป็นไร)"""
+        root = os.path.join(self.root, prefix)
+        cutoff = time.time() - max_age_sec
+        removed = 0
+        try:
+            names = os.listdir(root)
+        except FileNotFoundError:
+            return 0
+        for fn in names:
+            fp = os.path.join(root, fn)
             try:
-                if now - os.path.getmtime(fp) > max_age_sec:
+                if os.stat(fp).st_mtime < cutoff:
                     os.remove(fp)
-            except Exception:
+                    removed += 1
+            except OSError:
                 pass
+        return removed
+
+
+class HttpStore:
+    """object store ผ่าน HTTP: {STORAGE_URL}/{key} (ลบของเก่าให้ตั้ง lifecycle rule ที่ store)"""
+
+    name = "http"
+
+    def __init__(self, base_url: str, token: str = ""):
+        self.base_url = base_url
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+
+    def _request(self, method: str, key: str, headers=None, data=None):
+        return http_session("storage").request(
+            method, f"{self.base_url}/{key}", headers={**self.headers, **(headers or {})},
+            data=data, timeout=HTTP_TIMEOUTS["storage"],
+        )
+
+    def get(self, key: str):
+        r = self._request("GET", key)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return r.content
+
+    def put(self, key: str, data: bytes) -> None:
+        self._request("PUT", key, data=data).raise_for_status()
+
+    def exists(self, key: str) -> bool:
+        r = self._request("HEAD", key)
+        if r.status_code == 404:
+            return False
+        r.raise_for_status()
+        return True
+
+    def delete(self, key: str) -> None:
+        r = self._request("DELETE", key)
+        if r.status_code != 404:
+            r.raise_for_status()
+
+    def version(self, key: str):
+        r = self._request("HEAD", key)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return r.headers.get("ETag")
+
+    def claim(self, key: str, owner: str, ttl: int) -> bool:
+        r = self._request("PUT", key, headers={"If-None-Match": "*"}, data=_lease_body(owner, ttl))
+        if r.status_code != 412:
+            r.raise_for_status()
+            return True
+        # มี lease อยู่แล้ว: หมดอายุค่อยยึดต่อด้วย If-Match (ETag เดิม) กันแย่งกัน
+        r = self._request("GET", key)
+        if r.status_code == 404:
+            return False
+        r.raise_for_status()
+        if not _lease_expired(r.content) or not r.headers.get("ETag"):
+            return False
+        r = self._request("PUT", key, headers={"If-Match": r.headers["ETag"]}, data=_lease_body(owner, ttl))
+        if r.status_code == 412:
+            return False
+        r.raise_for_status()
+        return True
+
+    def release(self, key: str, owner: str) -> None:
+        r = self._request("GET", key)
+        if r.status_code == 200 and _lease_owner(r.content) == owner:
+            self._request("DELETE", key, headers={"If-Match": r.headers.get("ETag") or "*"})
+
+    def prune(self, prefix: str, max_age_sec: int) -> int:
+        return 0
+
+
+def _make_shared_store():
+    if STORAGE_BACKEND == "dir":
+        if not STORAGE_DIR:
+            raise RuntimeError("STORAGE_BACKEND=dir ต้องตั้ง STORAGE_DIR")
+        return DirStore(STORAGE_DIR)
+    if STORAGE_BACKEND == "http":
+        if not STORAGE_URL:
+            raise RuntimeError("STORAGE_BACKEND=http ต้องตั้ง STORAGE_URL")
+        return HttpStore(STORAGE_URL, STORAGE_TOKEN)
+    return None
+
+
+# None = local (ไม่มี store ร่วม)
+shared_store = _make_shared_store()
+
+
+# =======================
+# ✅ เพิ่ม: ลบไฟล์ mp3 เก่าอัตโนมัติ (กันดิสก์เต็ม)
+# =======================
+# ✅ NEW: ไม่ scan ทั้งโฟลเดอร์ทุกงานแล้ว ใช้ index (SQLite ข้าง AUDIO_DIR ใช้ร่วมกันทุก worker)
+# เก็บ ชื่อไฟล์ / ขนาด / เวลาใช้ล่าสุด -> หมดอายุ = ใช้ล่าสุด + AUDIO_MAX_AGE_SEC
+# janitor thread เดียวต่อ process ลบตามรอบ AUDIO_JANITOR_INTERVAL_SEC
+# (ลบแบบ DELETE ใน transaction ทำให้หลาย worker ไม่แย่งลบไฟล์เดียวกัน)
+# index (+ -wal/-shm) ต้องอยู่นอก AUDIO_DIR เพราะ /audio เสิร์ฟไฟล์ในโฟลเดอร์นั้น
+AUDIO_INDEX_PATH = os.getenv("AUDIO_INDEX_PATH", os.path.normpath(AUDIO_DIR) + ".index.sqlite3")
+os.makedirs(os.path.dirname(os.path.abspath(AUDIO_INDEX_PATH)), exist_ok=True)
+# index เดิมเคยอยู่ใน AUDIO_DIR: ลบทิ้ง (rescan สร้างใหม่จากไฟล์จริงได้)
+for _suffix in ("", "-wal", "-shm"):
+    try:
+        os.remove(os.path.join(AUDIO_DIR, ".audio_index.sqlite3" + _suffix))
+    except OSError:
+        pass
+AUDIO_JANITOR_INTERVAL_SEC = int(os.getenv("AUDIO_JANITOR_INTERVAL_SEC", "60"))
+# scan โฟลเดอร์เทียบกับ index (ไฟล์ที่ไม่มีใน index / index ที่ไม่มีไฟล์) ทุกกี่วินาที
+AUDIO_RESCAN_INTERVAL_SEC = int(os.getenv("AUDIO_RESCAN_INTERVAL_SEC", "3600"))
+
+_audio_index_local = threading.local()
+_audio_janitor_lock = threading.Lock()
+_audio_janitor = []
+
+
+def _audio_index_db() -> sqlite3.Connection:
+    conn = getattr(_audio_index_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(AUDIO_INDEX_PATH, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS audio_index ("
+            " fname TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS audio_index_last_used ON audio_index(last_used)")
+        _audio_index_local.conn = conn
+    return conn
+
+
+def audio_index_add(fname: str, size: int) -> None:
+    try:
+        _audio_index_db().execute(
+            "INSERT OR REPLACE INTO audio_index (fname, size, last_used) VALUES (?, ?, ?)",
+            (fname, size, time.time()),
+        )
+    except sqlite3.Error:
+        pass
+
+
+def audio_index_touch(fname: str) -> None:
+    try:
+        _audio_index_db().execute("UPDATE audio_index SET last_used = ? WHERE fname = ?", (time.time(), fname))
+    except sqlite3.Error:
+        pass
+
+
+def audio_index_usage() -> dict:
+    try:
+        n, total = _audio_index_db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM audio_index").fetchone()
+        return {"files": n, "bytes": total}
+    except sqlite3.Error:
+        return {"files": 0, "bytes": 0}
+
+
+def audio_index_rescan() -> None:
+    """เทียบ index กับไฟล์จริง: เพิ่มไฟล์ที่ไม่มีใน index, ลบ row ที่ไม่มีไฟล์, ลบ .tmp ค้าง"""
+    db = _audio_index_db()
+    known = {fn for (fn,) in db.execute("SELECT fname FROM audio_index")}
+    found = set()
+    now = time.time()
+    for fn in os.listdir(AUDIO_DIR):
+        fp = os.path.join(AUDIO_DIR, fn)
+        try:
+            st = os.stat(fp)
+        except OSError:
+            continue
+        if fn.endswith(".tmp"):
+            if now - st.st_mtime > 3600:
+                try:
+                    os.remove(fp)
+                except OSError:
+                    pass
+            continue
+        if not fn.lower().endswith(".mp3"):
+            continue
+        found.add(fn)
+        if fn not in known:
+            db.execute(
+                "INSERT OR IGNORE INTO audio_index (fname, size, last_used) VALUES (?, ?, ?)",
+                (fn, st.st_size, st.st_mtime),
+            )
+    gone = known - found
+    if gone:
+        db.executemany("DELETE FROM audio_index WHERE fname = ?", [(fn,) for fn in gone])
+
+
+def _evict_audio(fnames) -> None:
+    for fn in fnames:
+        try:
+            os.remove(os.path.join(AUDIO_DIR, fn))
+        except OSError:
+            pass
+        audio_delivery_forget(fn)
+    if fnames:
+        _tts_cache_count("evicted", len(fnames))
+
+
+def cleanup_old_audio(max_age_sec: int = 6 * 3600, max_total_bytes: int = 0):
+    """ลบไฟล์ mp3 ที่ไม่ได้ใช้นานกว่า max_age_sec และถ้าขนาดรวมเกิน max_total_bytes ลบไฟล์ที่ใช้ล่าสุดนานที่สุดก่อน"""
+    try:
+        db = _audio_index_db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            cutoff = time.time() - max_age_sec
+            victims = [fn for (fn,) in db.execute(
+                "SELECT fname FROM audio_index WHERE last_used < ?", (cutoff,))]
+            db.execute("DELETE FROM audio_index WHERE last_used < ?", (cutoff,))
+
+            # ✅ เพิ่ม: จำกัดขนาดรวม (LRU)
+            if max_total_bytes > 0:
+                (total,) = db.execute("SELECT COALESCE(SUM(size), 0) FROM audio_index").fetchone()
+                if total > max_total_bytes:
+                    for fn, size in db.execute(
+                            "SELECT fname, size FROM audio_index ORDER BY last_used").fetchall():
+                        if total <= max_total_bytes:
+                            break
+                        db.execute("DELETE FROM audio_index WHERE fname = ?", (fn,))
+                        victims.append(fn)
+                        total -= size
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        # ลบไฟล์หลัง commit แล้ว (row ถูก claim โดย process นี้คนเดียว)
+        _evict_audio(victims)
     except Exception:
         pass
 
 
+def _audio_janitor_loop():
+    last_rescan = 0.0
+    while True:
+        try:
+            if time.monotonic() - last_rescan >= AUDIO_RESCAN_INTERVAL_SEC or not last_rescan:
+                audio_index_rescan()
+                if shared_store is not None:
+                    shared_store.prune("audio", AUDIO_MAX_AGE_SEC)
+                last_rescan = time.monotonic()
+        except Exception:
+            pass
+        cleanup_old_audio(AUDIO_MAX_AGE_SEC, AUDIO_MAX_TOTAL_BYTES)
+        time.sleep(AUDIO_JANITOR_INTERVAL_SEC)
+
+
+def ensure_audio_janitor() -> None:
+    with _audio_janitor_lock:
+        if _audio_janitor:
+            return
+        t = threading.Thread(target=_audio_janitor_loop, name="audio-janitor", daemon=True)
+        t.start()
+        _audio_janitor.append(t)
+
+
+# =======================
+# ✅ NEW: MP3 frame parser (ความยาวเสียงจริง + ต่อไฟล์ระดับ frame)
+# =======================
+# bitrate (kbps) ตาม [MPEG1?][layer][index]
+_MP3_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# sample rate ตาม version bits (0=MPEG2.5, 2=MPEG2, 3=MPEG1)
+_MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+_duration_cache = OrderedDict()  # filename -> duration ms
+_duration_cache_lock = threading.Lock()
+
+
+def _mp3_frame_header(data, i):
+    """อ่าน header ที่ตำแหน่ง i คืน (ความยาว frame, จำนวน sample, sample rate) ไม่ใช่ frame คืน None"""
+    if i + 4 > len(data) or data[i] != 0xFF or (data[i + 1] & 0xE0) != 0xE0:
+        return None
+    version = (data[i + 1] >> 3) & 0x03
+    layer = 4 - ((data[i + 1] >> 1) & 0x03)
+    br_idx = data[i + 2] >> 4
+    sr_idx = (data[i + 2] >> 2) & 0x03
+    padding = (data[i + 2] >> 1) & 0x01
+    if version == 1 or layer == 4 or br_idx in (0, 15) or sr_idx == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = _MP3_BITRATES[(mpeg1, layer)][br_idx] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][sr_idx]
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    if layer == 2 or mpeg1:
+        return 144 * bitrate // sample_rate + padding, 1152, sample_rate
+    return 72 * bitrate // sample_rate + padding, 576, sample_rate
+
+
+def _mp3_skip_id3(data) -> int:
+    if len(data) >= 10 and data[:3] == b"ID3":
+        size = ((data[6] & 0x7F) << 21) | ((data[7] & 0x7F) << 14) | ((data[8] & 0x7F) << 7) | (data[9] & 0x7F)
+        footer = 10 if data[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def mp3_frames(data):
+    """
+    ไล่ frame ของ MP3: yield (start, length, samples, sample_rate)
+    ข้าม ID3v2 ด้านหน้า, ข้อมูลขยะระหว่าง frame, และ frame Xing/Info (header VBR ของ encoder)
+    """
+    i = _mp3_skip_id3(data)
+    end = len(data)
+    if end >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+    first = True
+    while i < end:
+        hdr = _mp3_frame_header(data, i)
+        # ต้องเจอ frame ถัดไปต่อกันพอดี (หรือจบไฟล์) กันเจอ 0xFF ในข้อมูลเสียงแล้วนึกว่าเป็น header
+        if hdr is None or hdr[0] < 4 or (i + hdr[0] < end and _mp3_frame_header(data, i + hdr[0]) is None):
+            i += 1
+            continue
+        length, samples, sample_rate = hdr
+        if first:
+            first = False
+            head = bytes(data[i:i + min(length, 64)])
+            if b"Xing" in head or b"Info" in head:
+                i += length
+                continue
+        yield i, length, samples, sample_rate
+        i += length
+
+
+def mp3_duration_ms(data) -> int:
+    total = 0.0
+    for _, _, samples, sample_rate in mp3_frames(data):
+        total += samples / sample_rate
+    return int(round(total * 1000))
+
+
+def mp3_concat(parts) -> bytes:
+    """ต่อ MP3 หลายไฟล์ด้วยการต่อ frame ตรงๆ (ตัด ID3/Xing ของแต่ละไฟล์ออก) ไม่ encode ใหม่"""
+    out = bytearray()
+    for data in parts:
+        for start, length, _, _ in mp3_frames(data):
+            out += data[start:start + length]
+    return bytes(out)
+
+
+def audio_duration_ms(fname: str, default: int = 30000) -> int:
+    """ความยาวไฟล์เสียงใน AUDIO_DIR (ms) อ่านจาก frame header จริง"""
+    with _duration_cache_lock:
+        ms = _duration_cache.get(fname)
+    if ms is not None:
+        return ms
+    try:
+        with open(os.path.join(AUDIO_DIR, fname), "rb") as f:
+            ms = mp3_duration_ms(f.read()) or default
+    except OSError:
+        return default
+    with _duration_cache_lock:
+        _duration_cache[fname] = ms
+        while len(_duration_cache) > 1024:
+            _duration_cache.popitem(last=False)
+    return ms
+
+
+# =======================
+# ✅ NEW: TTS audio cache (content-addressed)
+# =======================
+# ไฟล์เสียงตั้งชื่อตาม hash ของ payload ที่ส่งไป MiniMax (ข้อความ + voice_id + ค่าเสียงทั้งหมด)
+# ข้อความ/เสียง/ค่าเดิม = ไฟล์เดิม ไม่ต้องเรียก MiniMax ซ้ำ
+# อายุ/ขนาดของ cache ใช้ index + janitor ตัวเดียวกัน (AUDIO_MAX_AGE_SEC / AUDIO_MAX_TOTAL_BYTES)
+_tts_cache_lock = threading.Lock()
+_tts_cache_stats = {"hit": 0, "shared_hit": 0, "miss": 0, "evicted": 0}
+
+
+def _tts_cache_count(name: str, n: int = 1) -> None:
+    with _tts_cache_lock:
+        _tts_cache_stats[name] = _tts_cache_stats.get(name, 0) + n
+
+
+def tts_cache_stats() -> dict:
+    with _tts_cache_lock:
+        return dict(_tts_cache_stats)
+
+
+def tts_cache_key(payload: dict) -> str:
+    """hash ของ payload MiniMax (ไม่รวม field ที่ไม่กระทบเสียง เช่น stream)"""
+    data = {k: v for k, v in payload.items() if k not in ("stream", "stream_options")}
+    raw = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def tts_cache_lookup(key: str, record_miss: bool = True, record_hit: bool = True):
+    """
+    คืนชื่อไฟล์ถ้ามีใน cache ไม่มีคืน None (หมดอายุแล้ว janitor จะลบไฟล์ออกเอง)
+    record_hit=False: งานเบื้องหลัง (warm) ไม่นับเป็น hit ไม่ให้ hit ratio เพี้ยน
+    """
+    fname = f"{key}.mp3"
+    fpath = os.path.join(AUDIO_DIR, fname)
+    try:
+        st = os.stat(fpath)
+        if st.st_size > 0:
+            # touch ให้ไฟล์ที่ถูกใช้บ่อยอยู่นานขึ้น (LRU)
+            audio_index_touch(fname)
+            if record_hit:
+                _tts_cache_count("hit")
+            return fname
+    except OSError:
+        pass
+    # ✅ NEW: ไม่มีในเครื่อง ลองดึงจาก store ร่วม (instance อื่นทำไว้แล้ว)
+    if fetch_shared_audio(fname):
+        if record_hit:
+            _tts_cache_count("shared_hit")
+        return fname
+    if record_miss:
+        _tts_cache_count("miss")
+    return None
+
+
+def fetch_shared_audio(fname: str) -> bool:
+    """ดึงไฟล์เสียงจาก store ร่วมมาเก็บใน AUDIO_DIR คืน True ถ้าได้ไฟล์"""
+    if shared_store is None:
+        return False
+    try:
+        data = shared_store.get(f"audio/{fname}")
+    except Exception as e:
+        count_error(e)
+        return False
+    if not data:
+        return False
+    tts_cache_store(fname[:-len(".mp3")], data)
+    audio_index_add(fname, len(data))
+    return True
+
+
+def publish_shared_audio(fname: str) -> None:
+    """อัปโหลดไฟล์เสียงที่เพิ่งทำเสร็จขึ้น store ร่วม"""
+    if shared_store is None:
+        return
+    with open(os.path.join(AUDIO_DIR, fname), "rb") as f:
+        shared_store.put(f"audio/{fname}", f.read())
+
+
+def tts_cache_path(key: str) -> str:
+    return os.path.join(AUDIO_DIR, f"{key}.mp3")
+
+
+def tts_cache_store(key: str, mp3_bytes: bytes) -> str:
+    """เขียนไฟล์แบบ temp + rename กันคนอื่นเห็นไฟล์ครึ่งๆ"""
+    fpath = tts_cache_path(key)
+    tmp = f"{fpath}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(mp3_bytes)
+    os.replace(tmp, fpath)
+    return os.path.basename(fpath)
+
+
 # =======================
 # Thai date helpers
 # =======================
@@ -141,19 +1221,13 @@ def build_outage_template() -> str:
 # =======================
 # ✅ NEW: อ่าน Google Sheet CSV แล้วสร้างข้อความประกาศ
 # =======================
-def fetch_outages_from_sheet() -> list:
+def _parse_outage_csv(content: bytes) -> list:
     """
-    อ่าน CSV จาก Google Sheet ที่ publish แล้ว (SHEET_CSV_URL)
+    แปลง CSV จาก Google Sheet ที่ publish แล้ว (SHEET_CSV_URL โหลดผ่าน _refresh_outage_cache)
     คาดว่าหัวคอลัมน์: date, start, end, area, detail, status
     """
-    if not SHEET_CSV_URL:
-        return []
-
-    r = requests.get(SHEET_CSV_URL, timeout=20)
-    r.raise_for_status()
-
     # utf-8-sig กัน BOM
-    text = r.content.decode("utf-8-sig", errors="replace")
+    text = content.decode("utf-8-sig", errors="replace")
     reader = csv.DictReader(io.StringIO(text))
 
     rows = []
@@ -166,41 +1240,340 @@ def fetch_outages_from_sheet() -> list:
     return rows
 
 
-def build_outage_reply_from_sheet(rows: list) -> str:
-    # กรองเฉพาะ status=active
-    active = [r for r in rows if (r.get("status", "").strip().lower() == "active")]
+# =======================
+# ✅ NEW: ข้อมูลดับไฟแบบมี index (แปลงชีตครั้งเดียวต่อการ refresh)
+# =======================
+# LINE จำกัดข้อความละ 5000 ตัวอักษร เผื่อที่ไว้สำหรับหัว/ท้ายข้อความ
+OUTAGE_MSG_MAX_CHARS = min(4800, int(os.getenv("OUTAGE_MSG_MAX_CHARS", "4500")))
+# ใช้ตัดสินว่า "วันนี้/พรุ่งนี้" คือวันไหน (ค่าเริ่มต้นเวลาไทย UTC+7)
+OUTAGE_UTC_OFFSET_HOURS = float(os.getenv("OUTAGE_UTC_OFFSET_HOURS", "7"))
+
+THAI_WEEKDAYS = ["จันทร์", "อังคาร", "พุธ", "พฤหัสบดี", "ศุกร์", "เสาร์", "อาทิตย์"]
+_THAI_MONTH_LOOKUP = {name: i for i, name in enumerate(THAI_MONTHS) if name}
+_THAI_MONTH_LOOKUP.update({abbr: i + 1 for i, abbr in enumerate([
+    "ม.ค.", "ก.พ.", "มี.ค.", "เม.ย.", "พ.ค.", "มิ.ย.", "ก.ค.", "ส.ค.", "ก.ย.", "ต.ค.", "พ.ย.", "ธ.ค."])})
+_THAI_DIGITS = str.maketrans("๐๑๒๓๔๕๖๗๘๙", "0123456789")
 
-    if not active:
-        return "✅ ตอนนี้ไม่มีรายการดับไฟ (status=active) ใน Google Sheet"
 
-    # เรียงตาม date แล้ว start
-    active.sort(key=lambda r: (r.get("date", ""), r.get("start", "")))
+def outage_today() -> date:
+    return datetime.now(timezone(timedelta(hours=OUTAGE_UTC_OFFSET_HOURS))).date()
 
-    lines = ["📢 งานดับไฟแผนกปฏิบัติการ\n"]
-    current_date = None
 
-    for r in active:
-        d = r.get("date", "")
-        start = r.get("start", "")
-        end = r.get("end", "")
-        area = r.get("area", "")
-        detail = r.get("detail", "")
+def _outage_year(y: int) -> int:
+    """รับได้ทั้ง ค.ศ./พ.ศ. และปี 2 หลัก (เลือกแบบที่ใกล้ปีปัจจุบันที่สุด)"""
+    if y < 100:
+        now = outage_today().year
+        return min((2000 + y, 2500 + y - 543), key=lambda c: abs(c - now))
+    return y - 543 if y > 2400 else y
 
-        # คั่นวัน
-        if d != current_date:
-            if current_date is not None:
-                lines.append("******************************")
-            lines.append(f"📅 วันที่ {d}")
-            current_date = d
 
-        # รายละเอียดรายการ
-        lines.append(f"⏰ เวลา {start} - {end} น.")
+def parse_outage_date(raw: str):
+    """
+    แปลงวันที่ในชีตเป็น date รองรับ 2026-02-12, 12/2/2569, 12 ก.พ. 69,
+    วันพฤหัสบดีที่ 12 กุมภาพันธ์ 2569 (เลขไทยก็ได้) อ่านไม่ออกคืน None
+    """
+    s = unicodedata.normalize("NFC", raw or "").translate(_THAI_DIGITS).strip()
+    m = re.fullmatch(r"(\d{4})-(\d{1,2})-(\d{1,2})(?:[T ].*)?", s)
+    if m:
+        y, mo, d = int(m.group(1)), int(m.group(2)), int(m.group(3))
+    else:
+        m = re.fullmatch(r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{2,4})", s)
+        if m:
+            d, mo, y = int(m.group(1)), int(m.group(2)), int(m.group(3))
+        else:
+            m = re.search(r"(\d{1,2})\s*([^\d\s]+)\s*(\d{2,4})", s)
+            if not m or m.group(2) not in _THAI_MONTH_LOOKUP:
+                return None
+            d, mo, y = int(m.group(1)), _THAI_MONTH_LOOKUP[m.group(2)], int(m.group(3))
+    try:
+        return date(_outage_year(y), mo, d)
+    except ValueError:
+        return None
+
+
+def _outage_time_key(raw: str) -> str:
+    """"8.30" / "08:30" -> "08:30" ไว้เรียงเวลา"""
+    m = re.match(r"(\d{1,2})[:.](\d{2})", (raw or "").translate(_THAI_DIGITS))
+    return f"{int(m.group(1)):02d}:{m.group(2)}" if m else raw or ""
+
+
+def _outage_norm(text: str) -> str:
+    """ทำให้ค้นหาพื้นที่เทียบกันได้: NFC, ตัวพิมพ์เล็ก, ตัด zero-width, ยุบช่องว่าง"""
+    text = unicodedata.normalize("NFC", text or "").casefold().replace("\u200b", "")
+    return " ".join(text.split())
+
+
+def _outage_grams(text: str) -> set:
+    """trigram ของตัวอักษร (ภาษาไทยไม่เว้นวรรค จึงค้นแบบ substring ผ่าน trigram)"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class OutageRecord:
+    """แถวดับไฟที่แปลงแล้ว (เก็บเฉพาะที่ต้องใช้ตอบ)"""
+    __slots__ = ("row_id", "digest", "day", "date_label", "sort_key", "body", "search")
+
+    def __init__(self, row: dict):
+        raw_date = row.get("date", "")
+        start = row.get("start", "")
+        area = row.get("area", "")
+        self.day = parse_outage_date(raw_date)
+        # ตัวตนของแถว: คอลัมน์ id ถ้ามี ไม่งั้นใช้ วัน + เวลาเริ่ม + พื้นที่ (ใช้ diff หาแถวใหม่/เปลี่ยน)
+        self.row_id = row.get("id") or f"{self.day or raw_date}|{_outage_time_key(start)}|{_outage_norm(area)}"
+        fields = "\x1f".join(row.get(k, "") for k in ("date", "start", "end", "area", "detail"))
+        self.digest = hashlib.sha1(fields.encode("utf-8")).hexdigest()[:16]
+        if self.day is not None:
+            self.date_label = f"📅 วัน{THAI_WEEKDAYS[self.day.weekday()]}ที่ {thai_date(self.day)}"
+        else:
+            self.date_label = f"📅 วันที่ {raw_date}"
+        # วันที่อ่านไม่ออกไปอยู่ท้ายสุด
+        self.sort_key = (self.day is None, self.day or date.max, raw_date, _outage_time_key(start))
+
+        detail = row.get("detail", "")
+        lines = [f"⏰ เวลา {start} - {row.get('end', '')} น."]
         if area:
             lines.append(f"📍 {area}")
         if detail:
-            lines.append(f"{detail}")
+            lines.append(detail)
+        self.body = "\n".join(lines)
+        self.search = _outage_norm(f"{area} {detail}")
+
+
+class OutageIndex:
+    """
+    รายการดับไฟ (status=active) เรียงตามวัน/เวลา + index ตามวันและ trigram ของพื้นที่
+    สร้างครั้งเดียวตอนชีตเปลี่ยน แล้วใช้ตอบทุกคำถามจนกว่าจะ refresh รอบหน้า (ไม่แก้ไขหลังสร้าง)
+    """
+
+    def __init__(self, rows: list):
+        active = [r for r in rows if r.get("status", "").strip().lower() == "active"]
+        self.records = sorted((OutageRecord(r) for r in active), key=lambda rec: rec.sort_key)
+        self.by_date = {}
+        self.by_gram = {}
+        self.by_id = {}
+        for i, rec in enumerate(self.records):
+            if rec.row_id in self.by_id:
+                # แถวซ้ำ (วัน/เวลา/พื้นที่เดียวกัน) แยกด้วยลำดับ
+                n = 2
+                while f"{rec.row_id}#{n}" in self.by_id:
+                    n += 1
+                rec.row_id = f"{rec.row_id}#{n}"
+            self.by_id[rec.row_id] = rec
+            if rec.day is not None:
+                self.by_date.setdefault(rec.day, []).append(i)
+            for gram in _outage_grams(rec.search):
+                self.by_gram.setdefault(gram, []).append(i)
+        # ข้อความที่ render แล้วต่อคำถาม (index ไม่เปลี่ยน จึง cache ได้ตลอดอายุ)
+        self._rendered = OrderedDict()
+        self._rendered_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def on_date(self, day: date) -> list:
+        return [self.records[i] for i in self.by_date.get(day, ())]
+
+    def search(self, query: str) -> list:
+        """ทุกคำ (คั่นด้วยช่องว่าง) ต้องอยู่ในพื้นที่/รายละเอียด"""
+        words = _outage_norm(query).split()
+        if not words:
+            return []
+        candidates = None
+        for word in words:
+            for gram in _outage_grams(word):
+                ids = self.by_gram.get(gram)
+                if not ids:
+                    return []
+                candidates = set(ids) if candidates is None else candidates.intersection(ids)
+        ids = sorted(candidates) if candidates is not None else range(len(self.records))
+        return [self.records[i] for i in ids if all(w in self.records[i].search for w in words)]
+
+    def render(self, cache_key: str, title: str, records: list) -> list:
+        """แบ่งรายการเป็นข้อความละไม่เกิน OUTAGE_MSG_MAX_CHARS คืน list ของ str"""
+        with self._rendered_lock:
+            chunks = self._rendered.get(cache_key)
+            if chunks is not None:
+                self._rendered.move_to_end(cache_key)
+                return chunks
+
+        chunks = []
+        current = [title]
+        size = len(title)
+        current_date = None
+        for rec in records:
+            block = rec.body
+            if rec.date_label != current_date:
+                sep = "******************************\n" if current_date is not None else ""
+                block = f"{sep}{rec.date_label}\n{block}"
+            if size + len(block) + 1 > OUTAGE_MSG_MAX_CHARS and len(current) > 1:
+                chunks.append("\n".join(current))
+                # ขึ้นข้อความใหม่ให้บอกวันซ้ำ จะได้อ่านรู้เรื่อง
+                block = f"{rec.date_label} (ต่อ)\n{rec.body}"
+                current, size = [], 0
+            current.append(block)
+            size += len(block) + 1
+            current_date = rec.date_label
+        chunks.append("\n".join(current))
+
+        with self._rendered_lock:
+            self._rendered[cache_key] = chunks
+            while len(self._rendered) > 256:
+                self._rendered.popitem(last=False)
+        return chunks
+
+
+def select_outages(index: OutageIndex, query: str):
+    """เลือกรายการตาม query ("" | วันนี้ | พรุ่งนี้ | <วันที่> | <พื้นที่>) คืน (หัวข้อ, records)"""
+    if not query:
+        return "📢 งานดับไฟแผนกปฏิบัติการ\n", index.records
+    relative = {"วันนี้": 0, "พรุ่งนี้": 1}.get(query)
+    day = outage_today() + timedelta(days=relative) if relative is not None else parse_outage_date(query)
+    if day is not None:
+        label = f"{query} " if relative is not None else ""
+        return f"📢 งานดับไฟ {label}({thai_date(day)})\n", index.on_date(day)
+    records = index.search(query)
+    return f"📢 งานดับไฟ พื้นที่ \"{query}\" ({len(records)} รายการ)\n", records
+
+
+def outage_reply_messages(index: OutageIndex, query: str) -> list:
+    """
+    ตอบคำสั่ง "ดับไฟ [วันนี้|พรุ่งนี้|<วันที่>|<พื้นที่>] [หน้า N]" คืน list ของข้อความ
+    ส่งได้ครั้งละ LINE_MAX_MESSAGES_PER_CALL ข้อความ เกินนั้นแบ่งหน้า
+    """
+    page = 1
+    m = re.search(r"(?:^|\s)หน้า\s*(\d+)$", query)
+    if m:
+        page = max(1, int(m.group(1)))
+        query = query[:m.start()].strip()
+
+    if not index.records:
+        return ["✅ ตอนนี้ไม่มีรายการดับไฟ (status=active) ใน Google Sheet"]
+
+    title, records = select_outages(index, query)
+    if not records:
+        return [f"✅ ไม่พบรายการดับไฟ \"{query}\""]
+
+    # key ด้วยหัวข้อ (มีวันที่จริงอยู่แล้ว) ไม่ใช่ query: "วันนี้"/"พรุ่งนี้" ข้ามวันแล้วต้องได้รายการวันใหม่
+    chunks = index.render(title, title, records)
+    per_page = LINE_MAX_MESSAGES_PER_CALL
+    pages = max(1, math.ceil(len(chunks) / per_page))
+    page = min(page, pages)
+    messages = list(chunks[(page - 1) * per_page:page * per_page])
+    if pages > 1:
+        more = f"\n\n📄 หน้า {page}/{pages}"
+        if page < pages:
+            more += f" พิมพ์ \"ดับไฟ {query + ' ' if query else ''}หน้า {page + 1}\" เพื่อดูต่อ"
+        messages[-1] += more
+    return messages
+
+
+# =======================
+# ✅ NEW: Cache ข้อมูลดับไฟ (conditional GET + stale-while-revalidate)
+# =======================
+# ข้อมูลเก่ากว่านี้ (วินาที) จะ refresh เบื้องหลัง ระหว่างนั้นยังตอบด้วยข้อมูลชุดล่าสุดที่ดีอยู่
+SHEET_CACHE_TTL_SEC = int(os.getenv("SHEET_CACHE_TTL_SEC", "60"))
+
+_outage_lock = threading.Lock()
+_outage_cache = {
+    "index": None,         # OutageIndex ของชีตล่าสุดที่อ่านสำเร็จ
+    "etag": None,
+    "last_modified": None,
+    "fetched_at": 0.0,     # เวลาที่ยืนยันล่าสุดว่าข้อมูลยังใหม่ (200 หรือ 304)
+    "refreshing": False,
+    "last_error": None,
+}
 
-    return "\n".join(lines).strip()
+
+@timed(H_SHEET_FETCH)
+def _refresh_outage_cache() -> None:
+    """ดึงชีตแบบ conditional GET แล้วอัปเดต cache (พังก็เก็บ error ไว้ ไม่ทิ้งข้อมูลเดิม)"""
+    headers = _outage_conditional_headers()
+
+    try:
+        if not SHEET_CSV_URL:
+            rows, r = [], None
+        else:
+            r = http_session("sheets").get(SHEET_CSV_URL, headers=headers, timeout=HTTP_TIMEOUTS["sheet"])
+            if r.status_code == 304:
+                rows = None
+            else:
+                r.raise_for_status()
+                rows = _parse_outage_csv(r.content)
+
+        _store_outage_rows(rows, r.headers if r is not None else None)
+    except Exception as e:
+        _outage_refresh_failed(e)
+        raise
+    finally:
+        with _outage_lock:
+            _outage_cache["refreshing"] = False
+
+
+def _outage_conditional_headers() -> dict:
+    with _outage_lock:
+        headers = {}
+        if _outage_cache["etag"]:
+            headers["If-None-Match"] = _outage_cache["etag"]
+        if _outage_cache["last_modified"]:
+            headers["If-Modified-Since"] = _outage_cache["last_modified"]
+        return headers
+
+
+def _store_outage_rows(rows, resp_headers) -> None:
+    """rows=None คือ 304 (ข้อมูลเดิมยังใช้ได้)"""
+    index = OutageIndex(rows) if rows is not None else None
+    if index is not None:
+        # ✅ NEW: ชีตเปลี่ยน เตรียมเสียงรายการใหม่เบื้องหลัง
+        schedule_outage_warm(index)
+    with _outage_lock:
+        if index is not None:
+            _outage_cache["index"] = index
+            if resp_headers is not None:
+                _outage_cache["etag"] = resp_headers.get("ETag")
+                _outage_cache["last_modified"] = resp_headers.get("Last-Modified")
+        _outage_cache["fetched_at"] = time.time()
+        _outage_cache["last_error"] = None
+
+
+def _outage_refresh_failed(e: Exception) -> None:
+    count_error(e)
+    with _outage_lock:
+        _outage_cache["last_error"] = str(e)
+
+
+def _refresh_outage_cache_bg() -> None:
+    try:
+        _refresh_outage_cache()
+    except Exception:
+        pass
+
+
+def get_outage_index() -> OutageIndex:
+    """
+    คืน OutageIndex จาก cache
+    - ยังไม่เคยโหลด: โหลดทันที (พังจะ raise ให้คนเรียกใช้ข้อความสำรอง)
+    - เก่าเกิน TTL: ตอบข้อมูลเดิมไปก่อน แล้ว refresh เบื้องหลัง (ครั้งละ thread เดียว)
+    """
+    with _outage_lock:
+        index = _outage_cache["index"]
+        stale = time.time() - _outage_cache["fetched_at"] > SHEET_CACHE_TTL_SEC
+        start_bg = index is not None and stale and not _outage_cache["refreshing"]
+        if start_bg:
+            _outage_cache["refreshing"] = True
+
+    if index is None:
+        if ASYNC_MODE:
+            run_async(aio_refresh_outage_cache()).result()
+        else:
+            _refresh_outage_cache()
+        with _outage_lock:
+            return _outage_cache["index"]
+
+    if start_bg:
+        if ASYNC_MODE:
+            run_async(_aio_refresh_outage_cache_bg())
+        else:
+            threading.Thread(target=_refresh_outage_cache_bg, daemon=True).start()
+    return index
 
 
 # =======================
@@ -217,29 +1590,138 @@ DEFAULT_VOICE_ID = ENV_VOICE_ID if ENV_VOICE_ID else os.getenv(
 SETTINGS_PATH = os.getenv("SETTINGS_PATH", "/tmp/pea_tts_settings.json")
 _settings_lock = threading.Lock()
 
+# ✅ NEW: เก็บค่าไว้ใน memory แล้วเช็คไฟล์ (stat) อย่างมากทุกๆ SETTINGS_CHECK_SEC วินาที
+# ถ้า mtime/inode/size เปลี่ยน (worker อื่น /setvoice) ค่อยอ่านไฟล์ใหม่
+# gunicorn หลาย worker จะเห็นค่าใหม่ภายใน SETTINGS_CHECK_SEC วินาที
+SETTINGS_CHECK_SEC = float(os.getenv("SETTINGS_CHECK_SEC", "2"))
+_settings_cache = {"data": None, "sig": None, "checked_at": 0.0}
 
-def _load_settings() -> dict:
-    with _settings_lock:
-        if os.path.exists(SETTINGS_PATH):
-            try:
-                with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    # กันไฟล์พัง/ค่าว่าง
-                    vid = (data.get("voice_id") or "").strip()
-                    if vid:
-                        return {"voice_id": vid}
-            except Exception:
-                pass
+
+SHARED_SETTINGS_KEY = "settings.json"
+
+
+def _settings_file_sig():
+    # ✅ NEW: store ร่วม ใช้ ETag / mtime ของ object แทน
+    if shared_store is not None:
+        try:
+            return shared_store.version(SHARED_SETTINGS_KEY)
+        except Exception as e:
+            count_error(e)
+            return _settings_cache["sig"]
+    try:
+        st = os.stat(SETTINGS_PATH)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def _read_settings_file(fallback: bool = True) -> dict:
+    if shared_store is not None:
+        try:
+            data = json.loads(shared_store.get(SHARED_SETTINGS_KEY) or b"{}")
+            vid = (data.get("voice_id") or "").strip()
+            if vid:
+                data["voice_id"] = vid
+                return data
+        except Exception as e:
+            count_error(e)
+            # แก้ค่าจากค่าเก่าไม่ได้ (จะเขียนทับของ instance อื่น)
+            if not fallback:
+                raise
+            # อ่าน store ไม่ได้ ใช้ค่าเดิมใน memory ไปก่อน
+            if _settings_cache["data"] is not None:
+                return dict(_settings_cache["data"])
         return {"voice_id": DEFAULT_VOICE_ID}
 
+    if os.path.exists(SETTINGS_PATH):
+        try:
+            with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                # กันไฟล์พัง/ค่าว่าง
+                vid = (data.get("voice_id") or "").strip()
+                if vid:
+                    data["voice_id"] = vid
+                    return data
+        except Exception:
+            pass
+    return {"voice_id": DEFAULT_VOICE_ID}
+
 
-def _save_settings(data: dict) -> None:
+def _load_settings() -> dict:
     with _settings_lock:
+        now = time.monotonic()
+        cached = _settings_cache["data"]
+        if cached is not None and now - _settings_cache["checked_at"] < SETTINGS_CHECK_SEC:
+            return dict(cached)
+
+        sig = _settings_file_sig()
+        if cached is None or sig != _settings_cache["sig"]:
+            _settings_cache["data"] = _read_settings_file()
+            _settings_cache["sig"] = sig
+        _settings_cache["checked_at"] = now
+        return dict(_settings_cache["data"])
+
+
+def _write_settings(data: dict) -> None:
+    """เขียน settings (คนเรียกถือ _settings_lock + _settings_write_lock อยู่)"""
+    if shared_store is not None:
+        shared_store.put(SHARED_SETTINGS_KEY, json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8"))
+    else:
         parent = os.path.dirname(SETTINGS_PATH)
         if parent:
             os.makedirs(parent, exist_ok=True)
-        with open(SETTINGS_PATH, "w", encoding="utf-8") as f:
+        # ✅ NEW: เขียนไฟล์ temp แล้ว os.replace กันคนอ่านเจอไฟล์ครึ่งๆ
+        tmp = f"{SETTINGS_PATH}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, SETTINGS_PATH)
+
+    _settings_cache["data"] = dict(data)
+    _settings_cache["sig"] = _settings_file_sig()
+    _settings_cache["checked_at"] = time.monotonic()
+
+
+@contextmanager
+def _settings_write_lock():
+    """
+    กัน worker/instance อื่นแก้ settings พร้อมกัน (lock ใน process คือ _settings_lock)
+    store ร่วม: lease ใน store, ไฟล์ในเครื่อง: flock ที่ไฟล์ .lock ข้าง SETTINGS_PATH
+    """
+    if shared_store is not None:
+        lease = "leases/settings"
+        while not shared_store.claim(lease, INSTANCE_ID, 30):
+            time.sleep(STORAGE_POLL_SEC)
+        try:
+            yield
+        finally:
+            try:
+                shared_store.release(lease, INSTANCE_ID)
+            except Exception as e:
+                count_error(e)
+        return
+
+    parent = os.path.dirname(SETTINGS_PATH)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    with open(f"{SETTINGS_PATH}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _update_settings(change) -> None:
+    """
+    read-modify-write: อ่านไฟล์/store จริง (ไม่ใช้ cache ที่อาจเก่า) ให้ change(data) แก้
+    แล้วเขียนกลับภายใต้ lock เดียวกัน ค่าที่ worker อื่นเพิ่งตั้งจะไม่หาย
+    """
+    with _settings_lock, _settings_write_lock():
+        data = _read_settings_file(fallback=False)
+        change(data)
+        _write_settings(data)
 
 
 def get_voice_id() -> str:
@@ -247,9 +1729,28 @@ def get_voice_id() -> str:
 
 
 def set_voice_id(new_voice_id: str) -> None:
-    data = _load_settings()
-    data["voice_id"] = new_voice_id
-    _save_settings(data)
+    _update_settings(lambda data: data.update(voice_id=new_voice_id))
+    # ✅ NEW: เสียงประกาศดับไฟที่เตรียมไว้เป็นเสียงเก่า เตรียมใหม่ด้วยเสียงนี้
+    invalidate_outage_warm()
+
+
+# ✅ NEW: audio profile ต่อห้อง/ต่อคน (ไม่ตั้ง = DEFAULT_AUDIO_PROFILE)
+def get_audio_profile(target_id: str) -> str:
+    profiles = _load_settings().get("audio_profiles") or {}
+    return audio_profile_name(profiles.get(target_id))
+
+
+def set_audio_profile(target_id: str, profile: str = None) -> None:
+    """profile=None = กลับไปใช้ค่า default"""
+    def change(data: dict) -> None:
+        profiles = dict(data.get("audio_profiles") or {})
+        if profile is None:
+            profiles.pop(target_id, None)
+        else:
+            profiles[target_id] = profile
+        data["audio_profiles"] = profiles
+
+    _update_settings(change)
 
 
 # =======================
@@ -260,213 +1761,2773 @@ def home():
     return "OK", 200
 
 
+# =======================
+# ✅ NEW: Audio delivery (cache header + ETag + Range + hot files ใน memory)
+# =======================
+# ชื่อไฟล์เสียงเป็น hash ของ payload (ไม่เปลี่ยนเนื้อหา) ให้ browser/LINE/CDN cache ได้ยาวๆ
+AUDIO_CACHE_CONTROL = f"public, max-age={AUDIO_MAX_AGE_SEC}, immutable"
+# ไฟล์ที่ถูกขอบ่อยเก็บไว้ใน memory (LRU) 0 = ปิด, ไฟล์ใหญ่กว่า AUDIO_MEM_MAX_FILE ส่งจากดิสก์เสมอ
+# เข้า memory เมื่อถูกขอครั้งที่ 2 (ครั้งแรกจำแค่ชื่อ) ไล่เปิดไฟล์เก่าทีละไฟล์จะไม่เบียดไฟล์ฮิตออก
+AUDIO_MEM_CACHE_BYTES = int(os.getenv("AUDIO_MEM_CACHE_BYTES", str(32 * 1024 * 1024)))
+AUDIO_MEM_MAX_FILE = int(os.getenv("AUDIO_MEM_MAX_FILE", str(4 * 1024 * 1024)))
+PLAY_PAGE_CACHE_MAX = int(os.getenv("PLAY_PAGE_CACHE_MAX", "512"))
+AUDIO_MEM_SEEN_MAX = int(os.getenv("AUDIO_MEM_SEEN_MAX", "4096"))  # จำชื่อไฟล์ที่ถูกขอครั้งแรกได้กี่ไฟล์
+
+_audio_mem_lock = threading.Lock()
+_audio_mem = OrderedDict()  # filename -> (bytes, etag)
+_audio_mem_size = 0
+_audio_mem_seen = OrderedDict()  # ไฟล์ที่ถูกขอไปแล้ว 1 ครั้ง (จำแค่ชื่อ)
+_play_pages = OrderedDict()  # filename -> (etag ของไฟล์ตอน render, html)
+
+PLAY_PAGE_TEMPLATE = """<!doctype html>
+<html lang="th">
+<head>
+  <meta charset="utf-8" />
+  <meta name="viewport" content="width=device-width, initial-scale=1" />
+  <title>PEA Audio Loop</title>
+  <style>
+    body {{
+      margin: 0;
+      height: 100vh;
+      display: flex;
+      align-items: center;
+      justify-content: center;
+      background: #000;
+      color: #fff;
+      font-family: system-ui, -apple-system, Segoe UI, Roboto, sans-serif;
+    }}
+    .box {{ text-align: center; padding: 24px; }}
+    .title {{ font-size: 16px; opacity: .9; margin-bottom: 10px; }}
+    audio {{ width: min(92vw, 520px); }}
+    .hint {{ margin-top: 12px; font-size: 13px; opacity: .75; line-height: 1.4; }}
+    .links {{ margin-top: 12px; font-size: 13px; opacity: .85; }}
+    .links a {{ color: #7dd3fc; text-decoration: none; }}
+    .links a:hover {{ text-decoration: underline; }}
+  </style>
+</head>
+<body>
+  <div class="box">
+    <div class="title">🔁 เล่นวนอัตโนมัติ</div>
+    <audio controls autoplay loop>
+      <source src="/audio/{filename}" type="audio/mpeg" />
+    </audio>
+    <div class="hint">
+      มือถือบางรุ่นจะไม่ให้เล่นอัตโนมัติ ต้องกด ▶️ 1 ครั้งก่อน<br/>
+      หลังจากนั้นจะวนเองอัตโนมัติ
+    </div>
+    <div class="links">
+      ดาวน์โหลดไฟล์: <a href="/audio/{filename}">/audio/{filename}</a>
+    </div>
+  </div>
+</body>
+</html>"""
+
+
+def _audio_etag(filename: str, st) -> str:
+    # strong ETag: ชื่อไฟล์ (hash) + ขนาด ไม่ใส่ค่าเฉพาะเครื่อง (inode/mtime)
+    # ไฟล์เดียวกันที่ดึงจาก store ร่วมไปอีก instance ได้ ETag เดิม revalidate ข้าม instance ได้
+    stem = filename.rsplit(".", 1)[0]
+    return f"{stem}-{st.st_size:x}"
+
+
+def _audio_mem_get(filename: str):
+    with _audio_mem_lock:
+        hot = _audio_mem.get(filename)
+        if hot is not None:
+            _audio_mem.move_to_end(filename)
+        return hot
+
+
+def _audio_mem_admit(filename: str) -> bool:
+    """ถูกขอครั้งที่ 2 ภายในช่วงที่ยังจำชื่อได้ = ควรเก็บเข้า memory"""
+    with _audio_mem_lock:
+        if _audio_mem_seen.pop(filename, None) is not None:
+            return True
+        _audio_mem_seen[filename] = True
+        while len(_audio_mem_seen) > AUDIO_MEM_SEEN_MAX:
+            _audio_mem_seen.popitem(last=False)
+        return False
+
+
+def _audio_mem_put(filename: str, data: bytes, etag: str):
+    global _audio_mem_size
+    with _audio_mem_lock:
+        old = _audio_mem.pop(filename, None)
+        if old is not None:
+            _audio_mem_size -= len(old[0])
+        _audio_mem[filename] = (data, etag)
+        _audio_mem_size += len(data)
+        while _audio_mem_size > AUDIO_MEM_CACHE_BYTES and _audio_mem:
+            _, (evicted, _) = _audio_mem.popitem(last=False)
+            _audio_mem_size -= len(evicted)
+    return data, etag
+
+
+def audio_delivery_forget(filename: str) -> None:
+    """เรียกตอนลบไฟล์เสียง ให้ memory cache / หน้า play ลืมไฟล์นี้"""
+    global _audio_mem_size
+    with _audio_mem_lock:
+        old = _audio_mem.pop(filename, None)
+        if old is not None:
+            _audio_mem_size -= len(old[0])
+        _audio_mem_seen.pop(filename, None)
+        _play_pages.pop(filename, None)
+
+
 @app.route("/audio/<filename>", methods=["GET"])
+@timed(H_AUDIO_SERVE)
 def serve_audio(filename):
-    # ✅ เพิ่มเล็กน้อย: กัน path แปลกๆ
-    filename = os.path.basename(filename)
+    # ✅ เพิ่มเล็กน้อย: กัน path แปลกๆ (รับเฉพาะชื่อไฟล์เสียงใน cache)
+    if not AUDIO_NAME_RE.fullmatch(filename):
+        abort(404)
 
-    fpath = os.path.join(AUDIO_DIR, filename)
-    if not os.path.exists(fpath):
+    hot = _audio_mem_get(filename)
+    if hot is None:
+        fpath = os.path.join(AUDIO_DIR, filename)
+        try:
+            st = os.stat(fpath)
+        except OSError:
+            # ✅ NEW: ไฟล์อาจถูกทำบน instance อื่น ดึงจาก store ร่วม
+            if not fetch_shared_audio(filename):
+                abort(404)
+            st = os.stat(fpath)
+        etag = _audio_etag(filename, st)
+
+        if 0 < st.st_size <= AUDIO_MEM_MAX_FILE and AUDIO_MEM_CACHE_BYTES > 0 and _audio_mem_admit(filename):
+            with open(fpath, "rb") as f:
+                hot = _audio_mem_put(filename, f.read(), etag)
+        else:
+            # ✅ แก้: as_attachment=False เพื่อให้ LINE/Browser เล่นได้
+            # send_file ใช้ wsgi.file_wrapper -> gunicorn ส่งด้วย sendfile() (zero-copy), รองรับ Range/If-None-Match
+            resp = send_file(
+                fpath,
+                mimetype="audio/mpeg",
+                as_attachment=False,
+                download_name=filename,
+                conditional=True,
+                etag=etag,
+            )
+            resp.headers["Cache-Control"] = AUDIO_CACHE_CONTROL
+            return resp
+
+    data, etag = hot
+    resp = Response(data, mimetype="audio/mpeg")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = AUDIO_CACHE_CONTROL
+    resp.headers["Content-Disposition"] = f"inline; filename={filename}"
+    return resp.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+
+# ✅ เพิ่ม: หน้าเล่นเสียงแบบวน (loop)
+@app.route("/play/<path:filename>", methods=["GET"])
+def play_audio_page(filename):
+    # ป้องกัน path แปลกๆ
+    if not AUDIO_NAME_RE.fullmatch(filename):
         abort(404)
 
-    # ✅ แก้: as_attachment=False เพื่อให้ LINE/Browser เล่นได้
-    return send_file(
-        fpath,
-        mimetype="audio/mpeg",
-        as_attachment=False,
-        download_name=filename
+    # เช็คไฟล์ทุกครั้ง: ไฟล์ถูกลบ (เช่น cleanup ของ worker อื่น) ต้องได้ 404 ไม่ใช่หน้าเก่าจาก cache
+    fpath = os.path.join(AUDIO_DIR, filename)
+    try:
+        st = os.stat(fpath)
+    except FileNotFoundError:
+        # ถ้าไฟล์ไม่มีอยู่ ลองดึงจาก store ร่วม (instance อื่นทำไว้) ไม่มีจริงค่อย 404
+        if not fetch_shared_audio(filename):
+            abort(404)
+        try:
+            st = os.stat(fpath)
+        except FileNotFoundError:
+            abort(404)
+    etag = _audio_etag(filename, st)
+
+    # ✅ NEW: render ครั้งเดียวต่อไฟล์ แล้วใช้ซ้ำ ตราบที่ ETag ของไฟล์ยังตรงกับตอน render
+    with _audio_mem_lock:
+        cached = _play_pages.get(filename)
+    if cached is not None and cached[0] == etag:
+        html = cached[1]
+    else:
+        html = PLAY_PAGE_TEMPLATE.format(filename=filename)
+        with _audio_mem_lock:
+            _play_pages[filename] = (etag, html)
+            _play_pages.move_to_end(filename)
+            while len(_play_pages) > PLAY_PAGE_CACHE_MAX:
+                _play_pages.popitem(last=False)
+
+    resp = Response(html, mimetype="text/html; charset=utf-8")
+    resp.headers["Cache-Control"] = AUDIO_CACHE_CONTROL
+    return resp
+
+
+@app.route("/callback", methods=["POST"])
+@timed(H_CALLBACK)
+def callback():
+    t0 = time.perf_counter()
+    signature = request.headers.get("X-Line-Signature", "")
+    body = request.get_data(as_text=True)
+
+    # ✅ NEW: ตรวจลายเซ็น + parse แล้วโยนเข้าคิว ตอบ 200 ทันที (งานจริงทำใน worker)
+    if WEBHOOK_ASYNC:
+        try:
+            payload = handler.parser.parse(body, signature, as_payload=True)
+        except InvalidSignatureError:
+            abort(400)
+        t1 = time.perf_counter()
+        if TRACE_ENABLED:
+            for event in payload.events:
+                tr = Trace(getattr(event, "webhook_event_id", "") or "", t0)
+                tr.add("verify_parse", t0, t1)
+                tr.mark = t1
+                event.pea_trace = tr
+        enqueue_webhook_events(payload)
+        return "OK"
+
+    tr = Trace("", t0) if TRACE_ENABLED else None
+    try:
+        with use_traces((tr,) if tr else ()), span("handle"):
+            handler.handle(body, signature)
+    except InvalidSignatureError:
+        abort(400)
+    finally:
+        if tr:
+            tr.release()
+
+    return "OK"
+
+
+# =======================
+# ✅ NEW: Webhook dispatch queue (fast-ack)
+# =======================
+# WEBHOOK_ASYNC=0 กลับไปใช้แบบเดิม (ทำงานจบก่อนตอบ LINE)
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "1").strip().lower() in ("1", "true", "yes")
+WEBHOOK_QUEUE_MAX = max(1, int(os.getenv("WEBHOOK_QUEUE_MAX", "1000")))
+
+# กัน LINE ส่ง event ซ้ำ (redelivery): จำ webhookEventId ไว้ตามเวลา/จำนวนที่กำหนด
+EVENT_DEDUP_TTL_SEC = int(os.getenv("EVENT_DEDUP_TTL_SEC", "600"))
+EVENT_DEDUP_MAX = int(os.getenv("EVENT_DEDUP_MAX", "10000"))
+
+# reply token ใช้ได้ไม่นานหลังเกิด event เกินนี้ (วินาที) ส่งแบบ push แทน
+REPLY_TOKEN_TTL_SEC = float(os.getenv("REPLY_TOKEN_TTL_SEC", "50"))
+
+_webhook_queue = queue.Queue(maxsize=WEBHOOK_QUEUE_MAX)
+_webhook_workers = []
+_seen_events = OrderedDict()  # webhookEventId -> เวลาที่เห็น
+_webhook_lock = threading.Lock()
+_webhook_stats = {"received": 0, "duplicate": 0, "inline": 0, "reply_expired": 0}
+
+
+def _count_webhook(name: str) -> None:
+    with _webhook_lock:
+        _webhook_stats[name] += 1
+
+
+def _is_duplicate_event(event) -> bool:
+    event_id = getattr(event, "webhook_event_id", None)
+    if not event_id:
+        return False
+
+    now = time.time()
+    with _webhook_lock:
+        # ลบของที่หมดอายุ/เกินจำนวน (เรียงตามเวลาที่ใส่)
+        while _seen_events:
+            oldest_id, seen_at = next(iter(_seen_events.items()))
+            if now - seen_at <= EVENT_DEDUP_TTL_SEC and len(_seen_events) < EVENT_DEDUP_MAX:
+                break
+            _seen_events.popitem(last=False)
+
+        if event_id in _seen_events:
+            return True
+        _seen_events[event_id] = now
+        return False
+
+
+# (ชนิด event, ชนิดข้อความ|None) -> ฟังก์ชัน: เก็บเองไม่อ่าน handler._handlers (ของภายใน SDK เปลี่ยนได้ทุกรุ่น)
+_event_handlers = {}
+
+
+def on_event(event_type, message=None):
+    """ใช้แทน @handler.add: ลงทะเบียนทั้งกับ handler (โหมด sync) และ _event_handlers (dispatch_event)"""
+    def decorator(func):
+        _event_handlers[(event_type, message)] = func
+        return handler.add(event_type, message=message)(func)
+    return decorator
+
+
+def dispatch_event(event) -> None:
+    """ส่ง event ให้ฟังก์ชันที่ลงทะเบียนด้วย on_event (เหมือน WebhookHandler.handle ทีละ event)"""
+    func = None
+    if isinstance(event, MessageEvent):
+        func = _event_handlers.get((type(event), type(event.message)))
+    if func is None:
+        func = _event_handlers.get((type(event), None))
+    if func is not None:
+        func(event)
+
+
+def _run_webhook_event(event) -> None:
+    tr = getattr(event, "pea_trace", None)
+    if tr:
+        tr.add("webhook_queue", tr.mark, time.perf_counter())
+    try:
+        with use_traces((tr,) if tr else ()), span("handle_message"):
+            dispatch_event(event)
+    except Exception as e:
+        count_error(e)
+        print(f"[webhook] event failed: {e}")
+    finally:
+        if tr:
+            tr.release()
+
+
+def _webhook_worker_loop():
+    while True:
+        event = _webhook_queue.get()
+        try:
+            _run_webhook_event(event)
+        finally:
+            _webhook_queue.task_done()
+
+
+def _ensure_webhook_workers() -> None:
+    with _webhook_lock:
+        if _webhook_workers:
+            return
+        for i in range(WEBHOOK_WORKERS):
+            t = threading.Thread(target=_webhook_worker_loop, name=f"webhook-worker-{i}", daemon=True)
+            t.start()
+            _webhook_workers.append(t)
+
+
+def enqueue_webhook_events(payload) -> None:
+    _ensure_webhook_workers()
+    for event in payload.events:
+        _count_webhook("received")
+        if _is_duplicate_event(event):
+            _count_webhook("duplicate")
+            continue
+        try:
+            _webhook_queue.put_nowait(event)
+        except queue.Full:
+            # คิวเต็ม: ทำใน request นี้เลย ดีกว่าทิ้ง event
+            _count_webhook("inline")
+            _run_webhook_event(event)
+
+
+def event_target_id(event):
+    return getattr(event.source, "group_id", None) \
+        or getattr(event.source, "room_id", None) \
+        or getattr(event.source, "user_id", None)
+
+
+def reply_token_age_sec(event) -> float:
+    """อายุ reply token นับจาก timestamp ของ event (ms)"""
+    ts = getattr(event, "timestamp", None)
+    if not ts:
+        return 0.0
+    return max(0.0, time.time() - ts / 1000.0)
+
+
+def reply_to_event(event, messages) -> None:
+    """ตอบด้วย reply token ถ้ายังไม่หมดอายุ ไม่งั้น push ไปหา target แทน"""
+    send_messages(event_target_id(event), messages, event=event)
+
+
+# =======================
+# ✅ NEW: Outbound messages (รวมข้อความต่อ target + rate limit)
+# =======================
+# LINE รับได้สูงสุด 5 ข้อความต่อ 1 call (reply/push)
+LINE_MAX_MESSAGES_PER_CALL = 5
+# token bucket ของการเรียก LINE API (call/วินาที และ burst)
+LINE_RATE_PER_SEC = float(os.getenv("LINE_RATE_PER_SEC", "20"))
+LINE_RATE_BURST = float(os.getenv("LINE_RATE_BURST", "20"))
+LINE_MAX_RETRIES = int(os.getenv("LINE_MAX_RETRIES", "3"))
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """ได้ token คืน 0 ไม่งั้นคืนเวลาที่ควรรอก่อนลองใหม่"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if now >= self.paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return max(self.paused_until - now, (1 - self.tokens) / self.rate if self.rate > 0 else 0.1, 0.001)
+
+    def refund(self) -> None:
+        """คืน token ที่เพิ่งได้ไป (เช่นผ่าน bucket แรกแต่ติด bucket ที่สอง)"""
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    def acquire(self) -> None:
+        """รอจนได้ token 1 อัน"""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(min(max(wait, 0.01), 5.0))
+
+    def pause(self, seconds: float) -> None:
+        """โดน 429: หยุดทุก thread ไว้ตาม Retry-After แล้วเริ่มใหม่จาก bucket ว่าง"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+_line_bucket = _TokenBucket(LINE_RATE_PER_SEC, LINE_RATE_BURST)
+_send_lock = threading.Lock()
+_send_stats = {"messages": 0, "api_calls": 0, "saved_calls": 0, "reply": 0, "push": 0, "rate_limited": 0,
+               "duplicate": 0, "multicast": 0, "broadcast": 0}
+
+
+def _count_send(**kw) -> None:
+    with _send_lock:
+        for k, v in kw.items():
+            _send_stats[k] += v
+
+
+def send_stats() -> dict:
+    with _send_lock:
+        return dict(_send_stats)
+
+
+def _retry_after_sec(e: LineBotApiError, attempt: int) -> float:
+    try:
+        return float((e.headers or {}).get("Retry-After"))
+    except (TypeError, ValueError):
+        return min(2 ** attempt, 30)
+
+
+def _call_line(func, *args, **kwargs) -> None:
+    """เรียก LINE API ผ่าน rate limiter, 429 รอแล้วลองใหม่"""
+    name = getattr(func, "__name__", "line")
+    with span(f"line_{name}"):
+        _call_line_retry(func, name, *args, **kwargs)
+
+
+def _call_line_retry(func, name, *args, **kwargs) -> None:
+    for attempt in range(LINE_MAX_RETRIES + 1):
+        _line_bucket.acquire()
+        t0 = time.perf_counter()
+        try:
+            func(*args, **kwargs)
+            _count_send(api_calls=1)
+            return
+        except LineBotApiError as e:
+            # 409 + retry key = LINE รับข้อความนี้ไปแล้ว (เช่นงานที่ resume หลัง restart) ไม่ต้องส่งซ้ำ
+            if e.status_code == 409 and kwargs.get("retry_key"):
+                _count_send(duplicate=1)
+                return
+            count_error(e)
+            if e.status_code != 429 or attempt >= LINE_MAX_RETRIES:
+                raise
+            _count_send(rate_limited=1)
+            _line_bucket.pause(_retry_after_sec(e, attempt))
+        finally:
+            H_LINE_API.observe(time.perf_counter() - t0, name)
+
+
+def send_messages(target_id, messages, event=None, retry_key: str = None) -> None:
+    """
+    ส่งข้อความไปหา target ทีละไม่เกิน 5 ข้อความต่อ call
+    ถ้ามี event และ reply token ยังไม่หมดอายุ ใช้ reply (ฟรี) กับชุดแรก ที่เหลือ push
+    """
+    calls = _plan_sends(target_id, messages, event, retry_key)
+    if ASYNC_MODE:
+        # โหมด asyncio: ไม่รอ LINE ตอบ ส่งต่อให้ event loop (trace ค้างไว้จนส่งเสร็จ)
+        _spawn_async_send(calls)
+        return
+
+    for kind, to, batch, retry_key in calls:
+        if kind == "reply":
+            _call_line(line_bot_api.reply_message, to, batch)
+        else:
+            # retry_key เดิมทุกครั้งที่ลองใหม่ กัน LINE ส่งซ้ำ
+            _call_line(push_message, to, batch, retry_key=retry_key)
+        _count_send(**{kind: 1})
+
+
+def _plan_sends(target_id, messages, event=None, retry_key: str = None) -> list:
+    """
+    แบ่ง batch แล้วเลือก reply/push คืน [(kind, replyToken|to, batch, retry_key)]
+    retry_key (UUID) ที่ให้มาจะใช้กับ push ชุดแรก ชุดถัดไปใช้ uuid5 ที่ได้จากมัน (คงที่ทุกครั้งที่ส่งซ้ำ)
+    """
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    messages = list(messages)
+    if not messages:
+        return []
+
+    batches = [messages[i:i + LINE_MAX_MESSAGES_PER_CALL]
+               for i in range(0, len(messages), LINE_MAX_MESSAGES_PER_CALL)]
+    _count_send(messages=len(messages), saved_calls=len(messages) - len(batches))
+
+    calls = []
+    if event is not None and getattr(event, "reply_token", None):
+        if reply_token_age_sec(event) < REPLY_TOKEN_TTL_SEC:
+            calls.append(("reply", event.reply_token, batches.pop(0), None))
+        else:
+            _count_webhook("reply_expired")
+
+    if target_id:
+        for i, batch in enumerate(batches):
+            if retry_key is None:
+                key = str(uuid.uuid4())
+            elif i == 0:
+                key = retry_key
+            else:
+                key = str(uuid.uuid5(uuid.UUID(retry_key), str(i)))
+            calls.append(("push", target_id, batch, key))
+    return calls
+
+
+# =======================
+# ✅ NEW: แจ้งเตือนดับไฟอัตโนมัติ (สมัครรับ + poll ชีต + ส่งเฉพาะรายการใหม่/เปลี่ยน/ยกเลิก)
+# =======================
+# ทุกกี่วินาทีจะเช็คชีต 0 = ปิด (สมัครรับได้ แต่ยังไม่มีการส่ง)
+OUTAGE_POLL_SEC = int(os.getenv("OUTAGE_POLL_SEC", "0"))
+# multicast = ส่งเฉพาะ user ที่สมัคร (ครั้งละ 500 คน), broadcast = ส่งหาเพื่อนทุกคนของบอท
+# กลุ่ม/ห้องส่งทาง multicast/broadcast ไม่ได้ (LINE รับเฉพาะ userId) จึง push ทีละกลุ่ม
+OUTAGE_NOTIFY_MODE = os.getenv("OUTAGE_NOTIFY_MODE", "multicast").strip().lower()
+LINE_MULTICAST_MAX_TO = 500
+# รายชื่อผู้สมัคร + รายการที่แจ้งไปแล้ว: อยู่ใน store ร่วม (STORAGE_BACKEND) ถ้ามี ไม่งั้นโฟลเดอร์นี้
+OUTAGE_NOTIFY_DIR = os.getenv(
+    "OUTAGE_NOTIFY_DIR", os.path.join(os.path.dirname(SETTINGS_PATH) or ".", "pea_outage_notify"))
+
+SUBSCRIBERS_KEY = "outage_notify/subscribers.json"
+# {row_id: [digest, วันที่ ISO, หัววันที่, รายละเอียด]} ของรายการที่แจ้งไปแล้ว
+NOTIFY_STATE_KEY = "outage_notify/state.json"
+
+_notify_store = shared_store if shared_store is not None else DirStore(OUTAGE_NOTIFY_DIR)
+_notify_lock = threading.Lock()
+_notify_stats = {"polls": 0, "skipped": 0, "unchanged": 0, "notified": 0, "notify_calls": 0,
+                 "last_poll": None, "last_error": None}
+# index + เวอร์ชัน state ที่ diff ไปแล้วล่าสุด ไม่เปลี่ยนทั้งคู่ = ไม่ต้องทำอะไร
+_notify_memo = {"index": None, "state_version": None}
+
+
+def _count_notify(**kw) -> None:
+    with _notify_lock:
+        for k, v in kw.items():
+            _notify_stats[k] = _notify_stats[k] + v if isinstance(v, int) else v
+
+
+def notify_stats() -> dict:
+    with _notify_lock:
+        return dict(_notify_stats)
+
+
+def _with_notify_lease(name: str, fn):
+    """ทำ fn ระหว่างถือ lease (กันหลาย worker/instance แก้ไฟล์เดียวกันพร้อมกัน)"""
+    lease = f"leases/{name}"
+    deadline = time.monotonic() + 10
+    while not _notify_store.claim(lease, INSTANCE_ID, 30):
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{name} is locked by another instance")
+        time.sleep(0.05)
+    try:
+        return fn()
+    finally:
+        _notify_store.release(lease, INSTANCE_ID)
+
+
+def load_subscribers() -> list:
+    try:
+        return list(json.loads(_notify_store.get(SUBSCRIBERS_KEY) or b"[]"))
+    except ValueError:
+        return []
+
+
+def set_subscribed(target_id: str, on: bool) -> bool:
+    """สมัคร/เลิกรับแจ้งเตือน คืน True ถ้าสถานะเปลี่ยน"""
+    def update():
+        subs = load_subscribers()
+        if (target_id in subs) == on:
+            return False
+        subs = [t for t in subs if t != target_id] + ([target_id] if on else [])
+        _notify_store.put(SUBSCRIBERS_KEY, json.dumps(subs).encode("utf-8"))
+        return True
+    return _with_notify_lease("subscribers", update)
+
+
+def diff_outages(state: dict, index: OutageIndex):
+    """
+    เทียบ index กับรายการที่แจ้งไปแล้ว (ตาม row_id + digest) คืน (new_state, ใหม่, เปลี่ยน, ยกเลิก)
+    แต่ละรายการเป็น (หัววันที่, รายละเอียด) รายการของวันที่ผ่านไปแล้วไม่แจ้ง
+    """
+    today = outage_today().isoformat()
+    new_state, added, changed, cancelled = {}, [], [], []
+    for row_id, rec in index.by_id.items():
+        day = rec.day.isoformat() if rec.day is not None else ""
+        new_state[row_id] = [rec.digest, day, rec.date_label, rec.body]
+        old = state.get(row_id)
+        if (old is not None and old[0] == rec.digest) or (day and day < today):
+            continue
+        (added if old is None else changed).append((rec.date_label, rec.body))
+    for row_id, (_, day, label, body) in state.items():
+        if row_id not in new_state and not (day and day < today):
+            cancelled.append((label, body))
+    return new_state, added, changed, cancelled
+
+
+def build_outage_change_messages(added: list, changed: list, cancelled: list) -> list:
+    """ข้อความแจ้งเตือน แบ่งตาม OUTAGE_MSG_MAX_CHARS ไม่เกิน LINE_MAX_MESSAGES_PER_CALL ข้อความ"""
+    blocks = []
+    for title, items in (("🆕 งานดับไฟใหม่", added), ("✏️ มีการเปลี่ยนแปลง", changed), ("❌ ยกเลิก", cancelled)):
+        if items:
+            blocks.append(f"\n{title} ({len(items)} รายการ)")
+            blocks += [f"{label}\n{body}" for label, body in items]
+
+    chunks, current, size = [], ["🔔 อัปเดตงานดับไฟ"], 0
+    for block in blocks:
+        if size + len(block) + 1 > OUTAGE_MSG_MAX_CHARS and current:
+            chunks.append("\n".join(current).strip())
+            current, size = [], 0
+        current.append(block)
+        size += len(block) + 1
+    chunks.append("\n".join(current).strip())
+
+    if len(chunks) > LINE_MAX_MESSAGES_PER_CALL:
+        chunks = chunks[:LINE_MAX_MESSAGES_PER_CALL]
+        chunks[-1] += "\n\n… ยังมีอีก พิมพ์ \"ดับไฟ\" เพื่อดูทั้งหมด"
+    return chunks
+
+
+def send_outage_notification(texts: list, change_id: str) -> None:
+    """
+    ส่งแจ้งเตือนหาผู้สมัครทุกคน retry key ได้จาก change_id + ผู้รับ
+    (instance ที่ส่งซ้ำหลังพังกลางทาง LINE จะตอบ 409 ไม่ส่งซ้ำ)
+    """
+    messages = [TextSendMessage(text=t) for t in texts]
+    subs = load_subscribers()
+    users = [t for t in subs if t.startswith("U")]
+    chats = [t for t in subs if not t.startswith("U")]
+
+    def key(part: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"pea-outage:{change_id}:{part}"))
+
+    if OUTAGE_NOTIFY_MODE == "broadcast":
+        _call_line(broadcast_message, messages, retry_key=key("broadcast"))
+        _count_send(messages=len(messages), broadcast=1)
+        _count_notify(notify_calls=1)
+    else:
+        for i in range(0, len(users), LINE_MULTICAST_MAX_TO):
+            batch = users[i:i + LINE_MULTICAST_MAX_TO]
+            batch_id = hashlib.sha1(",".join(batch).encode("utf-8")).hexdigest()
+            _call_line(multicast_message, batch, messages, retry_key=key(f"multicast:{batch_id}"))
+            _count_send(messages=len(messages), multicast=1)
+            _count_notify(notify_calls=1)
+
+    for to in chats:
+        try:
+            _call_line(push_message, to, messages, retry_key=key(f"push:{to}"))
+        except LineBotApiError as e:
+            # บอทถูกเตะออกจากกลุ่ม/ถูกบล็อก: เลิกส่งให้ target นี้ ที่เหลือส่งต่อ
+            if e.status_code in (400, 403, 404):
+                set_subscribed(to, False)
+                continue
+            raise
+        _count_send(messages=len(messages), push=1)
+        _count_notify(notify_calls=1)
+
+
+def outage_poll_once() -> int:
+    """
+    เช็คชีต 1 รอบ คืนจำนวนรายการที่แจ้ง (-1 = worker/instance อื่นกำลัง poll อยู่)
+    ชีตไม่เปลี่ยน (304 หรือ index เดิม) และ state ไม่เปลี่ยน = จบทันทีไม่ต้อง diff
+    """
+    lease = "leases/outage_poll"
+    if not _notify_store.claim(lease, INSTANCE_ID, max(60, OUTAGE_POLL_SEC * 3)):
+        _count_notify(skipped=1)
+        return -1
+    try:
+        _refresh_outage_cache()
+        with _outage_lock:
+            index = _outage_cache["index"]
+        state_version = _notify_store.version(NOTIFY_STATE_KEY)
+        _count_notify(polls=1, last_poll=time.time())
+        if index is None or (index is _notify_memo["index"] and state_version == _notify_memo["state_version"]):
+            _count_notify(unchanged=1)
+            return 0
+
+        raw = _notify_store.get(NOTIFY_STATE_KEY)
+        state = json.loads(raw) if raw else None
+        new_state, added, changed, cancelled = diff_outages(state or {}, index)
+        total = len(added) + len(changed) + len(cancelled)
+        if state is None:
+            # รอบแรก: จำไว้เป็นฐาน ไม่แจ้ง (กันส่งทั้งชีตตอน deploy ครั้งแรก)
+            total = 0
+        elif not len(index) and state:
+            # ชีตว่างทั้งแผ่นมักเป็นชีตพัง/publish ผิด ไม่แจ้งยกเลิกทั้งหมด รอรอบหน้า
+            return 0
+        elif total:
+            # change_id เหมือนกันทุก instance ที่ diff จาก state เดียวกัน -> retry key ตรงกัน
+            change_id = hashlib.sha1(raw + json.dumps([added, changed, cancelled]).encode("utf-8")).hexdigest()
+            send_outage_notification(build_outage_change_messages(added, changed, cancelled), change_id)
+            _count_notify(notified=total)
+
+        if new_state != state:
+            _notify_store.put(NOTIFY_STATE_KEY, json.dumps(new_state, ensure_ascii=False).encode("utf-8"))
+            state_version = _notify_store.version(NOTIFY_STATE_KEY)
+        _notify_memo.update(index=index, state_version=state_version)
+        return total
+    finally:
+        _notify_store.release(lease, INSTANCE_ID)
+
+
+def _outage_poller_loop() -> None:
+    while True:
+        time.sleep(OUTAGE_POLL_SEC)
+        try:
+            outage_poll_once()
+            _count_notify(last_error=None)
+        except Exception as e:
+            count_error(e)
+            _count_notify(last_error=str(e))
+
+
+# =======================
+# ✅ NEW: เตรียมเสียงประกาศดับไฟไว้ล่วงหน้า (cache warming)
+# =======================
+# ชีตเปลี่ยนเมื่อไหร่ ทำเสียงรายการที่ยังไม่ถึงวันเก็บเข้า cache ไว้ "ดับไฟ เสียง" ตอบได้ทันที
+OUTAGE_WARM = os.getenv("OUTAGE_WARM", "1") == "1"
+OUTAGE_WARM_CONCURRENCY = max(1, int(os.getenv("OUTAGE_WARM_CONCURRENCY", "2")))
+# งบต่อวันต่อ process (ตัวอักษรที่ส่งไป MiniMax) และเครดิตขั้นต่ำที่ต้องเหลือ (0 = ไม่เช็ค)
+OUTAGE_WARM_MAX_CHARS_PER_DAY = int(os.getenv("OUTAGE_WARM_MAX_CHARS_PER_DAY", "20000"))
+OUTAGE_WARM_MIN_CREDIT = float(os.getenv("OUTAGE_WARM_MIN_CREDIT", "0"))
+# "ดับไฟ เสียง" รวมได้สูงสุดกี่รายการในไฟล์เดียว
+OUTAGE_AUDIO_MAX_ITEMS = max(1, int(os.getenv("OUTAGE_AUDIO_MAX_ITEMS", "10")))
+
+_warm_lock = threading.Lock()
+_warm_state = {
+    "index": None,       # OutageIndex ล่าสุดที่ต้องเตรียม
+    "voice": None,       # เสียงที่ใช้เตรียมรอบล่าสุด
+    "ready": {},         # row_id -> ชื่อไฟล์ (ของ voice ข้างบน)
+    "inflight": set(),   # cache key ที่กำลังทำ
+    "running": False,
+    "pending": False,    # มีคำขอใหม่ระหว่างรอบที่กำลังทำ
+    "day": None,
+    "chars_today": 0,
+}
+_warm_stats = {"warmed": 0, "cached": 0, "over_budget": 0, "errors": 0, "invalidated": 0}
+
+
+def warm_stats() -> dict:
+    with _warm_lock:
+        return dict(_warm_stats, ready=len(_warm_state["ready"]), inflight=len(_warm_state["inflight"]),
+                    chars_today=_warm_state["chars_today"], voice=_warm_state["voice"])
+
+
+def outage_speech_text(rec: OutageRecord) -> str:
+    """ข้อความที่ใช้ทำเสียง 1 รายการ (บล็อกเดียวกับในคำตอบ "ดับไฟ" ตัด emoji นำหน้าออกไม่ให้ถูกอ่าน)"""
+    return re.sub(r"[📅⏰📍]\s*", "", f"{rec.date_label}\n{rec.body}")
+
+
+def outage_audio_key(rec: OutageRecord, voice_id: str) -> str:
+    return tts_cache_key(build_t2a_payload(outage_speech_text(rec), voice_id, OUTAGE_AUDIO_PROFILE))
+
+
+def _warm_take_budget(chars: int) -> bool:
+    if OUTAGE_WARM_MIN_CREDIT > 0:
+        snapshot = credit_snapshot()
+        if snapshot["samples"] == 0:
+            # poller เพิ่งเริ่ม ยังไม่มีตัวอย่าง: เช็คเองครั้งเดียว
+            try:
+                sample_credit()
+            except Exception as e:
+                count_error(e)
+            snapshot = credit_snapshot()
+        # ไม่รู้เครดิต = ไม่เสี่ยงใช้เครดิตต่ำกว่าขั้นต่ำ
+        credit = _credit_number(snapshot["credit"])
+        if credit is None or credit < OUTAGE_WARM_MIN_CREDIT:
+            return False
+    with _warm_lock:
+        today = outage_today()
+        if _warm_state["day"] != today:
+            _warm_state["day"] = today
+            _warm_state["chars_today"] = 0
+        if _warm_state["chars_today"] + chars > OUTAGE_WARM_MAX_CHARS_PER_DAY:
+            return False
+        _warm_state["chars_today"] += chars
+        return True
+
+
+def _warm_refund_budget(chars: int) -> None:
+    # จองงบไว้ก่อน (กันหลาย worker ทำเกินงบพร้อมกัน) ทำเสียงไม่สำเร็จ/ไม่ได้เรียก MiniMax คืนงบ
+    with _warm_lock:
+        _warm_state["chars_today"] = max(0, _warm_state["chars_today"] - chars)
+
+
+def warm_outage_audio(index: OutageIndex) -> int:
+    """ทำเสียงรายการที่ยังไม่ถึงวันและยังไม่มีใน cache คืนจำนวนที่ต้องทำ"""
+    voice_id = get_voice_id()
+    today = outage_today()
+    ready, todo = {}, []
+    for rec in index.records:
+        if rec.day is not None and rec.day < today:
+            continue
+        key = outage_audio_key(rec, voice_id)
+        fname = tts_cache_lookup(key, record_miss=False, record_hit=False)
+        if fname:
+            ready[rec.row_id] = fname
+        else:
+            todo.append((rec, key))
+
+    with _warm_lock:
+        if _warm_state["voice"] != voice_id:
+            _warm_state["ready"] = {}
+            _warm_state["voice"] = voice_id
+        _warm_state["ready"].update(ready)
+        _warm_stats["cached"] += len(ready)
+
+    def warm_one(item):
+        rec, key = item
+        text = outage_speech_text(rec)
+        # มีคนขอเสียงนี้อยู่ในคิวแล้ว / MiniMax ล่มอยู่ / เกินงบ ข้าม
+        with _tts_inflight_lock:
+            queued = key in _tts_inflight
+        if queued or minimax_breaker.retry_after():
+            return
+        # worker / instance อื่นกำลังเตรียมไฟล์เดียวกัน ข้าม
+        lease = f"leases/warm/{key}"
+        if not _notify_store.claim(lease, INSTANCE_ID, STORAGE_LEASE_SEC):
+            return
+        if not _warm_take_budget(len(text)):
+            with _warm_lock:
+                _warm_stats["over_budget"] += 1
+            _notify_store.release(lease, INSTANCE_ID)
+            return
+        with _warm_lock:
+            _warm_state["inflight"].add(key)
+        # งบจองไว้แล้ว คิดจริงเฉพาะเมื่อ process นี้เรียก MiniMax เอง (instance อื่นทำให้ = คืนงบ)
+        charged = False
+        try:
+            fname = tts_cache_lookup(key, record_miss=False, record_hit=False)
+            if not fname:
+                fname, charged = _synthesize_coordinated(key, text, voice_id, OUTAGE_AUDIO_PROFILE,
+                                                         record_hit=False)
+            with _warm_lock:
+                if _warm_state["voice"] == voice_id:
+                    _warm_state["ready"][rec.row_id] = fname
+                _warm_stats["warmed"] += 1
+        except Exception as e:
+            count_error(e)
+            with _warm_lock:
+                _warm_stats["errors"] += 1
+        finally:
+            if not charged:
+                _warm_refund_budget(len(text))
+            with _warm_lock:
+                _warm_state["inflight"].discard(key)
+            _notify_store.release(lease, INSTANCE_ID)
+
+    if todo:
+        with ThreadPoolExecutor(max_workers=OUTAGE_WARM_CONCURRENCY, thread_name_prefix="outage-warm") as ex:
+            list(ex.map(warm_one, todo))
+    return len(todo)
+
+
+def _outage_warm_loop() -> None:
+    while True:
+        with _warm_lock:
+            index = _warm_state["index"]
+            _warm_state["pending"] = False
+        try:
+            warm_outage_audio(index)
+        except Exception as e:
+            count_error(e)
+        with _warm_lock:
+            if not _warm_state["pending"]:
+                _warm_state["running"] = False
+                return
+
+
+def schedule_outage_warm(index: OutageIndex = None) -> None:
+    """เริ่มเตรียมเสียงเบื้องหลัง (มีรอบที่กำลังทำอยู่ = ทำต่ออีกรอบเมื่อเสร็จ)"""
+    if not OUTAGE_WARM or not MINIMAX_API_KEY:
+        return
+    # งบเครดิตขั้นต่ำต้องมีเครดิตล่าสุด (ปกติ poller เริ่มตอนเปิด /control)
+    if OUTAGE_WARM_MIN_CREDIT > 0:
+        ensure_credit_poller()
+    with _warm_lock:
+        if index is not None:
+            _warm_state["index"] = index
+        if _warm_state["index"] is None:
+            return
+        if _warm_state["running"]:
+            _warm_state["pending"] = True
+            return
+        _warm_state["running"] = True
+    threading.Thread(target=_outage_warm_loop, name="outage-warm", daemon=True).start()
+
+
+def invalidate_outage_warm() -> None:
+    """เปลี่ยนเสียง: ลืมรายการที่เตรียมด้วยเสียงเก่า แล้วเตรียมใหม่ (ไฟล์เก่าปล่อยให้ janitor ลบตามอายุ)"""
+    with _warm_lock:
+        _warm_state["ready"] = {}
+        _warm_state["voice"] = None
+        _warm_stats["invalidated"] += 1
+    schedule_outage_warm()
+
+
+def outage_audio_file(records: list, voice_id: str):
+    """
+    ไฟล์เสียงของหลายรายการรวมกัน (ต่อ MP3 frame ของไฟล์ที่เตรียมไว้ ไม่ต้องเรียก MiniMax)
+    คืน None ถ้ายังมีรายการที่ไม่มีเสียงใน cache
+    """
+    keys = [outage_audio_key(rec, voice_id) for rec in records]
+    fnames = [tts_cache_lookup(k, record_miss=False) for k in keys]
+    if not all(fnames):
+        return None
+    if len(fnames) == 1:
+        return fnames[0]
+
+    combo = hashlib.sha256(("outage-concat:" + ",".join(keys)).encode("utf-8")).hexdigest()
+    fname = tts_cache_lookup(combo, record_miss=False)
+    if fname:
+        return fname
+    parts = []
+    for fn in fnames:
+        with open(os.path.join(AUDIO_DIR, fn), "rb") as f:
+            parts.append(f.read())
+    data = mp3_concat(parts)
+    fname = tts_cache_store(combo, data)
+    audio_index_add(fname, len(data))
+    publish_shared_audio(fname)
+    return fname
+
+
+# =======================
+# MiniMax (Sync T2A HTTP)
+# =======================
+def _require_minimax():
+    if not MINIMAX_API_KEY:
+        raise RuntimeError("MINIMAX_API_KEY not set")
+
+
+def _minimax_headers():
+    return {
+        "Authorization": f"Bearer {MINIMAX_API_KEY}",
+        "Content-Type": "application/json",
+    }
+
+
+def _clean_text_for_tts(text: str) -> str:
+    return text.replace("\ufeff", "").replace("\u200b", "").strip()
+
+
+# ค่าเสียงที่ส่งไป MiniMax (ใช้ทั้งตอนสร้างเสียงและเป็นส่วนหนึ่งของ cache key)
+MINIMAX_TTS_MODEL = "speech-2.8-hd"
+MINIMAX_VOICE_SETTING = {
+    "speed": 0.9,
+    "vol": 1.2,
+    "pitch": -1
+}
+MINIMAX_AUDIO_SETTING = {
+    "audio_sample_rate": 32000,
+    "bitrate": 128000,
+    "format": "mp3",
+    "channel": 2
+}
+
+# ✅ NEW: Audio profiles (ค่าเสียงเป็นชุดๆ เลือกได้ต่อคำสั่ง / ต่อห้อง)
+# เสียงพูดคนเดียวไม่ต้องใช้ stereo 128 kbps: mono 64k ขนาดราวครึ่งเดียว ฟังใน LINE แทบไม่ต่าง
+# audio_setting อยู่ใน payload อยู่แล้ว -> profile ต่างกัน = cache key ต่างกันเอง
+# hd-stereo = ค่าเดิม (MINIMAX_AUDIO_SETTING) ไฟล์ใน cache เดิมจึงยังใช้ได้
+AUDIO_PROFILES = {
+    "hd-stereo": MINIMAX_AUDIO_SETTING,
+    "voice-mono-64k": {
+        "audio_sample_rate": 24000,
+        "bitrate": 64000,
+        "format": "mp3",
+        "channel": 1
+    },
+    "voice-mono-32k": {
+        "audio_sample_rate": 16000,
+        "bitrate": 32000,
+        "format": "mp3",
+        "channel": 1
+    },
+}
+# profile ที่ใช้เทียบว่า "ประหยัดไปกี่ byte"
+AUDIO_PROFILE_BASELINE = "hd-stereo"
+
+
+def _env_audio_profile(name: str, default: str) -> str:
+    value = (os.getenv(name) or default).strip().lower()
+    if value not in AUDIO_PROFILES:
+        print(f"⚠️ {name}={value} ไม่รู้จัก ใช้ {default} แทน (มี: {', '.join(AUDIO_PROFILES)})")
+        return default
+    return value
+
+
+DEFAULT_AUDIO_PROFILE = _env_audio_profile("DEFAULT_AUDIO_PROFILE", AUDIO_PROFILE_BASELINE)
+# ประกาศดับไฟที่อุ่นไว้ล่วงหน้า (ไฟล์เดียวส่งให้ทุกคน)
+OUTAGE_AUDIO_PROFILE = _env_audio_profile("OUTAGE_AUDIO_PROFILE", DEFAULT_AUDIO_PROFILE)
+
+
+def audio_profile_name(profile: str = None) -> str:
+    return profile if profile in AUDIO_PROFILES else DEFAULT_AUDIO_PROFILE
+
+
+def build_t2a_payload(text: str, voice_id: str, profile: str = None) -> dict:
+    return {
+        "model": MINIMAX_TTS_MODEL,
+        "text": _clean_text_for_tts(text),
+        "stream": False,
+        "language_boost": "Thai",
+        "voice_setting": dict(MINIMAX_VOICE_SETTING, voice_id=voice_id),
+        "audio_setting": dict(AUDIO_PROFILES[audio_profile_name(profile)]),
+    }
+
+
+@timed(H_MINIMAX_T2A, "sync")
+def minimax_t2a_sync(text: str, voice_id: str, profile: str = None) -> bytes:
+    _require_minimax()
+
+    url = f"{MINIMAX_BASE_URL}/v1/t2a_v2"
+
+    payload = build_t2a_payload(text, voice_id, profile)
+    count_tts_chars(len(payload["text"]))
+
+    def attempt(read_timeout):
+        r = http_session("minimax").post(url, headers=_minimax_headers(), json=payload,
+                                         timeout=(HTTP_TIMEOUTS["minimax_t2a"][0], read_timeout))
+        r.raise_for_status()
+        return _decode_t2a_response(r.json())
+
+    return minimax_call(attempt, len(payload["text"]))
+
+
+class MiniMaxError(RuntimeError):
+    """MiniMax ตอบ error ใน base_resp (retriable = ลองใหม่แล้วมีโอกาสผ่าน)"""
+
+    def __init__(self, message: str, status_code=None, retriable: bool = False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retriable = retriable
+
+
+# รหัส base_resp ที่เป็นปัญหาชั่วคราวฝั่ง MiniMax (unknown / timeout / rate limit / internal / TPM limit)
+MINIMAX_RETRIABLE_CODES = {1000, 1001, 1002, 1013, 1039}
+
+
+def _check_base_resp(data: dict) -> None:
+    base_resp = data.get("base_resp") or {}
+    if base_resp.get("status_code") not in (None, 0, "0"):
+        code = base_resp.get("status_code")
+        try:
+            retriable = int(code) in MINIMAX_RETRIABLE_CODES
+        except (TypeError, ValueError):
+            retriable = False
+        raise MiniMaxError(f"MiniMax error {code}: {base_resp.get('status_msg')}", code, retriable)
+
+
+def _decode_t2a_response(data: dict) -> bytes:
+    _check_base_resp(data)
+
+    audio_hex = (data.get("data") or {}).get("audio")
+    if not audio_hex:
+        raise MiniMaxError(f"MiniMax did not return audio hex. Response: {str(data)[:600]}", retriable=True)
+
+    try:
+        return bytes.fromhex(audio_hex)
+    except Exception as e:
+        raise RuntimeError(f"Failed to decode audio hex: {e}")
+
+
+# =======================
+# ✅ NEW: MiniMax resilience (retry + hedged request + circuit breaker)
+# =======================
+# ลองใหม่สูงสุดกี่ครั้ง (รวมครั้งแรก) รอแบบ exponential backoff + full jitter
+MINIMAX_MAX_ATTEMPTS = max(1, int(os.getenv("MINIMAX_MAX_ATTEMPTS", "3")))
+MINIMAX_RETRY_BASE_SEC = float(os.getenv("MINIMAX_RETRY_BASE_SEC", "0.5"))
+MINIMAX_RETRY_MAX_SEC = float(os.getenv("MINIMAX_RETRY_MAX_SEC", "8"))
+# timeout ต่อครั้งปรับตาม latency จริง: p99 x FACTOR (ไม่ต่ำกว่า MIN ไม่เกิน HTTP_TIMEOUTS["minimax_t2a"])
+MINIMAX_TIMEOUT_FACTOR = float(os.getenv("MINIMAX_TIMEOUT_FACTOR", "3"))
+MINIMAX_MIN_TIMEOUT_SEC = float(os.getenv("MINIMAX_MIN_TIMEOUT_SEC", "15"))
+# MINIMAX_HEDGE=1: ครั้งแรกช้ากว่า p95 ยิงคำขอที่ 2 คู่กัน ใช้อันที่เสร็จก่อน (เสียเครดิตเพิ่มเฉพาะตอน hedge)
+MINIMAX_HEDGE = os.getenv("MINIMAX_HEDGE", "0").strip().lower() in ("1", "true", "yes")
+# พลาดติดกันกี่ครั้งถึงตัดวงจร / พักกี่วินาทีก่อนลองใหม่ (พลาดซ้ำพักนานขึ้นเท่าตัวจนถึง MAX)
+MINIMAX_BREAKER_FAILURES = max(1, int(os.getenv("MINIMAX_BREAKER_FAILURES", "5")))
+MINIMAX_BREAKER_OPEN_SEC = float(os.getenv("MINIMAX_BREAKER_OPEN_SEC", "30"))
+MINIMAX_BREAKER_MAX_OPEN_SEC = float(os.getenv("MINIMAX_BREAKER_MAX_OPEN_SEC", "300"))
+# ต้องมีตัวอย่าง latency อย่างน้อยเท่านี้ก่อนใช้ p95/p99 (ก่อนหน้านั้นใช้ timeout เดิม ไม่ hedge)
+MINIMAX_LATENCY_MIN_SAMPLES = 20
+
+C_MINIMAX = Counter("pea_minimax_resilience_total", "เหตุการณ์ retry / hedge / circuit breaker ของ MiniMax", "event")
+
+
+class MiniMaxUnavailable(RuntimeError):
+    """circuit breaker เปิดอยู่ ไม่เรียก MiniMax (ตอบผู้ใช้ได้ทันที)"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"MiniMax unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    closed -> (พลาดติดกัน N ครั้ง) -> open -> (ครบเวลา) -> half_open ให้ลอง 1 คำขอ
+    สำเร็จกลับ closed พลาดกลับ open นานขึ้นเท่าตัว
+    """
+
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, failures: int, open_sec: float, max_open_sec: float):
+        self.threshold = failures
+        self.base_open_sec = open_sec
+        self.max_open_sec = max_open_sec
+        self.state = "closed"
+        self.failures = 0
+        self.open_sec = open_sec
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def retry_after(self) -> float:
+        """0 = เรียกได้ มากกว่า 0 = วงจรเปิดอยู่อีกกี่วินาที"""
+        with self.lock:
+            if self.state != "open":
+                return 0.0
+            return max(0.0, self.opened_at + self.open_sec - time.monotonic())
+
+    def before_call(self) -> None:
+        with self.lock:
+            if self.state == "closed":
+                return
+            now = time.monotonic()
+            if self.state == "open" and now - self.opened_at >= self.open_sec:
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return
+            wait = self.opened_at + self.open_sec - now if self.state == "open" else 1.0
+        C_MINIMAX.inc("breaker_reject")
+        raise MiniMaxUnavailable(max(1.0, wait))
+
+    def success(self) -> None:
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.open_sec = self.base_open_sec
+            self.probing = False
+
+    def failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open":
+                self.open_sec = min(self.open_sec * 2, self.max_open_sec)
+            elif self.state == "open" or self.failures < self.threshold:
+                return
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.probing = False
+        C_MINIMAX.inc("breaker_open")
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"state": self.state, "failures": self.failures, "open_sec": self.open_sec}
+
+
+class LatencyWindow:
+    """latency ล่าสุด (วินาทีต่อ 200 ตัวอักษร) ไว้คิด p95/p99 ของคำขอขนาดใดก็ได้"""
+
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def units(chars: int) -> float:
+        return 1 + chars / 200
+
+    def add(self, seconds: float, chars: int) -> None:
+        with self.lock:
+            self.samples.append(seconds / self.units(chars))
+
+    def percentile(self, q: float, chars: int):
+        with self.lock:
+            if len(self.samples) < MINIMAX_LATENCY_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * self.units(chars)
+
+
+minimax_breaker = CircuitBreaker(MINIMAX_BREAKER_FAILURES, MINIMAX_BREAKER_OPEN_SEC, MINIMAX_BREAKER_MAX_OPEN_SEC)
+_minimax_latency = LatencyWindow()
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            # คนเรียก MiniMax พร้อมกันได้: งาน TTS + ท่อนของข้อความยาว + thread เตรียมเสียงดับไฟ
+            # คนละ 2 คำขอ (ครั้งแรก + hedge) ไม่งั้นคำขอที่ 2 ต้องรอคิวจน hedge ไม่มีผล
+            callers = TTS_WORKERS + TTS_CHUNK_WORKERS + (OUTAGE_WARM_CONCURRENCY if OUTAGE_WARM else 0)
+            _hedge_executor = ThreadPoolExecutor(max_workers=2 * callers, thread_name_prefix="minimax-hedge")
+        return _hedge_executor
+
+
+def _minimax_read_timeout(chars: int) -> float:
+    default = HTTP_TIMEOUTS["minimax_t2a"][1]
+    p99 = _minimax_latency.percentile(0.99, chars)
+    if p99 is None:
+        return default
+    return min(default, max(MINIMAX_MIN_TIMEOUT_SEC, p99 * MINIMAX_TIMEOUT_FACTOR))
+
+
+def _minimax_retry_plan(e: Exception, attempt: int):
+    """คืน (ลองใหม่ได้ไหม, รอกี่วินาที) 4xx / เนื้อหาผิด = ไม่ลองใหม่ (MiniMax ยังปกติดี)"""
+    wait = random.uniform(0, min(MINIMAX_RETRY_MAX_SEC, MINIMAX_RETRY_BASE_SEC * 2 ** attempt))
+    if isinstance(e, MiniMaxError):
+        return e.retriable, wait
+    status, headers = None, {}
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        status, headers = e.response.status_code, e.response.headers
+    elif isinstance(e, aiohttp.ClientResponseError):
+        status, headers = e.status, e.headers or {}
+    elif isinstance(e, (requests.ConnectionError, requests.Timeout, aiohttp.ClientError, asyncio.TimeoutError)):
+        return True, wait
+    if status is None:
+        return False, wait
+    if status == 429:
+        try:
+            wait = max(wait, float(headers.get("Retry-After")))
+        except (TypeError, ValueError):
+            pass
+    return status == 429 or status >= 500, wait
+
+
+def _minimax_rejected(e: Exception) -> bool:
+    """
+    MiniMax ตอบกลับมาชัดเจนว่าคำขอผิด (4xx / base_resp error) = ระบบยังปกติดี ไม่นับเป็นความล้มเหลว
+    error อื่นที่ลองใหม่ไม่ได้ (decode ไม่ได้ / ตอบไม่ครบ) นับเป็นความล้มเหลวของ MiniMax
+    """
+    if isinstance(e, MiniMaxError):
+        return e.status_code is not None
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return 400 <= e.response.status_code < 500
+    if isinstance(e, aiohttp.ClientResponseError):
+        return 400 <= e.status < 500
+    return False
+
+
+def _minimax_failed() -> None:
+    C_MINIMAX.inc("failure")
+    minimax_breaker.failure()
+
+
+def _minimax_hedged(attempt, read_timeout: float, chars: int):
+    """รันครั้งแรก ถ้าเกิน p95 ยังไม่เสร็จยิงคำขอที่ 2 เอาอันที่สำเร็จก่อน"""
+    delay = _minimax_latency.percentile(0.95, chars)
+    if delay is None:
+        return attempt(read_timeout)
+    executor = _get_hedge_executor()
+    first = executor.submit(attempt, read_timeout)
+    try:
+        return first.result(timeout=delay)
+    except FutureTimeout:
+        pass
+    C_MINIMAX.inc("hedge")
+    second = executor.submit(attempt, read_timeout)
+    pending, error = {first, second}, None
+    while pending:
+        done, pending = futures_wait(pending, return_when=FIRST_COMPLETED)
+        for f in done:
+            if f.exception() is None:
+                if f is second:
+                    C_MINIMAX.inc("hedge_win")
+                # อันที่ช้ากว่ายกเลิกกลางทางไม่ได้ (requests) ปล่อยให้จบเองแล้วทิ้งผล
+                return f.result()
+            error = f.exception()
+    raise error
+
+
+def minimax_call(attempt, chars: int, hedge: bool = True):
+    """
+    เรียก attempt(read_timeout) ผ่าน circuit breaker + retry (+ hedge ถ้าเปิด)
+    วงจรเปิดอยู่ raise MiniMaxUnavailable ทันที
+    """
+    error = None
+    for i in range(MINIMAX_MAX_ATTEMPTS):
+        minimax_breaker.before_call()
+        C_MINIMAX.inc("attempt" if i == 0 else "retry")
+        read_timeout = _minimax_read_timeout(chars)
+        t0 = time.monotonic()
+        try:
+            if hedge and MINIMAX_HEDGE:
+                result = _minimax_hedged(attempt, read_timeout, chars)
+            else:
+                result = attempt(read_timeout)
+        except Exception as e:
+            retriable, wait = _minimax_retry_plan(e, i)
+            if not retriable:
+                if _minimax_rejected(e):
+                    minimax_breaker.success()
+                else:
+                    _minimax_failed()
+                raise
+            count_error(e)
+            _minimax_failed()
+            error = e
+            if i + 1 < MINIMAX_MAX_ATTEMPTS:
+                time.sleep(wait)
+            continue
+        minimax_breaker.success()
+        _minimax_latency.add(time.monotonic() - t0, chars)
+        return result
+    raise error
+
+
+async def _aio_minimax_hedged(attempt, read_timeout: float, chars: int):
+    delay = _minimax_latency.percentile(0.95, chars)
+    if delay is None:
+        return await attempt(read_timeout)
+    tasks = [asyncio.ensure_future(attempt(read_timeout))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return tasks[0].result()
+        C_MINIMAX.inc("hedge")
+        tasks.append(asyncio.ensure_future(attempt(read_timeout)))
+        pending, error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    if t is tasks[1]:
+                        C_MINIMAX.inc("hedge_win")
+                    return t.result()
+                error = t.exception()
+        raise error
+    finally:
+        # โหมด asyncio ยกเลิกคำขอที่แพ้ได้จริง
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+
+
+async def aio_minimax_call(attempt, chars: int, hedge: bool = True):
+    """เหมือน minimax_call แต่ attempt(read_timeout) เป็น coroutine"""
+    error = None
+    for i in range(MINIMAX_MAX_ATTEMPTS):
+        minimax_breaker.before_call()
+        C_MINIMAX.inc("attempt" if i == 0 else "retry")
+        read_timeout = _minimax_read_timeout(chars)
+        t0 = time.monotonic()
+        try:
+            if hedge and MINIMAX_HEDGE:
+                result = await _aio_minimax_hedged(attempt, read_timeout, chars)
+            else:
+                result = await attempt(read_timeout)
+        except Exception as e:
+            retriable, wait = _minimax_retry_plan(e, i)
+            if not retriable:
+                if _minimax_rejected(e):
+                    minimax_breaker.success()
+                else:
+                    _minimax_failed()
+                raise
+            count_error(e)
+            _minimax_failed()
+            error = e
+            if i + 1 < MINIMAX_MAX_ATTEMPTS:
+                await asyncio.sleep(wait)
+            continue
+        minimax_breaker.success()
+        _minimax_latency.add(time.monotonic() - t0, chars)
+        return result
+    raise error
+
+
+def minimax_resilience_stats() -> dict:
+    return dict(minimax_breaker.snapshot(),
+                events={lv: c[0] for lv, c in C_MINIMAX._collect().items()},
+                p95_sec=_minimax_latency.percentile(0.95, 0),
+                timeout_sec=_minimax_read_timeout(0))
+
+
+def tts_failure_messages(e: Exception) -> list:
+    """ข้อความแจ้งผู้ใช้เมื่อทำเสียงไม่สำเร็จ"""
+    if isinstance(e, MiniMaxUnavailable):
+        return [TextSendMessage(text=f"⚠️ MiniMax ขัดข้องชั่วคราว ลองใหม่ในอีกประมาณ {math.ceil(e.retry_after)} วินาทีครับ")]
+    return [TextSendMessage(text=f"❌ ทำเสียงไม่สำเร็จ: {e}")]
+
+
+# =======================
+# ✅ NEW: MiniMax streaming (SSE) -> เขียนลงไฟล์ทีละ chunk
+# =======================
+# MINIMAX_STREAM=1 ใช้โหมด stream (หน่วยความจำต่องานคงที่ ไม่ต้องถือ hex ทั้งก้อน)
+MINIMAX_STREAM = os.getenv("MINIMAX_STREAM", "0").strip().lower() in ("1", "true", "yes")
+
+_synth_stats_lock = threading.Lock()
+_synth_stats = {
+    mode: {"jobs": 0, "first_byte_sec": 0.0, "total_sec": 0.0, "bytes": 0}
+    for mode in ("sync", "stream", "chunked")
+}
+
+
+def _record_synth(mode: str, first_byte_sec: float, total_sec: float, nbytes: int) -> None:
+    with _synth_stats_lock:
+        st = _synth_stats[mode]
+        st["jobs"] += 1
+        st["first_byte_sec"] += first_byte_sec
+        st["total_sec"] += total_sec
+        st["bytes"] += nbytes
+
+
+def synth_stats() -> dict:
+    """
+    ค่าเฉลี่ยต่องานของแต่ละโหมด ใช้เทียบ sync กับ stream
+    (หน่วยความจำเทียบด้วย bench/loadtest.py --env MINIMAX_STREAM=0/1 ที่วัด peak RSS ต่อ process ต่อโหมด)
+    """
+    out = {}
+    with _synth_stats_lock:
+        for mode, st in _synth_stats.items():
+            n = st["jobs"] or 1
+            out[mode] = {
+                "jobs": st["jobs"],
+                "avg_first_byte_sec": round(st["first_byte_sec"] / n, 3),
+                "avg_total_sec": round(st["total_sec"] / n, 3),
+                "avg_bytes": st["bytes"] // n,
+            }
+    return out
+
+
+# ✅ NEW: ขนาดไฟล์แยกตาม audio profile + byte ที่ประหยัดได้เทียบกับ AUDIO_PROFILE_BASELINE
+# (ความยาวเสียงเท่ากัน ที่ bitrate ของ baseline จะได้ไฟล์ราว duration * bitrate / 8)
+C_AUDIO_PROFILE_FILES = Counter("pea_audio_profile_files_total", "จำนวนไฟล์เสียงที่ทำใหม่แยกตาม audio profile", "profile")
+C_AUDIO_PROFILE_BYTES = Counter("pea_audio_profile_bytes_total", "ขนาดไฟล์เสียงที่ทำใหม่แยกตาม audio profile", "profile")
+C_AUDIO_PROFILE_SAVED = Counter("pea_audio_profile_saved_bytes_total",
+                                "byte ที่ประหยัดได้เทียบกับ profile baseline", "profile")
+
+
+def record_audio_profile(profile: str, fname: str, nbytes: int) -> None:
+    profile = audio_profile_name(profile)
+    baseline = AUDIO_PROFILES[AUDIO_PROFILE_BASELINE]["bitrate"] * audio_duration_ms(fname, 0) // 8000
+    C_AUDIO_PROFILE_FILES.inc(profile)
+    C_AUDIO_PROFILE_BYTES.inc(profile, nbytes)
+    C_AUDIO_PROFILE_SAVED.inc(profile, max(0, baseline - nbytes))
+
+
+def audio_profile_stats() -> dict:
+    files = C_AUDIO_PROFILE_FILES._collect()
+    nbytes = C_AUDIO_PROFILE_BYTES._collect()
+    saved = C_AUDIO_PROFILE_SAVED._collect()
+    out = {}
+    for profile, cell in sorted(files.items()):
+        b = nbytes.get(profile, [0])[0]
+        s = saved.get(profile, [0])[0]
+        out[profile] = {
+            "files": cell[0],
+            "bytes": b,
+            "saved_bytes": s,
+            "saved_pct": round(100 * s / (b + s), 1) if b + s else 0.0,
+        }
+    return out
+
+
+@timed(H_MINIMAX_T2A, "stream")
+def minimax_t2a_stream_to_file(text: str, voice_id: str, dest_path: str, profile: str = None) -> int:
+    """
+    เรียก t2a_v2 แบบ stream=True แล้ว decode hex แต่ละ chunk เขียนต่อท้ายไฟล์ทันที
+    เขียนลงไฟล์ temp ก่อน เสร็จแล้วค่อย os.replace ไป dest_path
+    คืนจำนวน byte ที่เขียน
+    """
+    _require_minimax()
+
+    url = f"{MINIMAX_BASE_URL}/v1/t2a_v2"
+
+    payload = build_t2a_stream_payload(text, voice_id, profile)
+    count_tts_chars(len(payload["text"]))
+
+    t0 = time.monotonic()
+
+    def attempt(read_timeout):
+        # ลองใหม่ = เริ่มไฟล์ temp ใหม่ทั้งไฟล์ (byte แรกนับจากต้นรอบนี้ ไม่รวมรอบที่พัง/backoff)
+        started = time.monotonic()
+        first_byte_sec = None
+        written = 0
+        tmp = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with http_session("minimax").post(url, headers=_minimax_headers(), json=payload,
+                                              timeout=(HTTP_TIMEOUTS["minimax_t2a"][0], read_timeout),
+                                              stream=True) as r:
+                r.raise_for_status()
+                with open(tmp, "wb") as f:
+                    for line in r.iter_lines():
+                        audio = _decode_t2a_stream_line(line, written)
+                        if not audio:
+                            continue
+                        f.write(audio)
+                        written = f.tell()
+                        if first_byte_sec is None:
+                            first_byte_sec = time.monotonic() - started
+
+            if not written:
+                raise MiniMaxError("MiniMax stream did not return audio", retriable=True)
+
+            os.replace(tmp, dest_path)
+        finally:
+            if os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+        return written, first_byte_sec
+
+    # stream ไม่ hedge (เขียนไฟล์ปลายทางเดียวกัน)
+    written, first_byte_sec = minimax_call(attempt, len(payload["text"]), hedge=False)
+    _record_synth("stream", first_byte_sec or 0.0, time.monotonic() - t0, written)
+    return written
+
+
+def build_t2a_stream_payload(text: str, voice_id: str, profile: str = None) -> dict:
+    payload = build_t2a_payload(text, voice_id, profile)
+    payload["stream"] = True
+    # chunk สุดท้าย (status=2) ปกติจะส่งเสียงทั้งก้อนซ้ำมาอีกรอบ ขอไม่เอา
+    payload["stream_options"] = {"exclude_aggregated_audio": True}
+    return payload
+
+
+def _decode_t2a_stream_line(line: bytes, written: int) -> bytes:
+    """แปลง SSE 1 บรรทัดเป็น byte เสียง (ไม่มีเสียงคืน b"")"""
+    line = line.strip()
+    if not line.startswith(b"data:"):
+        return b""
+    data = json.loads(line[5:].strip() or b"{}")
+
+    _check_base_resp(data)
+
+    chunk = data.get("data") or {}
+    audio_hex = chunk.get("audio")
+    # กันกรณี server ยังส่งเสียงรวมมาใน chunk สุดท้าย
+    if not audio_hex or (chunk.get("status") == 2 and written):
+        return b""
+
+    try:
+        return bytes.fromhex(audio_hex)
+    except ValueError as e:
+        raise RuntimeError(f"Failed to decode audio hex: {e}")
+
+
+# =======================
+# ✅ NEW: ข้อความยาว -> แบ่งท่อน ทำเสียงพร้อมกัน แล้วต่อ MP3 ระดับ frame
+# =======================
+_chunk_executor = None
+_chunk_executor_lock = threading.Lock()
+
+# จุดตัด: ขึ้นบรรทัดใหม่ > จบประโยค > ช่องว่าง (ภาษาไทยใช้ช่องว่างคั่นประโยค)
+_SPLIT_PATTERNS = [r"\n+", r"(?<=[.!?。！？ฯ])\s*", r"\s+"]
+
+
+def split_tts_text(text: str, max_chars: int) -> list:
+    """แบ่งข้อความเป็นท่อนละไม่เกิน max_chars โดยตัดที่ขอบบรรทัด/ประโยค/ช่องว่างก่อน"""
+    text = text.strip()
+    if len(text) <= max_chars:
+        return [text] if text else []
+
+    def pieces(t, level):
+        if len(t) <= max_chars:
+            return [t]
+        if level >= len(_SPLIT_PATTERNS):
+            # ไม่มีช่องว่างเลย ตัดตรงๆ
+            return [t[i:i + max_chars] for i in range(0, len(t), max_chars)]
+        out = []
+        for part in re.split(_SPLIT_PATTERNS[level], t):
+            part = part.strip()
+            if part:
+                out += pieces(part, level + 1)
+        return out
+
+    # รวมชิ้นเล็กๆ กลับให้ได้ท่อนใหญ่สุดที่ไม่เกิน max_chars
+    chunks = []
+    for piece in pieces(text, 0):
+        if chunks and len(chunks[-1]) + 1 + len(piece) <= max_chars:
+            chunks[-1] = f"{chunks[-1]} {piece}"
+        else:
+            chunks.append(piece)
+    return chunks
+
+
+def _get_chunk_executor() -> ThreadPoolExecutor:
+    global _chunk_executor
+    with _chunk_executor_lock:
+        if _chunk_executor is None:
+            _chunk_executor = ThreadPoolExecutor(max_workers=TTS_CHUNK_WORKERS, thread_name_prefix="tts-chunk")
+        return _chunk_executor
+
+
+def minimax_t2a_chunked(text: str, voice_id: str, profile: str = None) -> bytes:
+    """ทำเสียงทีละท่อนพร้อมกัน แล้วต่อ MP3 frame ตามลำดับ (ไม่ encode ใหม่)"""
+    chunks = split_tts_text(_clean_text_for_tts(text), TTS_CHUNK_CHARS)
+    if len(chunks) <= 1:
+        return minimax_t2a_sync(text, voice_id=voice_id, profile=profile)
+    parts = list(_get_chunk_executor().map(lambda c: minimax_t2a_sync(c, voice_id=voice_id, profile=profile), chunks))
+    return mp3_concat(parts)
+
+
+def synthesize_to_cache(key: str, text: str, voice_id: str, profile: str = None) -> str:
+    """ทำเสียงแล้วเก็บเข้า cache ตามโหมดที่ตั้งไว้ คืนชื่อไฟล์"""
+    ensure_audio_janitor()
+
+    if len(_clean_text_for_tts(text)) > TTS_CHUNK_CHARS:
+        t0 = time.monotonic()
+        with span("minimax_chunked"):
+            mp3_bytes = minimax_t2a_chunked(text, voice_id, profile)
+        with span("disk_write"):
+            fname = tts_cache_store(key, mp3_bytes)
+        size = len(mp3_bytes)
+        elapsed = time.monotonic() - t0
+        _record_synth("chunked", elapsed, elapsed, size)
+    elif MINIMAX_STREAM:
+        fpath = tts_cache_path(key)
+        with span("minimax_stream"):
+            size = minimax_t2a_stream_to_file(text, voice_id, fpath, profile)
+        fname = os.path.basename(fpath)
+    else:
+        t0 = time.monotonic()
+        with span("minimax_sync"):
+            mp3_bytes = minimax_t2a_sync(text, voice_id=voice_id, profile=profile)
+        with span("disk_write"):
+            fname = tts_cache_store(key, mp3_bytes)
+        size = len(mp3_bytes)
+        # โหมด sync: byte แรกถึงดิสก์พร้อมกับตอนเสร็จ
+        elapsed = time.monotonic() - t0
+        _record_synth("sync", elapsed, elapsed, size)
+
+    with span("audio_index"):
+        audio_index_add(fname, size)
+    record_audio_profile(profile, fname, size)
+    with span("shared_publish"):
+        publish_shared_audio(fname)
+    return fname
+
+
+def synthesize_coordinated(key: str, text: str, voice_id: str, profile: str = None) -> str:
+    """
+    หลาย instance: ทำเสียงเฉพาะ instance ที่ได้ lease ของ key นี้
+    ที่เหลือรอจนไฟล์ขึ้น store ร่วม (คนทำพัง/ตาย lease หมดอายุแล้ว instance อื่นยึดทำต่อ)
+    """
+    return _synthesize_coordinated(key, text, voice_id, profile)[0]
+
+
+def _synthesize_coordinated(key: str, text: str, voice_id: str, profile: str = None,
+                            record_hit: bool = True) -> tuple:
+    """เหมือน synthesize_coordinated แต่คืน (ชื่อไฟล์, process นี้เรียก MiniMax เองหรือไม่)"""
+    if shared_store is None:
+        return synthesize_to_cache(key, text, voice_id, profile), True
+
+    lease = f"leases/{key}"
+    with span("shared_wait"):
+        while not shared_store.claim(lease, INSTANCE_ID, STORAGE_LEASE_SEC):
+            fname = tts_cache_lookup(key, record_miss=False, record_hit=record_hit)
+            if fname:
+                return fname, False
+            time.sleep(STORAGE_POLL_SEC)
+    try:
+        # ระหว่างรอ lease อาจมีคนทำเสร็จพอดี
+        fname = tts_cache_lookup(key, record_miss=False, record_hit=record_hit)
+        if fname:
+            return fname, False
+        return synthesize_to_cache(key, text, voice_id, profile), True
+    finally:
+        try:
+            shared_store.release(lease, INSTANCE_ID)
+        except Exception as e:
+            count_error(e)
+
+
+def minimax_get_voice_list() -> dict:
+    _require_minimax()
+    # โหมด asyncio: เรียกผ่าน aiohttp บน event loop เหมือนงาน MiniMax อื่น (คนเรียกเป็น thread เบื้องหลัง)
+    if ASYNC_MODE:
+        return run_async(aio_minimax_get_voice_list()).result()
+    url = f"{MINIMAX_BASE_URL}/v1/get_voice"
+    r = http_session("minimax").post(url, headers=_minimax_headers(), json={"voice_type": "all"},
+                                    timeout=HTTP_TIMEOUTS["minimax_voices"])
+    r.raise_for_status()
+    return r.json()
+
+
+# =======================
+# ✅ NEW: Voice catalog (cache ใน memory + ไฟล์, refresh เบื้องหลัง)
+# =======================
+VOICE_CATALOG_PATH = os.getenv("VOICE_CATALOG_PATH", "/tmp/pea_voice_catalog.json")
+VOICE_CATALOG_TTL_SEC = int(os.getenv("VOICE_CATALOG_TTL_SEC", "3600"))
+# voice_id ที่ไม่เจอใน catalog: ถ้า catalog เก่ากว่านี้ (วินาที) โหลดใหม่ 1 ครั้งก่อนตัดสินว่าไม่มีจริง
+VOICE_CATALOG_RECHECK_SEC = int(os.getenv("VOICE_CATALOG_RECHECK_SEC", "60"))
+VOICES_PAGE_SIZE = 10
+
+_voice_lock = threading.Lock()
+_voice_catalog = {
+    "voices": [],      # [{"voice_id", "name", "type"}]
+    "by_id": {},
+    "by_name": {},     # ชื่อที่ normalize แล้ว -> [voice]
+    "fetched_at": 0.0,
+    "loaded": False,
+    "refreshing": False,
+    "last_error": None,
+}
+
+
+def _normalize_voice_name(name: str) -> str:
+    n = unicodedata.normalize("NFKC", name or "").lower()
+    return re.sub(r"[\s_\-]+", "", n)
+
+
+def _flatten_voice_list(data) -> list:
+    """รวมรายการเสียงจาก schema ที่เป็นไปได้ทั้งหมดของ get_voice"""
+    voices = []
+    if isinstance(data, dict):
+        for key in ["system_voice", "voice_cloning", "voice_generation", "voices", "data"]:
+            v = data.get(key)
+            if isinstance(v, dict) and isinstance(v.get("voices"), list):
+                v = v["voices"]
+            if not isinstance(v, list):
+                continue
+            for item in v:
+                if not isinstance(item, dict):
+                    continue
+                vid = item.get("voice_id") or item.get("id") or item.get("voiceId")
+                if not vid:
+                    continue
+                name = item.get("name") or item.get("voice_name") or item.get("title") or vid
+                voices.append({"voice_id": vid, "name": name, "type": key})
+    return voices
+
+
+def _set_voice_catalog(voices: list, fetched_at: float) -> None:
+    by_id = {}
+    by_name = {}
+    for v in voices:
+        if v["voice_id"] in by_id:
+            continue
+        by_id[v["voice_id"]] = v
+        by_name.setdefault(_normalize_voice_name(v["name"]), []).append(v)
+    with _voice_lock:
+        _voice_catalog["voices"] = list(by_id.values())
+        _voice_catalog["by_id"] = by_id
+        _voice_catalog["by_name"] = by_name
+        _voice_catalog["fetched_at"] = fetched_at
+        _voice_catalog["loaded"] = True
+
+
+def _load_voice_catalog_file() -> None:
+    try:
+        with open(VOICE_CATALOG_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        _set_voice_catalog(data.get("voices") or [], float(data.get("fetched_at") or 0))
+    except Exception:
+        with _voice_lock:
+            _voice_catalog["loaded"] = True
+
+
+def refresh_voice_catalog() -> None:
+    """ดึงรายการเสียงจาก MiniMax แล้วเก็บทั้ง memory และไฟล์ (พังก็เก็บ error ไว้ ไม่ทิ้งของเดิม)"""
+    try:
+        voices = _flatten_voice_list(minimax_get_voice_list())
+        if not voices:
+            raise RuntimeError("ไม่พบรายการเสียง หรือ schema เปลี่ยน")
+        now = time.time()
+        _set_voice_catalog(voices, now)
+        with _voice_lock:
+            _voice_catalog["last_error"] = None
+
+        tmp = f"{VOICE_CATALOG_PATH}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"fetched_at": now, "voices": voices}, f, ensure_ascii=False)
+            os.replace(tmp, VOICE_CATALOG_PATH)
+        except OSError:
+            pass
+    except Exception as e:
+        with _voice_lock:
+            _voice_catalog["last_error"] = str(e)
+        raise
+    finally:
+        with _voice_lock:
+            _voice_catalog["refreshing"] = False
+
+
+def _refresh_voice_catalog_bg() -> None:
+    try:
+        refresh_voice_catalog()
+    except Exception:
+        pass
+
+
+def get_voice_catalog() -> list:
+    """
+    รายการเสียงจาก cache
+    - ยังไม่มีทั้งใน memory และไฟล์: โหลดจาก MiniMax ทันที (พังจะ raise)
+    - เก่าเกิน TTL: คืนของเดิมไปก่อน แล้ว refresh เบื้องหลัง
+    """
+    with _voice_lock:
+        loaded = _voice_catalog["loaded"]
+    if not loaded:
+        _load_voice_catalog_file()
+
+    with _voice_lock:
+        voices = _voice_catalog["voices"]
+        stale = time.time() - _voice_catalog["fetched_at"] > VOICE_CATALOG_TTL_SEC
+        start_bg = bool(voices) and stale and not _voice_catalog["refreshing"]
+        if start_bg:
+            _voice_catalog["refreshing"] = True
+
+    if not voices:
+        refresh_voice_catalog()
+        with _voice_lock:
+            return _voice_catalog["voices"]
+
+    if start_bg:
+        threading.Thread(target=_refresh_voice_catalog_bg, daemon=True).start()
+    return voices
+
+
+def find_voices(query: str) -> list:
+    """ค้นหาจาก voice_id ตรงตัว, ชื่อ normalize ตรงตัว, แล้วค่อยชื่อ/voice_id ที่มีคำค้น"""
+    get_voice_catalog()
+    q = _normalize_voice_name(query)
+    with _voice_lock:
+        exact = _voice_catalog["by_id"].get(query.strip())
+        if exact:
+            return [exact]
+        named = _voice_catalog["by_name"].get(q)
+        if named:
+            return list(named)
+        return [
+            v for v in _voice_catalog["voices"]
+            if q in _normalize_voice_name(v["name"]) or q in v["voice_id"].lower()
+        ]
+
+
+def is_known_voice(voice_id: str) -> bool:
+    """เช็ค voice_id กับ catalog (ไม่เจอและ catalog เก่า -> โหลดใหม่ 1 ครั้ง)"""
+    if voice_id == DEFAULT_VOICE_ID:
+        return True
+    get_voice_catalog()
+    with _voice_lock:
+        if voice_id in _voice_catalog["by_id"]:
+            return True
+        recheck = time.time() - _voice_catalog["fetched_at"] > VOICE_CATALOG_RECHECK_SEC
+    if recheck:
+        refresh_voice_catalog()
+        with _voice_lock:
+            return voice_id in _voice_catalog["by_id"]
+    return False
+
+
+def format_voice_page(voices: list, page: int, title: str) -> str:
+    pages = max(1, (len(voices) + VOICES_PAGE_SIZE - 1) // VOICES_PAGE_SIZE)
+    page = min(max(1, page), pages)
+    start = (page - 1) * VOICES_PAGE_SIZE
+    lines = [f"{title} (หน้า {page}/{pages}, ทั้งหมด {len(voices)} เสียง):"]
+    for i, v in enumerate(voices[start:start + VOICES_PAGE_SIZE], start + 1):
+        lines.append(f"{i}. {v['name']}\nvoice_id: {v['voice_id']}")
+    if page < pages:
+        lines.append(f"\nหน้าถัดไป: /voices {page + 1}")
+    return "\n".join(lines)
+
+
+# =======================
+# Background job
+# =======================
+def _audio_result_messages(fname: str) -> list:
+    """ข้อความที่ส่งกลับเมื่อได้ไฟล์เสียงแล้ว (เสียง + ลิงก์วนเล่น + ลิงก์ดาวน์โหลด)"""
+    cleaned_base = _clean_base_url(BASE_URL)
+    if not cleaned_base.startswith("https://"):
+        msg = (
+            "❌ ส่งเสียงใน LINE ไม่ได้ เพราะ BASE_URL ต้องเป็น https://...\n"
+            "ไปตั้ง BASE_URL ใน Render ให้เป็นบรรทัดเดียว เช่น:\n"
+            "https://pea-linebot.onrender.com"
+        )
+        return [TextSendMessage(text=msg)]
+
+    audio_url = build_https_url(cleaned_base, f"/audio/{fname}")
+    play_url = build_https_url(cleaned_base, f"/play/{fname}")  # ✅ เพิ่ม: หน้า loop
+
+    return [
+        # ส่งเสียงเข้า LINE (เหมือนเดิม)
+        # ✅ แก้: ใช้ความยาวจริงจาก MP3 frame header แทน 30000 ตายตัว
+        AudioSendMessage(
+            original_content_url=audio_url,
+            duration=audio_duration_ms(fname)
+        ),
+        # ✅ เพิ่ม: ลิงก์หน้าวนเสียงอัตโนมัติ
+        TextSendMessage(text=f"🔁 เปิดหน้าวนเล่นอัตโนมัติ: {play_url}"),
+        # ลิงก์เดิมสำหรับดาวน์โหลด MP3
+        TextSendMessage(text=f"ดาวน์โหลดไฟล์ MP3: {audio_url}"),
+    ]
+
+
+def _tts_job_begin(key: str):
+    """อ่านงานจาก inflight แล้วบันทึกเวลารอคิวลง trace คืน (job, traces)"""
+    with _tts_inflight_lock:
+        job = _tts_inflight[key]
+        started = time.perf_counter()
+        job["started"] = started
+        for tr, queued_at in job["traces"]:
+            tr.add("tts_queue", queued_at, started)
+        return job, [tr for tr, _ in job["traces"]]
+
+
+def _tts_job_end(key: str, job: dict) -> list:
+    """ปิดงานก่อนส่ง: คนที่ขอหลังจากนี้จะเจอ cache หรือเริ่มงานใหม่ คืน traces ทั้งหมด"""
+    with _tts_inflight_lock:
+        _tts_inflight.pop(key, None)
+        _tts_owner_load[job["owner"]] -= 1
+        if _tts_owner_load[job["owner"]] <= 0:
+            del _tts_owner_load[job["owner"]]
+        # เวลาทำงานเฉลี่ย (EWMA) ใช้ประเมินว่าควรบอกให้ลองใหม่อีกกี่วินาที
+        elapsed = time.perf_counter() - job["started"]
+        _tts_job_time["ewma"] += 0.2 * (elapsed - _tts_job_time["ewma"])
+        # รวม trace ที่มา join หลัง _tts_job_begin
+        return [tr for tr, _ in job["traces"]]
+
+
+def tts_background_job(key: str):
+    """ทำเสียง 1 งาน แล้วส่งผลให้ทุก target ที่รอเสียงเดียวกันอยู่"""
+    job, traces = _tts_job_begin(key)
+
+    with use_traces(traces):
+        try:
+            # ✅ NEW: ถ้ามีเสียงเดิมใน cache ไม่ต้องเรียก MiniMax
+            with span("cache_lookup"):
+                fname = tts_cache_lookup(key)
+            if not fname:
+                fname = synthesize_coordinated(key, job["text"], job["voice_id"], job["profile"])
+            messages = _audio_result_messages(fname)
+
+        except Exception as e:
+            count_error(e)
+            messages = tts_failure_messages(e)
+
+        traces = _tts_job_end(key, job)
+
+        for target_id in job["targets"]:
+            try:
+                send_messages(target_id, messages, retry_key=job["retry_keys"][target_id])
+                journal_finish(target_id, key, "done")
+            except Exception as e:
+                count_error(e)
+                journal_finish(target_id, key, "failed")
+
+    for tr in traces:
+        tr.release()
+
+
+# =======================
+# ✅ NEW: Admission control ต่อ target / ผู้ใช้ (token bucket)
+# =======================
+# ใช้กับงานที่ต้องเรียก MiniMax จริงเท่านั้น (cache hit / รวมกับงานเดิมไม่นับ) แอดมินไม่ติด
+# rate เป็นครั้งต่อนาที burst = ขอติดกันได้กี่ครั้งก่อนต้องรอ
+TTS_TARGET_RATE_PER_MIN = float(os.getenv("TTS_TARGET_RATE_PER_MIN", "6"))
+TTS_TARGET_BURST = float(os.getenv("TTS_TARGET_BURST", "5"))
+TTS_USER_RATE_PER_MIN = float(os.getenv("TTS_USER_RATE_PER_MIN", "3"))
+TTS_USER_BURST = float(os.getenv("TTS_USER_BURST", "3"))
+TTS_ADMISSION_MAX_KEYS = int(os.getenv("TTS_ADMISSION_MAX_KEYS", "10000"))
+
+C_TTS_ADMISSION = Counter("pea_tts_admission_total", "ผลการรับงานทำเสียง", "result")
+
+_admission_lock = threading.Lock()
+_admission_buckets = OrderedDict()  # "t:<target>" / "u:<user>" -> _TokenBucket (LRU)
+
+
+def _admission_bucket(name: str, rate_per_min: float, burst: float) -> _TokenBucket:
+    with _admission_lock:
+        bucket = _admission_buckets.get(name)
+        if bucket is None:
+            bucket = _TokenBucket(rate_per_min / 60.0, burst)
+            _admission_buckets[name] = bucket
+            while len(_admission_buckets) > TTS_ADMISSION_MAX_KEYS:
+                _admission_buckets.popitem(last=False)
+        else:
+            _admission_buckets.move_to_end(name)
+        return bucket
+
+
+def tts_admission(target_id: str, user_id: str) -> float:
+    """คืน 0 = รับงาน, มากกว่า 0 = ต้องรออีกกี่วินาที (ไม่ตัด token ถ้าไม่ผ่าน)"""
+    user_bucket = None
+    if user_id and TTS_USER_RATE_PER_MIN > 0:
+        user_bucket = _admission_bucket(f"u:{user_id}", TTS_USER_RATE_PER_MIN, TTS_USER_BURST)
+        wait = user_bucket.try_acquire()
+        if wait:
+            C_TTS_ADMISSION.inc("rate_limited_user")
+            return wait
+
+    if target_id and TTS_TARGET_RATE_PER_MIN > 0:
+        wait = _admission_bucket(f"t:{target_id}", TTS_TARGET_RATE_PER_MIN, TTS_TARGET_BURST).try_acquire()
+        if wait:
+            if user_bucket is not None:
+                user_bucket.refund()
+            C_TTS_ADMISSION.inc("rate_limited_target")
+            return wait
+
+    C_TTS_ADMISSION.inc("admitted")
+    return 0.0
+
+
+def tts_admission_refund(target_id: str, user_id: str) -> None:
+    """คืน token ที่ tts_admission ตัดไป เมื่องานไม่ได้เข้าคิวจริง (คิวเต็ม / ห้องเต็ม / รวมกับงานเดิม)"""
+    if user_id and TTS_USER_RATE_PER_MIN > 0:
+        _admission_bucket(f"u:{user_id}", TTS_USER_RATE_PER_MIN, TTS_USER_BURST).refund()
+    if target_id and TTS_TARGET_RATE_PER_MIN > 0:
+        _admission_bucket(f"t:{target_id}", TTS_TARGET_RATE_PER_MIN, TTS_TARGET_BURST).refund()
+    C_TTS_ADMISSION.inc("refunded")
+
+
+# =======================
+# ✅ NEW: TTS worker pool (จำกัดจำนวน thread + คิว + รวมงานซ้ำ)
+# =======================
+# งานที่รอคิวได้สูงสุด เกินนี้ตอบ "ไม่ว่าง" ทันที
+TTS_QUEUE_MAX = max(1, int(os.getenv("TTS_QUEUE_MAX", "20")))
+# งานที่ค้าง (รอคิว + กำลังทำ) ได้สูงสุดต่อ target กันกลุ่มเดียวยึดคิวทั้งหมด
+TTS_TARGET_MAX_PENDING = max(1, int(os.getenv("TTS_TARGET_MAX_PENDING", "5")))
+
+# ลำดับความสำคัญ (เลขน้อยได้ก่อน): ประกาศดับไฟที่บอทสร้างเอง > แอดมิน > ทั่วไป
+TTS_PRIORITY_OUTAGE = 0
+TTS_PRIORITY_ADMIN = 1
+TTS_PRIORITY_NORMAL = 2
+
+
+class FairQueue:
+    """
+    คิวงานแบบ priority + round-robin ต่อ owner (target_id)
+    priority ต่ำกว่าได้ก่อนเสมอ ใน priority เดียวกันหยิบจากแต่ละ target สลับกันทีละงาน
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._classes = {}  # priority -> OrderedDict(owner -> deque[item])
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def qsize(self) -> int:
+        return self._size
+
+    def put_nowait(self, item, owner: str, priority: int = TTS_PRIORITY_NORMAL) -> None:
+        with self._cond:
+            if self._size >= self.maxsize:
+                raise queue.Full
+            self._classes.setdefault(priority, OrderedDict()).setdefault(owner, deque()).append(item)
+            self._size += 1
+            self._cond.notify()
+
+    def promote(self, item, owner: str, priority: int) -> None:
+        """ย้ายงานที่ยังรอคิวไป priority ที่สูงขึ้น (เช่นแอดมินขอข้อความเดียวกัน)"""
+        with self._cond:
+            for prio, owners in self._classes.items():
+                if prio <= priority:
+                    continue
+                for own, items in owners.items():
+                    if item in items:
+                        items.remove(item)
+                        if not items:
+                            del owners[own]
+                        self._classes.setdefault(priority, OrderedDict()).setdefault(owner, deque()).append(item)
+                        return
+
+    def get(self):
+        with self._cond:
+            while not self._size:
+                self._cond.wait()
+            owners = self._classes[min(p for p, o in self._classes.items() if o)]
+            owner, items = owners.popitem(last=False)
+            item = items.popleft()
+            if items:
+                # ยังมีงานของ target นี้ ต่อท้ายรอบถัดไป
+                owners[owner] = items
+            self._size -= 1
+            return item
+
+
+_tts_queue = FairQueue(TTS_QUEUE_MAX)
+# key (cache key) -> {"text", "voice_id", "targets", "traces", "retry_keys", "owner", "priority"} ของงานที่อยู่ในคิว/กำลังทำ
+_tts_inflight = {}
+_tts_inflight_lock = threading.Lock()
+# owner (target_id คนแรกที่ขอ) -> จำนวนงานที่ค้าง
+_tts_owner_load = {}
+_tts_job_time = {"ewma": 5.0}
+_tts_workers = []
+
+
+def _tts_worker_loop():
+    while True:
+        key = _tts_queue.get()
+        # error หลุดออกมา (journal / trace) ต้องไม่ทำให้ worker ตาย pool ขนาดคงที่จะหายไปทีละตัว
+        try:
+            tts_background_job(key)
+        except Exception as e:
+            count_error(e)
+            print(f"[tts] job {key[:12]} failed: {e}")
+
+
+def tts_retry_after_sec() -> int:
+    """ประเมินว่าอีกกี่วินาทีคิวน่าจะว่าง (เวลางานเฉลี่ย x งานที่รอต่อ worker)"""
+    waiting = len(_tts_inflight) if ASYNC_MODE else _tts_queue.qsize() + 1
+    slots = 1 if ASYNC_MODE else TTS_WORKERS
+    return max(1, math.ceil(_tts_job_time["ewma"] * max(1, waiting) / slots))
+
+
+def _ensure_tts_workers() -> None:
+    # start ตอนใช้งานครั้งแรก (gunicorn fork แล้ว thread ก่อน fork จะไม่ตามไป)
+    with _tts_inflight_lock:
+        if _tts_workers:
+            return
+        for i in range(TTS_WORKERS):
+            t = threading.Thread(target=_tts_worker_loop, name=f"tts-worker-{i}", daemon=True)
+            t.start()
+            _tts_workers.append(t)
+
+
+def submit_tts_job(target_id: str, text: str, voice_id: str, retry_key: str = None,
+                   priority: int = TTS_PRIORITY_NORMAL, profile: str = None):
+    """
+    ส่งงานเข้าคิว คืน (status, position)
+    status: "queued" = งานใหม่, "joined" = รวมกับงานเดิมที่กำลังทำ, "busy" = คิวเต็ม,
+            "target_busy" = target นี้มีงานค้างครบ TTS_TARGET_MAX_PENDING แล้ว
+    retry_key: มีค่า = งานที่ resume จาก journal (บันทึกไว้แล้ว ใช้ retry key เดิม)
+    profile: ชื่อใน AUDIO_PROFILES (None = DEFAULT_AUDIO_PROFILE) เป็นส่วนหนึ่งของ cache key
+    """
+    if not ASYNC_MODE:
+        _ensure_tts_workers()
+    profile = audio_profile_name(profile)
+    key = tts_cache_key(build_t2a_payload(text, voice_id, profile))
+
+    # trace ของ event ที่ขอ จะจบเมื่องานทำเสียงเสร็จ
+    now = time.perf_counter()
+    traces = [(tr, now) for tr in current_traces()]
+
+    resumed = retry_key is not None
+    retry_key = retry_key or str(uuid.uuid4())
+
+    with _tts_inflight_lock:
+        job = _tts_inflight.get(key)
+        if job is not None:
+            if target_id not in job["targets"]:
+                job["targets"].append(target_id)
+                job["retry_keys"][target_id] = retry_key
+                if not resumed:
+                    journal_add(target_id, key, text, voice_id, retry_key, profile)
+            for tr, _ in traces:
+                tr.hold()
+            job["traces"] += traces
+            if priority < job["priority"] and not ASYNC_MODE:
+                job["priority"] = priority
+                _tts_queue.promote(key, job["owner"], priority)
+            return "joined", _tts_queue.qsize()
+
+        # งานด่วน (แอดมิน / ประกาศดับไฟ) ไม่ติดเพดานต่อ target
+        if priority == TTS_PRIORITY_NORMAL and _tts_owner_load.get(target_id, 0) >= TTS_TARGET_MAX_PENDING:
+            return "target_busy", _tts_owner_load[target_id]
+
+        # โหมด asyncio: ไม่มีคิว ทุกงานเริ่มทันทีบน event loop จนถึง ASYNC_TTS_MAX_INFLIGHT
+        if ASYNC_MODE:
+            if len(_tts_inflight) >= ASYNC_TTS_MAX_INFLIGHT:
+                return "busy", len(_tts_inflight)
+        else:
+            try:
+                _tts_queue.put_nowait(key, target_id, priority)
+            except queue.Full:
+                return "busy", _tts_queue.qsize()
+
+        for tr, _ in traces:
+            tr.hold()
+        _tts_inflight[key] = {"text": text, "voice_id": voice_id, "profile": profile, "targets": [target_id],
+                              "traces": traces, "retry_keys": {target_id: retry_key}, "owner": target_id,
+                              "priority": priority}
+        _tts_owner_load[target_id] = _tts_owner_load.get(target_id, 0) + 1
+        # ใส่คิว journal ใต้ lock เดียวกัน: add ต้องมาก่อน done ของงานนี้เสมอ
+        if not resumed:
+            journal_add(target_id, key, text, voice_id, retry_key, profile)
+
+    if ASYNC_MODE:
+        run_async(aio_tts_job(key))
+        return "queued", 0
+    return "queued", _tts_queue.qsize()
+
+
+# =======================
+# ✅ NEW: TTS job journal (SQLite WAL) งานไม่หายตอน restart / redeploy
+# =======================
+# 1 row ต่องานต่อ target (job_id = hash ของ target_id + cache key ซึ่งรวมข้อความและเสียงไว้แล้ว)
+# เขียนผ่าน writer thread เดียว รวมหลาย op ต่อ 1 commit (รอไม่เกิน TTS_JOURNAL_FLUSH_MS)
+# เริ่ม process (และสแกนซ้ำทุก TTS_JOURNAL_RESUME_SEC): งาน pending ของ process ที่ตายไปแล้วจะถูก claim แล้วเข้าคิวใหม่
+# push ใช้ retry key ที่บันทึกไว้ ถ้าเคยส่งสำเร็จแล้ว LINE ตอบ 409 -> ไม่ส่งซ้ำ
+# Render: ถ้ามี Persistent Disk แนะนำตั้ง TTS_JOURNAL_PATH=/var/data/pea_tts_journal.sqlite3 ("" = ปิด)
+TTS_JOURNAL_PATH = os.getenv("TTS_JOURNAL_PATH", "/tmp/pea_tts_journal.sqlite3")
+TTS_JOURNAL_FLUSH_MS = float(os.getenv("TTS_JOURNAL_FLUSH_MS", "50"))
+TTS_JOURNAL_BATCH_MAX = int(os.getenv("TTS_JOURNAL_BATCH_MAX", "200"))
+TTS_JOURNAL_MAX_ATTEMPTS = int(os.getenv("TTS_JOURNAL_MAX_ATTEMPTS", "3"))
+# pending นานเกินนี้ถือว่าเจ้าของค้าง ใครก็ claim ได้
+TTS_JOURNAL_STALE_SEC = int(os.getenv("TTS_JOURNAL_STALE_SEC", "1800"))
+TTS_JOURNAL_KEEP_SEC = int(os.getenv("TTS_JOURNAL_KEEP_SEC", str(24 * 3600)))
+# สแกนหางานค้างซ้ำทุกกี่วินาที (worker ข้างๆ ตายระหว่างที่ process นี้ยังทำงานอยู่) 0 = เฉพาะตอนเริ่ม process
+TTS_JOURNAL_RESUME_SEC = int(os.getenv("TTS_JOURNAL_RESUME_SEC", "300"))
+
+H_JOURNAL_COMMIT = Histogram("pea_tts_journal_commit_seconds", "เวลา commit journal ต่อ batch")
+
+# owner = pid:instance (pid ซ้ำได้หลัง restart ใน container เลยต้องมี instance id ด้วย)
+_JOURNAL_OWNER = f"{os.getpid()}:{uuid.uuid4().hex[:12]}"
+_journal_queue = queue.Queue()
+_journal_lock = threading.Lock()
+_journal_writer = []
+_journal_stats = {"ops": 0, "batches": 0, "errors": 0, "resumed": 0}
+
+
+def _journal_connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(TTS_JOURNAL_PATH, timeout=10, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS tts_jobs ("
+        " job_id TEXT PRIMARY KEY, cache_key TEXT NOT NULL, target_id TEXT NOT NULL,"
+        " text TEXT NOT NULL, voice_id TEXT NOT NULL, retry_key TEXT NOT NULL,"
+        " state TEXT NOT NULL, owner TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+        " created REAL NOT NULL, updated REAL NOT NULL, profile TEXT NOT NULL DEFAULT 'hd-stereo')"
+    )
+    # journal เก่าก่อนมี audio profile: งานเดิมทั้งหมดเป็น hd-stereo
+    try:
+        conn.execute("ALTER TABLE tts_jobs ADD COLUMN profile TEXT NOT NULL DEFAULT 'hd-stereo'")
+    except sqlite3.OperationalError:
+        pass
+    conn.execute("CREATE INDEX IF NOT EXISTS tts_jobs_state ON tts_jobs(state, updated)")
+    return conn
+
+
+def _journal_job_id(target_id: str, key: str) -> str:
+    return hashlib.sha256(f"{target_id}\n{key}".encode("utf-8")).hexdigest()[:32]
+
+
+def _journal_put(sql: str, params: tuple) -> None:
+    if not TTS_JOURNAL_PATH:
+        return
+    _ensure_journal_writer()
+    _journal_queue.put((sql, params))
+
+
+def journal_add(target_id: str, key: str, text: str, voice_id: str, retry_key: str, profile: str) -> None:
+    now = time.time()
+    # ขอข้อความเดิมซ้ำหลังงานเก่าจบแล้ว (เช่น cache ถูกลบ) = งานใหม่ ใช้ retry key ใหม่
+    # row ยัง pending (ของ process ที่ตายไปแล้ว) ก็ให้ retry key / owner ตามงานที่กำลังทำจริง
+    # ไม่งั้น resume รอบหลังจะ push ด้วย key เก่า LINE กันส่งซ้ำไม่ได้
+    _journal_put(
+        "INSERT INTO tts_jobs (job_id, cache_key, target_id, text, voice_id, retry_key, state, owner,"
+        " attempts, created, updated, profile) VALUES (?, ?, ?, ?, ?, ?, 'pending', ?, 0, ?, ?, ?)"
+        " ON CONFLICT(job_id) DO UPDATE SET retry_key = excluded.retry_key, owner = excluded.owner,"
+        " attempts = CASE WHEN state = 'pending' THEN attempts ELSE 0 END, state = 'pending',"
+        " updated = excluded.updated",
+        (_journal_job_id(target_id, key), key, target_id, text, voice_id, retry_key, _JOURNAL_OWNER, now, now,
+         profile),
+    )
+
+
+def journal_finish(target_id: str, key: str, state: str) -> None:
+    """state: done (ส่งแล้ว) / failed (ส่งไม่สำเร็จ ไม่ลองใหม่)"""
+    _journal_put(
+        "UPDATE tts_jobs SET state = ?, updated = ? WHERE job_id = ?",
+        (state, time.time(), _journal_job_id(target_id, key)),
     )
 
 
-# ✅ เพิ่ม: หน้าเล่นเสียงแบบวน (loop)
-@app.route("/play/<path:filename>", methods=["GET"])
-def play_audio_page(filename):
-    # ป้องกัน path แปลกๆ
-    filename = os.path.basename(filename)
+def _journal_writer_loop():
+    conn = _journal_connect()
+    last_prune = 0.0
+    while True:
+        ops = [_journal_queue.get()]
+        deadline = time.monotonic() + TTS_JOURNAL_FLUSH_MS / 1000
+        while len(ops) < TTS_JOURNAL_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                ops.append(_journal_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        taken = len(ops)
+        if time.monotonic() - last_prune > 3600:
+            ops.append(("DELETE FROM tts_jobs WHERE state != 'pending' AND updated < ?",
+                        (time.time() - TTS_JOURNAL_KEEP_SEC,)))
+            last_prune = time.monotonic()
+
+        t0 = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in ops:
+                    conn.execute(sql, params)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            with _journal_lock:
+                _journal_stats["ops"] += len(ops)
+                _journal_stats["batches"] += 1
+        except Exception as e:
+            count_error(e)
+            with _journal_lock:
+                _journal_stats["errors"] += 1
+        finally:
+            H_JOURNAL_COMMIT.observe(time.perf_counter() - t0)
+            for _ in range(taken):
+                _journal_queue.task_done()
+
+
+def _ensure_journal_writer() -> None:
+    with _journal_lock:
+        if _journal_writer:
+            return
+        t = threading.Thread(target=_journal_writer_loop, name="tts-journal", daemon=True)
+        t.start()
+        _journal_writer.append(t)
+
+
+@atexit.register
+def _journal_flush_on_exit() -> None:
+    # ปิดแบบปกติ (gunicorn SIGTERM): รอ op ที่ค้างในคิว commit ให้เสร็จก่อน (สูงสุด 2 วินาที)
+    deadline = time.monotonic() + 2
+    while _journal_writer and _journal_queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def journal_stats() -> dict:
+    with _journal_lock:
+        stats = dict(_journal_stats)
+    stats["queued"] = _journal_queue.qsize()
+    return stats
+
+
+def _journal_owner_gone(owner: str) -> bool:
+    """owner เป็น process ที่ตายไปแล้ว (journal เป็นไฟล์ local จึงเช็ค pid ในเครื่องนี้ได้)"""
+    pid, _, _ = owner.partition(":")
+    if owner == _JOURNAL_OWNER:
+        return False
+    try:
+        pid = int(pid)
+    except ValueError:
+        return True
+    if pid == os.getpid():
+        # pid เดียวกันแต่คนละ instance = process ก่อน restart
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def resume_tts_journal() -> int:
+    """claim งาน pending ที่ค้างจาก process ก่อนหน้าแล้วเข้าคิวใหม่ คืนจำนวนงาน"""
+    if not TTS_JOURNAL_PATH:
+        return 0
+
+    conn = _journal_connect()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        claimed = []
+        for job_id, key, target_id, text, voice_id, retry_key, profile, owner, attempts, updated in conn.execute(
+                "SELECT job_id, cache_key, target_id, text, voice_id, retry_key, profile, owner, attempts, updated"
+                " FROM tts_jobs WHERE state = 'pending'").fetchall():
+            if not (_journal_owner_gone(owner) or updated < now - TTS_JOURNAL_STALE_SEC):
+                continue
+            if attempts >= TTS_JOURNAL_MAX_ATTEMPTS:
+                conn.execute("UPDATE tts_jobs SET state = 'failed', updated = ? WHERE job_id = ?", (now, job_id))
+                continue
+            conn.execute(
+                "UPDATE tts_jobs SET owner = ?, attempts = attempts + 1, updated = ? WHERE job_id = ?",
+                (_JOURNAL_OWNER, now, job_id),
+            )
+            claimed.append((target_id, text, voice_id, retry_key, profile))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    for target_id, text, voice_id, retry_key, profile in claimed:
+        # คิวเต็ม / target นี้งานค้างเต็มเพดานก็รอ (งานที่ค้างมาต้องไม่หาย)
+        while submit_tts_job(target_id, text, voice_id, retry_key=retry_key,
+                             profile=profile)[0] in ("busy", "target_busy"):
+            time.sleep(1)
+
+    with _journal_lock:
+        _journal_stats["resumed"] += len(claimed)
+    if claimed:
+        print(f"[journal] resumed {len(claimed)} TTS job(s)")
+    return len(claimed)
+
+
+def _resume_tts_journal_bg() -> None:
+    while True:
+        try:
+            resume_tts_journal()
+        except Exception as e:
+            count_error(e)
+            print(f"[journal] resume failed: {e}")
+        if TTS_JOURNAL_RESUME_SEC <= 0:
+            return
+        time.sleep(TTS_JOURNAL_RESUME_SEC)
+
+
+# =======================
+# ✅ NEW: IO_MODE=asyncio (MiniMax / LINE / ชีต ผ่าน aiohttp บน event loop เดียว)
+# =======================
+# handle_message ยังรันบน webhook worker เหมือนเดิม แต่ไม่ต้องรอ LINE ตอบ (ส่งต่อให้ loop)
+# งานทำเสียงเป็น task บน loop แทน TTS worker ค้างรอ MiniMax ได้เป็นร้อยงานโดยไม่กิน thread
+_aio = {"loop": None, "session": None, "pid": None}
+_aio_lock = threading.Lock()
 
-    # ถ้าไฟล์ไม่มีอยู่ ให้ 404
-    fpath = os.path.join(AUDIO_DIR, filename)
-    if not os.path.exists(fpath):
-        abort(404)
 
-    html = f"""<!doctype html>
-<html lang="th">
-<head>
-  <meta charset="utf-8" />
-  <meta name="viewport" content="width=device-width, initial-scale=1" />
-  <title>PEA Audio Loop</title>
-  <style>
-    body {{
-      margin: 0;
-      height: 100vh;
-      display: flex;
-      align-items: center;
-      justify-content: center;
-      background: #000;
-      color: #fff;
-      font-family: system-ui, -apple-system, Segoe UI, Roboto, sans-serif;
-    }}
-    .box {{ text-align: center; padding: 24px; }}
-    .title {{ font-size: 16px; opacity: .9; margin-bottom: 10px; }}
-    audio {{ width: min(92vw, 520px); }}
-    .hint {{ margin-top: 12px; font-size: 13px; opacity: .75; line-height: 1.4; }}
-    .links {{ margin-top: 12px; font-size: 13px; opacity: .85; }}
-    .links a {{ color: #7dd3fc; text-decoration: none; }}
-    .links a:hover {{ text-decoration: underline; }}
-  </style>
-</head>
-<body>
-  <div class="box">
-    <div class="title">🔁 เล่นวนอัตโนมัติ</div>
-    <audio controls autoplay loop>
-      <source src="/audio/{filename}" type="audio/mpeg" />
-    </audio>
-    <div class="hint">
-      มือถือบางรุ่นจะไม่ให้เล่นอัตโนมัติ ต้องกด ▶️ 1 ครั้งก่อน<br/>
-      หลังจากนั้นจะวนเองอัตโนมัติ
-    </div>
-    <div class="links">
-      ดาวน์โหลดไฟล์: <a href="/audio/{filename}">/audio/{filename}</a>
-    </div>
-  </div>
-</body>
-</html>"""
-    return Response(html, mimetype="text/html; charset=utf-8")
+def _aio_loop() -> asyncio.AbstractEventLoop:
+    # start ตอนใช้งานครั้งแรก และเริ่มใหม่หลัง fork (gunicorn)
+    with _aio_lock:
+        if _aio["loop"] is None or _aio["pid"] != os.getpid():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="aio-loop", daemon=True).start()
+            _aio.update(loop=loop, session=None, pid=os.getpid())
+        return _aio["loop"]
 
 
-@app.route("/callback", methods=["POST"])
-def callback():
-    signature = request.headers.get("X-Line-Signature", "")
-    body = request.get_data(as_text=True)
+def run_async(coro):
+    """ส่ง coroutine เข้า event loop คืน concurrent.futures.Future (ห้าม .result() จากใน loop)"""
+    return asyncio.run_coroutine_threadsafe(coro, _aio_loop())
 
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
-        abort(400)
 
-    return "OK"
+def _aio_session() -> aiohttp.ClientSession:
+    # เรียกจากใน loop เท่านั้น
+    if _aio["session"] is None:
+        _aio["session"] = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=ASYNC_HTTP_LIMIT))
+    return _aio["session"]
 
 
-# =======================
-# MiniMax (Sync T2A HTTP)
-# =======================
-def _require_minimax():
-    if not MINIMAX_API_KEY:
-        raise RuntimeError("MINIMAX_API_KEY not set")
+def _aio_timeout(name: str, read: float = None) -> aiohttp.ClientTimeout:
+    connect, default_read = HTTP_TIMEOUTS[name]
+    return aiohttp.ClientTimeout(sock_connect=connect, sock_read=read or default_read)
 
 
-def _minimax_headers():
-    return {
-        "Authorization": f"Bearer {MINIMAX_API_KEY}",
-        "Content-Type": "application/json",
-    }
+@timed(H_SHEET_FETCH)
+async def aio_refresh_outage_cache() -> None:
+    """เหมือน _refresh_outage_cache แต่ใช้ aiohttp"""
+    headers = _outage_conditional_headers()
+    try:
+        if not SHEET_CSV_URL:
+            rows, resp_headers = [], None
+        else:
+            async with _aio_session().get(SHEET_CSV_URL, headers=headers, timeout=_aio_timeout("sheet")) as r:
+                resp_headers = r.headers
+                if r.status == 304:
+                    rows = None
+                else:
+                    r.raise_for_status()
+                    data = await r.read()
+                    # parse CSV / สร้าง OutageIndex เป็นงาน CPU ทำใน thread ไม่ให้ loop ค้าง
+                    rows = await asyncio.to_thread(_parse_outage_csv, data)
+
+        await asyncio.to_thread(_store_outage_rows, rows, resp_headers)
+    except Exception as e:
+        _outage_refresh_failed(e)
+        raise
+    finally:
+        with _outage_lock:
+            _outage_cache["refreshing"] = False
 
 
-def _clean_text_for_tts(text: str) -> str:
-    return text.replace("\ufeff", "").replace("\u200b", "").strip()
+async def _aio_refresh_outage_cache_bg() -> None:
+    try:
+        await aio_refresh_outage_cache()
+    except Exception:
+        pass
 
 
-def minimax_t2a_sync(text: str, voice_id: str) -> bytes:
+@timed(H_MINIMAX_T2A, "sync")
+async def aio_minimax_t2a(text: str, voice_id: str, profile: str = None) -> bytes:
     _require_minimax()
 
-    url = "https://api.minimax.io/v1/t2a_v2"
+    payload = build_t2a_payload(text, voice_id, profile)
+    count_tts_chars(len(payload["text"]))
 
-    payload = {
-        "model": "speech-2.8-hd",
-        "text": _clean_text_for_tts(text),
-        "stream": False,
-        "language_boost": "Thai",
-        "voice_setting": {
-            "voice_id": voice_id,
-            "speed": 0.9,
-            "vol": 1.2,
-            "pitch": -1
-        },
-        "audio_setting": {
-            "audio_sample_rate": 32000,
-            "bitrate": 128000,
-            "format": "mp3",
-            "channel": 2
-        }
-    }
+    async def attempt(read_timeout):
+        async with _aio_session().post(f"{MINIMAX_BASE_URL}/v1/t2a_v2", headers=_minimax_headers(), json=payload,
+                                       timeout=_aio_timeout("minimax_t2a", read_timeout)) as r:
+            r.raise_for_status()
+            data = await r.json(content_type=None)
+        return _decode_t2a_response(data)
 
-    r = requests.post(url, headers=_minimax_headers(), json=payload, timeout=120)
-    r.raise_for_status()
-    data = r.json()
+    return await aio_minimax_call(attempt, len(payload["text"]))
 
-    base_resp = data.get("base_resp") or {}
-    if base_resp.get("status_code") not in (None, 0, "0"):
-        raise RuntimeError(f"MiniMax error {base_resp.get('status_code')}: {base_resp.get('status_msg')}")
 
-    audio_hex = (data.get("data") or {}).get("audio")
-    if not audio_hex:
-        raise RuntimeError(f"MiniMax did not return audio hex. Response: {str(data)[:600]}")
+async def aio_minimax_get_voice_list() -> dict:
+    """เหมือน minimax_get_voice_list แต่ใช้ aiohttp"""
+    async with _aio_session().post(f"{MINIMAX_BASE_URL}/v1/get_voice", headers=_minimax_headers(),
+                                   json={"voice_type": "all"}, timeout=_aio_timeout("minimax_voices")) as r:
+        r.raise_for_status()
+        return await r.json(content_type=None)
+
+
+async def aio_minimax_balance() -> dict:
+    """response ของ /v1/user/balance (แปลงเป็นเครดิตที่ get_minimax_credit)"""
+    async with _aio_session().get(f"{MINIMAX_BASE_URL}/v1/user/balance", headers=_minimax_headers(),
+                                  timeout=_aio_timeout("minimax_balance")) as r:
+        return await r.json(content_type=None)
 
+
+def _remove_quietly(path: str) -> None:
     try:
-        return bytes.fromhex(audio_hex)
-    except Exception as e:
-        raise RuntimeError(f"Failed to decode audio hex: {e}")
+        os.remove(path)
+    except OSError:
+        pass
 
 
-def minimax_get_voice_list() -> dict:
+@timed(H_MINIMAX_T2A, "stream")
+async def aio_minimax_t2a_stream_to_file(text: str, voice_id: str, dest_path: str, profile: str = None) -> int:
     _require_minimax()
-    url = "https://api.minimax.io/v1/get_voice"
-    r = requests.post(url, headers=_minimax_headers(), json={"voice_type": "all"}, timeout=60)
-    r.raise_for_status()
-    return r.json()
 
+    payload = build_t2a_stream_payload(text, voice_id, profile)
+    count_tts_chars(len(payload["text"]))
 
-# =======================
-# Background job
-# =======================
-def tts_background_job(target_id: str, text: str, voice_id: str):
+    t0 = time.monotonic()
+
+    async def attempt(read_timeout):
+        # byte แรกนับจากต้นรอบนี้ (ไม่รวมรอบที่พัง/backoff) เหมือนโหมด threads
+        started = time.monotonic()
+        first_byte_sec = None
+        written = 0
+        tmp = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+        # งานดิสก์ทั้งหมด (open / write / replace) ทำใน thread ไม่บล็อก loop
+        f = await asyncio.to_thread(open, tmp, "wb")
+        try:
+            try:
+                async with _aio_session().post(f"{MINIMAX_BASE_URL}/v1/t2a_v2", headers=_minimax_headers(),
+                                               json=payload, timeout=_aio_timeout("minimax_t2a", read_timeout)) as r:
+                    r.raise_for_status()
+                    # แยกบรรทัดเอง: บรรทัด SSE ที่มี hex เสียงอาจยาวเกิน limit ของ readline
+                    buf = b""
+                    async for data in r.content.iter_any():
+                        buf += data
+                        *lines, buf = buf.split(b"\n")
+                        # รวมเสียงทุกบรรทัดในก้อนนี้แล้วเขียนครั้งเดียว (ส่งเข้า thread น้อยครั้ง)
+                        audio = b""
+                        for line in lines:
+                            audio += _decode_t2a_stream_line(line, written + len(audio))
+                        if not audio:
+                            continue
+                        await asyncio.to_thread(f.write, audio)
+                        written += len(audio)
+                        if first_byte_sec is None:
+                            first_byte_sec = time.monotonic() - started
+                    audio = _decode_t2a_stream_line(buf, written)
+                    if audio:
+                        await asyncio.to_thread(f.write, audio)
+                        written += len(audio)
+            finally:
+                await asyncio.to_thread(f.close)
+
+            if not written:
+                raise MiniMaxError("MiniMax stream did not return audio", retriable=True)
+
+            await asyncio.to_thread(os.replace, tmp, dest_path)
+        finally:
+            await asyncio.to_thread(_remove_quietly, tmp)
+        return written, first_byte_sec
+
+    written, first_byte_sec = await aio_minimax_call(attempt, len(payload["text"]), hedge=False)
+    _record_synth("stream", first_byte_sec or 0.0, time.monotonic() - t0, written)
+    return written
+
+
+async def aio_minimax_t2a_chunked(text: str, voice_id: str, profile: str = None) -> bytes:
+    chunks = split_tts_text(_clean_text_for_tts(text), TTS_CHUNK_CHARS)
+    if len(chunks) <= 1:
+        return await aio_minimax_t2a(text, voice_id, profile)
+
+    # จำกัดท่อนที่ยิงพร้อมกันต่องานเท่ากับโหมด threads
+    sem = asyncio.Semaphore(TTS_CHUNK_WORKERS)
+
+    async def one(chunk):
+        async with sem:
+            return await aio_minimax_t2a(chunk, voice_id, profile)
+
+    return mp3_concat(await asyncio.gather(*(one(c) for c in chunks)))
+
+
+async def aio_synthesize_to_cache(key: str, text: str, voice_id: str, profile: str = None) -> str:
+    """เหมือน synthesize_to_cache (งานดิสก์/SQLite ทำใน thread ไม่บล็อก loop)"""
+    ensure_audio_janitor()
+
+    if len(_clean_text_for_tts(text)) > TTS_CHUNK_CHARS:
+        t0 = time.monotonic()
+        with span("minimax_chunked"):
+            mp3_bytes = await aio_minimax_t2a_chunked(text, voice_id, profile)
+        with span("disk_write"):
+            fname = await asyncio.to_thread(tts_cache_store, key, mp3_bytes)
+        size = len(mp3_bytes)
+        elapsed = time.monotonic() - t0
+        _record_synth("chunked", elapsed, elapsed, size)
+    elif MINIMAX_STREAM:
+        fpath = tts_cache_path(key)
+        with span("minimax_stream"):
+            size = await aio_minimax_t2a_stream_to_file(text, voice_id, fpath, profile)
+        fname = os.path.basename(fpath)
+    else:
+        t0 = time.monotonic()
+        with span("minimax_sync"):
+            mp3_bytes = await aio_minimax_t2a(text, voice_id, profile)
+        with span("disk_write"):
+            fname = await asyncio.to_thread(tts_cache_store, key, mp3_bytes)
+        size = len(mp3_bytes)
+        elapsed = time.monotonic() - t0
+        _record_synth("sync", elapsed, elapsed, size)
+
+    with span("audio_index"):
+        await asyncio.to_thread(audio_index_add, fname, size)
+    await asyncio.to_thread(record_audio_profile, profile, fname, size)
+    with span("shared_publish"):
+        await asyncio.to_thread(publish_shared_audio, fname)
+    return fname
+
+
+async def aio_synthesize_coordinated(key: str, text: str, voice_id: str, profile: str = None) -> str:
+    """เหมือน synthesize_coordinated (งาน store ทำใน thread)"""
+    if shared_store is None:
+        return await aio_synthesize_to_cache(key, text, voice_id, profile)
+
+    lease = f"leases/{key}"
+    with span("shared_wait"):
+        while not await asyncio.to_thread(shared_store.claim, lease, INSTANCE_ID, STORAGE_LEASE_SEC):
+            fname = await asyncio.to_thread(tts_cache_lookup, key, False)
+            if fname:
+                return fname
+            await asyncio.sleep(STORAGE_POLL_SEC)
     try:
-        # ✅ เพิ่ม: ลบไฟล์เก่า ป้องกันดิสก์เต็ม
-        cleanup_old_audio(AUDIO_MAX_AGE_SEC)
+        fname = await asyncio.to_thread(tts_cache_lookup, key, False)
+        return fname or await aio_synthesize_to_cache(key, text, voice_id, profile)
+    finally:
+        try:
+            await asyncio.to_thread(shared_store.release, lease, INSTANCE_ID)
+        except Exception as e:
+            count_error(e)
+
+
+async def _aio_call_line(kind: str, to: str, batch: list, retry_key: str = None) -> None:
+    """เหมือน _call_line: rate limiter เดียวกัน, 429 รอตาม Retry-After แล้วลองใหม่"""
+    name = f"{kind}_message"
+    body = {"replyToken": to} if kind == "reply" else {"to": to}
+    body["messages"] = [m.as_json_dict() for m in batch]
+    headers = {"Authorization": f"Bearer {CHANNEL_ACCESS_TOKEN}"}
+    if retry_key:
+        headers["X-Line-Retry-Key"] = retry_key
+
+    with span(f"line_{name}"):
+        for attempt in range(LINE_MAX_RETRIES + 1):
+            wait = _line_bucket.try_acquire()
+            while wait:
+                await asyncio.sleep(min(max(wait, 0.01), 5.0))
+                wait = _line_bucket.try_acquire()
+
+            t0 = time.perf_counter()
+            try:
+                async with _aio_session().post(f"{LINE_API_ENDPOINT}/v2/bot/message/{kind}", json=body,
+                                               headers=headers, timeout=_aio_timeout("line")) as r:
+                    if r.status >= 300:
+                        try:
+                            error_body = await r.json(content_type=None)
+                        except ValueError:
+                            error_body = {}
+                        raise LineBotApiError(
+                            status_code=r.status,
+                            headers=dict(r.headers.items()),
+                            request_id=r.headers.get("X-Line-Request-Id"),
+                            accepted_request_id=r.headers.get("X-Line-Accepted-Request-Id"),
+                            error=LineError.new_from_json_dict(error_body or {}),
+                        )
+                _count_send(api_calls=1)
+                return
+            except LineBotApiError as e:
+                if e.status_code == 409 and retry_key:
+                    _count_send(duplicate=1)
+                    return
+                count_error(e)
+                if e.status_code != 429 or attempt >= LINE_MAX_RETRIES:
+                    raise
+                _count_send(rate_limited=1)
+                _line_bucket.pause(_retry_after_sec(e, attempt))
+            finally:
+                H_LINE_API.observe(time.perf_counter() - t0, name)
+
+
+async def aio_send_calls(calls: list) -> None:
+    """ส่งตามแผนจาก _plan_sends ทีละ call ตามลำดับ"""
+    for kind, to, batch, retry_key in calls:
+        await _aio_call_line(kind, to, batch, retry_key)
+        _count_send(**{kind: 1})
+
+
+def _spawn_async_send(calls: list) -> None:
+    if not calls:
+        return
+    traces = current_traces()
+    for tr in traces:
+        tr.hold()
 
-        mp3_bytes = minimax_t2a_sync(text, voice_id=voice_id)
+    async def run():
+        with use_traces(traces):
+            try:
+                await aio_send_calls(calls)
+            except Exception as e:
+                count_error(e)
+                print(f"[line] send failed: {e}")
+            finally:
+                for tr in traces:
+                    tr.release()
 
-        fname = f"{uuid.uuid4().hex}.mp3"
-        fpath = os.path.join(AUDIO_DIR, fname)
-        with open(fpath, "wb") as f:
-            f.write(mp3_bytes)
+    run_async(run())
 
-        cleaned_base = _clean_base_url(BASE_URL)
-        if not cleaned_base.startswith("https://"):
-            msg = (
-                "❌ ส่งเสียงใน LINE ไม่ได้ เพราะ BASE_URL ต้องเป็น https://...\n"
-                "ไปตั้ง BASE_URL ใน Render ให้เป็นบรรทัดเดียว เช่น:\n"
-                "https://pea-linebot.onrender.com"
-            )
-            line_bot_api.push_message(target_id, TextSendMessage(text=msg))
-            return
 
-        audio_url = build_https_url(cleaned_base, f"/audio/{fname}")
-        play_url = build_https_url(cleaned_base, f"/play/{fname}")  # ✅ เพิ่ม: หน้า loop
+async def aio_tts_job(key: str) -> None:
+    """เหมือน tts_background_job แต่เป็น task บน event loop"""
+    job, traces = _tts_job_begin(key)
 
-        # ส่งเสียงเข้า LINE (เหมือนเดิม)
-        line_bot_api.push_message(
-            target_id,
-            AudioSendMessage(
-                original_content_url=audio_url,
-                duration=30000
-            )
-        )
+    with use_traces(traces):
+        try:
+            with span("cache_lookup"):
+                fname = await asyncio.to_thread(tts_cache_lookup, key)
+            if not fname:
+                fname = await aio_synthesize_coordinated(key, job["text"], job["voice_id"], job["profile"])
+            messages = await asyncio.to_thread(_audio_result_messages, fname)
 
-        # ✅ เพิ่ม: ลิงก์หน้าวนเสียงอัตโนมัติ
-        line_bot_api.push_message(
-            target_id,
-            TextSendMessage(text=f"🔁 เปิดหน้าวนเล่นอัตโนมัติ: {play_url}")
-        )
+        except Exception as e:
+            count_error(e)
+            messages = tts_failure_messages(e)
 
-        # ลิงก์เดิมสำหรับดาวน์โหลด MP3
-        line_bot_api.push_message(
-            target_id,
-            TextSendMessage(text=f"ดาวน์โหลดไฟล์ MP3: {audio_url}")
-        )
+        traces = _tts_job_end(key, job)
 
-    except Exception as e:
-        line_bot_api.push_message(target_id, TextSendMessage(text=f"❌ ทำเสียงไม่สำเร็จ: {e}"))
+        for target_id in job["targets"]:
+            try:
+                await aio_send_calls(_plan_sends(target_id, messages, retry_key=job["retry_keys"][target_id]))
+                journal_finish(target_id, key, "done")
+            except Exception as e:
+                count_error(e)
+                journal_finish(target_id, key, "failed")
+
+    for tr in traces:
+        tr.release()
 
 
 # =======================
@@ -476,110 +4537,250 @@ def _help_text() -> str:
     return (
         "คำสั่งที่ใช้ได้:\n"
         "1) /help = ดูคำสั่ง\n"
-        "2) /voices = ดูรายการเสียง (ตัวอย่าง)\n"
+        "2) /voices [หน้า|คำค้น] = ดู/ค้นหารายการเสียง\n"
         "3) /setvoice <voice_id> = ตั้งเสียงที่ใช้ (ล็อคทั้งบอท) [แอดมิน]\n"
         "4) /myid = ดู userId ของตัวเอง\n"
         "5) เสียง <ข้อความ> = สร้างไฟล์ MP3\n"
-        "6) ดับไฟ = ส่งประกาศดับไฟ\n\n"
+        "   เสียง @<profile> <ข้อความ> = เลือกคุณภาพเสียงเฉพาะครั้งนี้\n"
+        "6) ดับไฟ = ส่งประกาศดับไฟ\n"
+        "   ดับไฟ วันนี้ / ดับไฟ พรุ่งนี้ / ดับไฟ <พื้นที่> [หน้า N] = ค้นเฉพาะวัน/พื้นที่\n"
+        "   ดับไฟ ติดตาม / ดับไฟ เลิกติดตาม = รับ/เลิกรับแจ้งเตือนเมื่อมีรายการใหม่\n"
+        "   ดับไฟ เสียง [วันนี้|พรุ่งนี้|<พื้นที่>] = ฟังเสียงประกาศ (เตรียมไว้ล่วงหน้า)\n"
+        "7) /profile [วินาที] = จับ profile การทำงานของบอท [แอดมิน]\n"
+        "8) /audioprofile [ชื่อ|default] = ดู/ตั้งคุณภาพเสียงของห้องนี้ (ตั้งได้เฉพาะแอดมิน)\n\n"
         f"VOICE ปัจจุบัน: {get_voice_id()}\n"
         f"MAX_TTS_CHARS: {MAX_TTS_CHARS}\n"
         f"AUDIO_MAX_AGE_SEC: {AUDIO_MAX_AGE_SEC}"
     )
 
 
-@handler.add(MessageEvent, message=TextMessage)
+def _command_name(user_text: str, lower: str) -> str:
+    """ชื่อคำสั่งสำหรับ metrics (ค่าคงที่ ไม่เอาข้อความผู้ใช้ไปเป็น label)"""
+    if lower.startswith("/"):
+        cmd = lower.split(maxsplit=1)[0]
+        if cmd in ("/help", "/myid", "/voices", "/setvoice", "/profile", "/audioprofile"):
+            return cmd[1:]
+        return "unknown"
+    if user_text.startswith("ดับไฟ เสียง"):
+        return "outage_audio"
+    if user_text.startswith("ดับไฟ"):
+        return "outage"
+    if user_text.startswith("เสียง"):
+        return "tts"
+    return "other"
+
+
+@on_event(UnfollowEvent)
+@on_event(LeaveEvent)
+def handle_unsubscribe(event):
+    # ถูกบล็อก / ถูกเชิญออกจากกลุ่ม: เลิกส่งแจ้งเตือนให้ target นี้
+    target_id = event_target_id(event)
+    if target_id:
+        set_subscribed(target_id, False)
+
+
+@on_event(MessageEvent, message=TextMessage)
 def handle_message(event):
     user_text = (event.message.text or "").strip()
     lower = user_text.lower()
+    command = _command_name(user_text, lower)
+    C_COMMANDS.inc(command)
+    trace_command(command)
 
-    target_id = getattr(event.source, "group_id", None) \
-        or getattr(event.source, "room_id", None) \
-        or getattr(event.source, "user_id", None)
+    target_id = event_target_id(event)
 
     # --- help ---
     if lower == "/help":
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=_help_text()))
+        reply_to_event(event, TextSendMessage(text=_help_text()))
         return
 
     # ✅ เพิ่ม: ดู userId ของตัวเอง (เอาไว้ตั้ง ADMIN_USER_IDS)
     if lower == "/myid":
         uid = getattr(event.source, "user_id", "") or "unknown"
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"Your userId:\n{uid}"))
+        reply_to_event(event, TextSendMessage(text=f"Your userId:\n{uid}"))
         return
 
     # --- voices ---
-    if lower == "/voices":
-        try:
-            data = minimax_get_voice_list()
-
-            voices = []
-            if isinstance(data, dict):
-                for key in ["system_voice", "voice_cloning", "voice_generation", "voices", "data"]:
-                    v = data.get(key)
-                    if isinstance(v, list):
-                        voices += v
-                    elif isinstance(v, dict) and isinstance(v.get("voices"), list):
-                        voices += v["voices"]
-
-            if not voices:
-                line_bot_api.reply_message(
-                    event.reply_token,
-                    TextSendMessage(text=f"ไม่พบรายการเสียง หรือ schema เปลี่ยน:\n{str(data)[:1500]}")
-                )
-                return
-
-            lines = []
-            for i, v in enumerate(voices[:10], 1):
-                vid = v.get("voice_id") or v.get("id") or v.get("voiceId")
-                name = v.get("name") or v.get("voice_name") or v.get("title")
-                lines.append(f"{i}. {name}\nvoice_id: {vid}")
-
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="รายการเสียง (10 รายการแรก):\n" + "\n".join(lines))
-            )
+    # ✅ NEW: /voices [หน้า] หรือ /voices <คำค้น> ตอบจาก catalog ที่ cache ไว้
+    if lower == "/voices" or lower.startswith("/voices "):
+        arg = user_text[len("/voices"):].strip()
+        try:
+            if not arg or arg.isdigit():
+                voices = get_voice_catalog()
+                msg = format_voice_page(voices, int(arg or 1), "รายการเสียง")
+            else:
+                voices = find_voices(arg)
+                if not voices:
+                    msg = f"ไม่พบเสียงที่ตรงกับ \"{arg}\""
+                else:
+                    msg = format_voice_page(voices, 1, f"ผลค้นหา \"{arg}\"")
+
+            reply_to_event(event, TextSendMessage(text=msg))
             return
 
         except Exception as e:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"ดึงรายการเสียงไม่สำเร็จ: {e}"))
+            reply_to_event(event, TextSendMessage(text=f"ดึงรายการเสียงไม่สำเร็จ: {e}"))
+            return
+
+    # --- audioprofile (ต่อห้อง) ---
+    # ✅ NEW: ห้องที่ฟังในมือถือเป็นหลักใช้ mono ไฟล์เล็กกว่า ส่ง/โหลดเร็วกว่า
+    if lower == "/audioprofile" or lower.startswith("/audioprofile "):
+        if not target_id:
+            reply_to_event(event, TextSendMessage(text="ไม่พบปลายทางสำหรับตั้งค่า"))
+            return
+        arg = lower[len("/audioprofile"):].strip()
+        if not arg:
+            lines = [f"{'👉 ' if name == get_audio_profile(target_id) else '• '}{name}: "
+                     f"{p['bitrate'] // 1000} kbps {'stereo' if p['channel'] == 2 else 'mono'} "
+                     f"{p['audio_sample_rate'] // 1000} kHz"
+                     for name, p in AUDIO_PROFILES.items()]
+            reply_to_event(event, TextSendMessage(
+                text="คุณภาพเสียงของห้องนี้:\n" + "\n".join(lines) +
+                     f"\n\nค่า default: {DEFAULT_AUDIO_PROFILE}\nตั้งค่า: /audioprofile <ชื่อ|default>"
+            ))
+            return
+        if not is_admin(event):
+            reply_to_event(event, TextSendMessage(text="❌ คำสั่งนี้สำหรับแอดมินเท่านั้น"))
+            return
+        if arg != "default" and arg not in AUDIO_PROFILES:
+            reply_to_event(event, TextSendMessage(text=f"❌ ไม่รู้จัก profile: {arg}\nมี: {', '.join(AUDIO_PROFILES)}"))
             return
+        set_audio_profile(target_id, None if arg == "default" else arg)
+        reply_to_event(event, TextSendMessage(text=f"✅ ตั้งคุณภาพเสียงของห้องนี้เป็น {get_audio_profile(target_id)} แล้ว"))
+        return
 
     # --- setvoice (ล็อคทั้งบอท) ---
     if lower.startswith("/setvoice"):
         # ✅ เพิ่ม: จำกัดเฉพาะแอดมิน
         if not is_admin(event):
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ คำสั่งนี้สำหรับแอดมินเท่านั้น"))
+            reply_to_event(event, TextSendMessage(text="❌ คำสั่งนี้สำหรับแอดมินเท่านั้น"))
             return
 
         parts = user_text.split(maxsplit=1)
         if len(parts) < 2 or not parts[1].strip():
-            line_bot_api.reply_message(
-                event.reply_token,
+            reply_to_event(
+                event,
                 TextSendMessage(text=f"วิธีใช้: /setvoice <voice_id>\nเสียงปัจจุบัน: {get_voice_id()}")
             )
             return
 
         new_voice = parts[1].strip()
+        # ✅ NEW: เช็คกับ catalog ก่อนบันทึก กันพิมพ์ผิดแล้วไปพังตอนทำเสียง
+        try:
+            known = is_known_voice(new_voice)
+        except Exception as e:
+            reply_to_event(event, TextSendMessage(text=f"เช็ครายการเสียงไม่สำเร็จ: {e}"))
+            return
+        if not known:
+            reply_to_event(
+                event,
+                TextSendMessage(text=f"❌ ไม่พบ voice_id นี้ใน MiniMax:\n{new_voice}\nดูรายการด้วย /voices <คำค้น>")
+            )
+            return
+
         set_voice_id(new_voice)
 
-        line_bot_api.reply_message(
-            event.reply_token,
+        reply_to_event(
+            event,
             TextSendMessage(text=f"ตั้งค่า VOICE_ID (ล็อคทั้งบอท) แล้ว ✅\n{new_voice}")
         )
         return
 
+    # --- profile ---
+    # ✅ NEW: จับ profile เบื้องหลังแล้วส่งลิงก์ผลกลับมา (แอดมิน)
+    if lower == "/profile" or lower.startswith("/profile "):
+        # ไม่ใช้ is_admin(): ไม่ตั้ง ADMIN_USER_IDS = ทุกคนเป็นแอดมิน แต่ profile ต้องระบุตัวแอดมินจริง
+        if not ADMIN_USER_IDS:
+            reply_to_event(event, TextSendMessage(text="❌ ต้องตั้ง ADMIN_USER_IDS ก่อนใช้ /profile"))
+            return
+        if (getattr(event.source, "user_id", "") or "") not in ADMIN_USER_IDS:
+            reply_to_event(event, TextSendMessage(text="❌ คำสั่งนี้สำหรับแอดมินเท่านั้น"))
+            return
+
+        arg = user_text[len("/profile"):].strip()
+        seconds = int(arg) if arg.isdigit() else 10
+        if not target_id:
+            reply_to_event(event, TextSendMessage(text="ไม่พบปลายทางสำหรับส่งผล profile"))
+            return
+
+        threading.Thread(target=_profile_job, args=(target_id, seconds), daemon=True).start()
+        reply_to_event(event, TextSendMessage(text=f"⏳ กำลังจับ profile {min(seconds, PROFILE_MAX_SEC)} วินาที เสร็จแล้วจะส่งลิงก์ให้ครับ"))
+        return
+
+    # --- outage audio ---
+    if user_text == "ดับไฟ เสียง" or user_text.startswith("ดับไฟ เสียง "):
+        query = user_text[len("ดับไฟ เสียง"):].strip()
+        try:
+            index = get_outage_index()
+        except Exception as e:
+            reply_to_event(event, TextSendMessage(text=f"⚠️ อ่านชีตไม่สำเร็จ: {e}"))
+            return
+        today = outage_today()
+        _, records = select_outages(index, query)
+        records = [r for r in records if r.day is None or r.day >= today][:OUTAGE_AUDIO_MAX_ITEMS]
+        if not records:
+            suffix = f" \"{query}\"" if query else ""
+            reply_to_event(event, TextSendMessage(text=f"✅ ไม่พบรายการดับไฟที่ยังไม่ถึงวัน{suffix}"))
+            return
+
+        voice_id = get_voice_id()
+        if _warm_state["voice"] != voice_id:
+            # worker อื่นเปลี่ยนเสียง เตรียมใหม่ด้วยเสียงปัจจุบัน
+            schedule_outage_warm(index)
+        caption = TextSendMessage(text=f"🔊 ประกาศดับไฟ {len(records)} รายการ")
+        with span("cache_lookup"):
+            fname = outage_audio_file(records, voice_id)
+        if fname:
+            reply_to_event(event, [caption] + _audio_result_messages(fname))
+            return
+
+        # ยังเตรียมไม่ครบ: ทำเสียงรวมทั้งชุดเป็นงานเดียว (คิวระดับประกาศดับไฟ ไม่ติด admission)
+        if not target_id:
+            reply_to_event(event, TextSendMessage(text="⏳ กำลังเตรียมเสียงประกาศดับไฟ ลองใหม่อีกสักครู่ครับ"))
+            return
+        if minimax_breaker.retry_after():
+            reply_to_event(event, tts_failure_messages(MiniMaxUnavailable(minimax_breaker.retry_after())))
+            return
+        text = "\n".join(outage_speech_text(r) for r in records)
+        status, _ = submit_tts_job(target_id, text, voice_id, priority=TTS_PRIORITY_OUTAGE,
+                                   profile=OUTAGE_AUDIO_PROFILE)
+        if status == "busy":
+            msg = f"⚠️ คิวทำเสียงเต็ม ลองใหม่ในอีกประมาณ {tts_retry_after_sec()} วินาทีนะครับ"
+        else:
+            msg = "⏳ เสียงประกาศดับไฟยังไม่พร้อม กำลังทำให้ เสร็จแล้วจะส่งตามไปครับ"
+        reply_to_event(event, TextSendMessage(text=msg))
+        return
+
+    # --- outage subscribe ---
+    if user_text in ("ดับไฟ ติดตาม", "ดับไฟ เลิกติดตาม"):
+        if not target_id:
+            reply_to_event(event, TextSendMessage(text="ไม่พบปลายทางสำหรับส่งแจ้งเตือน"))
+            return
+        on = user_text == "ดับไฟ ติดตาม"
+        changed = set_subscribed(target_id, on)
+        if on:
+            msg = "🔔 สมัครรับแจ้งเตือนดับไฟแล้ว จะส่งให้เมื่อมีรายการใหม่หรือเปลี่ยนแปลงครับ" if changed \
+                else "🔔 ที่นี่สมัครรับแจ้งเตือนไว้อยู่แล้วครับ"
+            if OUTAGE_POLL_SEC <= 0:
+                msg += "\n(ตอนนี้ระบบแจ้งเตือนอัตโนมัติยังปิดอยู่)"
+        else:
+            msg = "🔕 เลิกรับแจ้งเตือนดับไฟแล้วครับ" if changed else "ที่นี่ยังไม่ได้สมัครรับแจ้งเตือนครับ"
+        reply_to_event(event, TextSendMessage(text=msg))
+        return
+
     # --- outage ---
-    if user_text == "ดับไฟ":
+    if user_text == "ดับไฟ" or user_text.startswith("ดับไฟ "):
         # ✅ NEW: ดึงข้อมูลจาก Google Sheet CSV ก่อน (ถ้าพัง/ว่างค่อย fallback)
         try:
-            rows = fetch_outages_from_sheet()
-            msg = build_outage_reply_from_sheet(rows)
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=msg))
+            # ✅ NEW: ตอบจาก index ใน cache ไม่ต้องโหลด/จัดรูปชีตทุกครั้ง
+            with span("outage_reply"):
+                msgs = outage_reply_messages(get_outage_index(), user_text[len("ดับไฟ"):].strip())
+            reply_to_event(event, [TextSendMessage(text=m) for m in msgs])
         except Exception as e:
             # fallback ไป template เดิม (กันระบบล่ม)
             fallback = build_outage_template()
-            line_bot_api.reply_message(
-                event.reply_token,
+            reply_to_event(
+                event,
                 TextSendMessage(text=f"⚠️ อ่านชีตไม่สำเร็จ ใช้ข้อความสำรองแทน\nเหตุผล: {e}\n\n{fallback}")
             )
         return
@@ -587,38 +4788,119 @@ def handle_message(event):
     # --- tts ---
     if user_text.startswith("เสียง"):
         text = user_text.replace("เสียง", "", 1).strip()
+        # ✅ NEW: "เสียง @voice-mono-64k ข้อความ" เลือก profile เฉพาะครั้งนี้ ไม่งั้นใช้ของห้อง
+        profile = get_audio_profile(target_id) if target_id else DEFAULT_AUDIO_PROFILE
+        if text.startswith("@"):
+            first, _, rest = text.partition(" ")
+            if first[1:].lower() in AUDIO_PROFILES:
+                profile = first[1:].lower()
+                text = rest.strip()
         if not text:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="พิมพ์แบบนี้ครับ: เสียง สวัสดีครับ ..."))
+            reply_to_event(event, TextSendMessage(text="พิมพ์แบบนี้ครับ: เสียง สวัสดีครับ ..."))
             return
 
         # ✅ เพิ่ม: จำกัดความยาวข้อความ
+        # (ข้อความเตือนส่งรวมไปกับคำตอบถัดไป reply token ใช้ได้ครั้งเดียว)
+        notices = []
         if len(text) > MAX_TTS_CHARS:
             text = text[:MAX_TTS_CHARS].rstrip()
-            line_bot_api.reply_message(
-                event.reply_token,
+            notices.append(
                 TextSendMessage(text=f"⚠️ ข้อความยาวเกินไป ตัดเหลือ {MAX_TTS_CHARS} ตัวอักษรแล้วกำลังทำเสียงให้ครับ")
             )
             # ไม่ return เพื่อให้ทำเสียงต่อได้
 
-        voice_id = get_voice_id()
+        with span("settings"):
+            voice_id = get_voice_id()
 
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=f"⏳ กำลังสร้างเสียงด้วย MiniMax (Sync HTTP)...\nVOICE: {voice_id}\nเสร็จแล้วจะส่งเสียงให้ฟังใน LINE และลิงก์วนเล่น/ลิงก์โหลดครับ")
-        )
+        # ✅ NEW: เจอใน cache ตอบกลับด้วย reply token ได้ทันที ไม่ต้องรอ MiniMax
+        key = tts_cache_key(build_t2a_payload(text, voice_id, profile))
+        with span("cache_lookup"):
+            cached = tts_cache_lookup(key, record_miss=False)
+        if cached:
+            reply_to_event(event, notices + _audio_result_messages(cached))
+            return
 
         if not target_id:
+            reply_to_event(
+                event,
+                notices + [TextSendMessage(text=f"⏳ กำลังสร้างเสียงด้วย MiniMax (Sync HTTP)...\nVOICE: {voice_id}\nเสร็จแล้วจะส่งเสียงให้ฟังใน LINE และลิงก์วนเล่น/ลิงก์โหลดครับ")]
+            )
+            return
+
+        # ✅ NEW: MiniMax ล่มอยู่ (circuit breaker เปิด) บอกผู้ใช้ทันที ไม่ต้องรอคิว
+        if minimax_breaker.retry_after() and key not in _tts_inflight:
+            reply_to_event(event, notices + tts_failure_messages(MiniMaxUnavailable(minimax_breaker.retry_after())))
+            return
+
+        # ✅ NEW: จำกัดความถี่ต่อกลุ่ม/ต่อคน (แอดมินและข้อความที่กำลังทำอยู่แล้วไม่นับ)
+        # เช็ค ADMIN_USER_IDS ตรงๆ ไม่ใช้ is_admin (ไม่ตั้ง ADMIN_USER_IDS = ทุกคนเป็นแอดมิน ไม่มีใครโดนจำกัด)
+        user_id = getattr(event.source, "user_id", "") or ""
+        admin = user_id in ADMIN_USER_IDS
+        charged = not admin and key not in _tts_inflight
+        if charged:
+            wait = tts_admission(target_id, user_id)
+            if wait:
+                reply_to_event(
+                    event,
+                    notices + [TextSendMessage(text=f"⏳ ขอทำเสียงถี่เกินไป ลองใหม่ในอีก {math.ceil(wait)} วินาทีนะครับ")]
+                )
+                return
+
+        # ✅ NEW: เข้าคิว worker pool (คิวเต็ม = ตอบไม่ว่างทันที) แอดมินได้คิวก่อน
+        status, position = submit_tts_job(target_id, text, voice_id,
+                                          priority=TTS_PRIORITY_ADMIN if admin else TTS_PRIORITY_NORMAL,
+                                          profile=profile)
+        # ไม่ได้เข้าคิวเป็นงานใหม่ ไม่นับโควต้า
+        if charged and status != "queued":
+            tts_admission_refund(target_id, user_id)
+
+        if status == "busy":
+            C_TTS_ADMISSION.inc("queue_full")
+            reply_to_event(
+                event,
+                notices + [TextSendMessage(text=f"⚠️ ตอนนี้มีงานทำเสียงรอคิวเต็มแล้ว ({position} งาน)\nลองใหม่ในอีกประมาณ {tts_retry_after_sec()} วินาทีนะครับ")]
+            )
+            return
+
+        if status == "target_busy":
+            C_TTS_ADMISSION.inc("target_busy")
+            reply_to_event(
+                event,
+                notices + [TextSendMessage(text=f"⚠️ ห้องนี้มีงานทำเสียงค้างอยู่ {position} งานแล้ว\nลองใหม่ในอีกประมาณ {tts_retry_after_sec()} วินาทีนะครับ")]
+            )
             return
 
-        threading.Thread(
-            target=tts_background_job,
-            args=(target_id, text, voice_id),
-            daemon=True
-        ).start()
+        if status == "joined":
+            queue_note = "มีคนขอเสียงข้อความนี้อยู่แล้ว เสร็จพร้อมกันครับ"
+        elif position > 1:
+            queue_note = f"อยู่คิวที่ {position} รอประมาณ {tts_retry_after_sec()} วินาที"
+        else:
+            queue_note = "เริ่มทำทันที"
+
+        reply_to_event(
+            event,
+            notices + [TextSendMessage(text=f"⏳ กำลังสร้างเสียงด้วย MiniMax ({'Stream' if MINIMAX_STREAM else 'Sync HTTP'})... ({queue_note})\nVOICE: {voice_id}\nเสร็จแล้วจะส่งเสียงให้ฟังใน LINE และลิงก์วนเล่น/ลิงก์โหลดครับ")]
+        )
         return
 
     return
 
+def _profile_job(target_id: str, seconds: int) -> None:
+    try:
+        profile_id, token = store_profile(sample_profile(seconds))
+        if BASE_URL:
+            url = build_https_url(BASE_URL, f"/debug/profile/{profile_id}?token={token}")
+            msg = f"✅ profile เสร็จแล้ว (folded stacks)\n{url}"
+        else:
+            msg = "✅ profile เสร็จแล้ว แต่ยังไม่ได้ตั้งค่า BASE_URL จึงส่งลิงก์ไม่ได้"
+    except Exception as e:
+        count_error(e)
+        msg = f"❌ จับ profile ไม่สำเร็จ: {e}"
+    try:
+        send_messages(target_id, TextSendMessage(text=msg))
+    except Exception as e:
+        count_error(e)
+
 # =======================
 # ✅ NEW: MiniMax Control Panel
 # =======================
@@ -626,9 +4908,12 @@ def handle_message(event):
 def get_minimax_credit():
     """ดึงเครดิตคงเหลือจาก MiniMax"""
     try:
-        url = "https://api.minimax.io/v1/user/balance"
-        r = requests.get(url, headers=_minimax_headers(), timeout=10)
-        data = r.json()
+        if ASYNC_MODE:
+            data = run_async(aio_minimax_balance()).result()
+        else:
+            url = f"{MINIMAX_BASE_URL}/v1/user/balance"
+            r = http_session("minimax").get(url, headers=_minimax_headers(), timeout=HTTP_TIMEOUTS["minimax_balance"])
+            data = r.json()
         return (
             data.get("credit_balance")
             or data.get("balance")
@@ -639,20 +4924,151 @@ def get_minimax_credit():
         return f"เช็คไม่ได้: {e}"
 
 
+# =======================
+# ✅ NEW: Credit poller (เช็คเครดิตเบื้องหลัง หน้า /control ไม่ต้องรอ MiniMax)
+# =======================
+CREDIT_POLL_SEC = int(os.getenv("CREDIT_POLL_SEC", "300"))
+# เก็บประวัติย้อนหลังกี่ครั้ง (ค่าเริ่มต้น 288 x 5 นาที = 24 ชั่วโมง)
+CREDIT_HISTORY_MAX = int(os.getenv("CREDIT_HISTORY_MAX", "288"))
+
+_credit_lock = threading.Lock()
+_credit_history = deque(maxlen=CREDIT_HISTORY_MAX)  # (เวลา, เครดิตที่เป็นตัวเลข|None, ค่าดิบ, จำนวนตัวอักษรสะสม)
+_credit_poller = []
+_tts_chars_total = 0
+
+
+def count_tts_chars(n: int) -> None:
+    """นับตัวอักษรที่ส่งไปทำเสียงจริง (ไม่รวม cache hit) ใช้คำนวณเครดิตต่อตัวอักษร"""
+    global _tts_chars_total
+    with _credit_lock:
+        _tts_chars_total += n
+
+
+def _credit_number(value):
+    try:
+        return float(str(value).replace(",", ""))
+    except (TypeError, ValueError):
+        return None
+
+
+def sample_credit() -> None:
+    raw = get_minimax_credit()
+    with _credit_lock:
+        _credit_history.append((time.time(), _credit_number(raw), raw, _tts_chars_total))
+
+
+def _credit_poll_loop():
+    while True:
+        try:
+            sample_credit()
+        except Exception:
+            pass
+        time.sleep(CREDIT_POLL_SEC)
+
+
+def ensure_credit_poller() -> None:
+    with _credit_lock:
+        if _credit_poller:
+            return
+        t = threading.Thread(target=_credit_poll_loop, name="credit-poller", daemon=True)
+        t.start()
+        _credit_poller.append(t)
+
+
+def credit_snapshot() -> dict:
+    """
+    เครดิตล่าสุด + อายุข้อมูล + อัตราใช้เครดิตต่อตัวอักษร
+    (คิดจากตัวอย่างแรกกับล่าสุดที่เป็นตัวเลข ช่วงที่มีการเติมเครดิตจะถูกตัดออก)
+    """
+    with _credit_lock:
+        history = list(_credit_history)
+        chars_total = _tts_chars_total
+
+    if not history:
+        return {"credit": None, "age_sec": None, "per_char": None, "chars": chars_total, "samples": 0}
+
+    ts, _, raw, _ = history[-1]
+    numeric = [h for h in history if h[1] is not None]
+
+    # ตัดช่วงก่อนเติมเครดิต (เครดิตเพิ่มขึ้น) ออก
+    start = 0
+    for i in range(1, len(numeric)):
+        if numeric[i][1] > numeric[i - 1][1]:
+            start = i
+    window = numeric[start:]
+
+    per_char = None
+    if len(window) >= 2:
+        used = window[0][1] - window[-1][1]
+        chars = window[-1][3] - window[0][3]
+        if chars > 0:
+            per_char = used / chars
+
+    return {
+        "credit": raw,
+        "age_sec": int(time.time() - ts),
+        "per_char": per_char,
+        "chars": chars_total,
+        "samples": len(history),
+    }
+
+
 @app.route("/control", methods=["GET"])
 def control_panel():
-    credit = get_minimax_credit()
+    # ✅ NEW: ใช้ค่าจาก poller ไม่เรียก MiniMax ตอนเปิดหน้า
+    ensure_credit_poller()
+    credit = credit_snapshot()
+    if credit["credit"] is None:
+        credit_text = "กำลังโหลด... (รีเฟรชอีกครั้งในไม่กี่วินาที)"
+    else:
+        credit_text = f"{credit['credit']} (ข้อมูลเมื่อ {credit['age_sec']} วินาทีที่แล้ว, เช็คทุก {CREDIT_POLL_SEC} วินาที)"
+    if credit["per_char"] is not None:
+        burn_text = f"{credit['per_char']:.4f} ต่อตัวอักษร (~{credit['per_char'] * 1000:.2f} ต่อ 1,000 ตัวอักษร)"
+    else:
+        burn_text = "ยังไม่พอคำนวณ"
     voice_now = get_voice_id()
+    cache = tts_cache_stats()
+    usage = audio_index_usage()
 
     html = f"""
     <h2>🎛 MiniMax Control Panel</h2>
 
     <h3>💳 เครดิต MiniMax คงเหลือ</h3>
-    <p>{credit}</p>
+    <p>{credit_text}</p>
+    <p>อัตราใช้เครดิต: {burn_text} | ทำเสียงไปแล้ว {credit["chars"]} ตัวอักษร</p>
 
     <h3>🔊 เสียงที่ใช้ตอนนี้</h3>
     <p>{voice_now}</p>
 
+    <h3>🗂 Cache เสียง</h3>
+    <p>hit: {cache["hit"]} | hit จาก store ร่วม: {cache["shared_hit"]} | miss: {cache["miss"]} | evicted: {cache["evicted"]}</p>
+    <p>ไฟล์: {usage["files"]} | ขนาด: {usage["bytes"] / 1024 / 1024:.1f} / {AUDIO_MAX_TOTAL_BYTES / 1024 / 1024:.0f} MB</p>
+    <p>storage: {STORAGE_BACKEND} | instance: {INSTANCE_ID}</p>
+
+    <h3>⏱ เวลาทำเสียง (โหมด: {'stream' if MINIMAX_STREAM else 'sync'})</h3>
+    <p>{synth_stats()}</p>
+    <p>audio profile (default: {DEFAULT_AUDIO_PROFILE}, ดับไฟ: {OUTAGE_AUDIO_PROFILE}, เทียบกับ {AUDIO_PROFILE_BASELINE}): {audio_profile_stats()}</p>
+
+    <h3>🔌 HTTP connection reuse</h3>
+    <p>{http_pool_stats()}</p>
+
+    <h3>📤 การส่งข้อความ LINE</h3>
+    <p>{send_stats()}</p>
+
+    <h3>📨 Webhook</h3>
+    <p>{_webhook_stats} | รอคิว: {_webhook_queue.qsize()}</p>
+
+    <h3>🧵 คิวทำเสียง (IO_MODE: {IO_MODE})</h3>
+    <p>workers: {TTS_WORKERS} | รอคิว: {_tts_queue.qsize()}/{TTS_QUEUE_MAX} | งานที่ยังไม่เสร็จ: {len(_tts_inflight)}{f"/{ASYNC_TTS_MAX_INFLIGHT}" if ASYNC_MODE else ""}</p>
+    <p>journal: {journal_stats() if TTS_JOURNAL_PATH else "ปิด"}</p>
+    <p>MiniMax resilience (hedge: {"เปิด" if MINIMAX_HEDGE else "ปิด"}): {minimax_resilience_stats()}</p>
+
+    <p>เตรียมเสียงดับไฟล่วงหน้า: {warm_stats() if OUTAGE_WARM else "ปิด"}</p>
+
+    <h3>🔔 แจ้งเตือนดับไฟ (poll ทุก {OUTAGE_POLL_SEC or "-"} วินาที, {OUTAGE_NOTIFY_MODE})</h3>
+    <p>ผู้สมัคร: {len(load_subscribers())} | {notify_stats()}</p>
+    <p>admission: { {lv: c[0] for lv, c in C_TTS_ADMISSION._collect().items()} } | งานค้างต่อห้อง (สูงสุด {TTS_TARGET_MAX_PENDING}): {dict(sorted(_tts_owner_load.items(), key=lambda kv: -kv[1])[:5])} | เวลางานเฉลี่ย: {_tts_job_time["ewma"]:.1f}s</p>
+
     <hr>
     <h3>เปลี่ยนเสียง (ล็อคทั้งบอท)</h3>
 
@@ -662,7 +5078,7 @@ def control_panel():
     <a href="/control/setvoice?voice=moss_audio_b2d479cd-3cd8-11f1-a34e-be827e93647d">เสียงผู้หญิงอัพเดท</a><br><br>
 
     <hr>
-    <p>รีเฟรชหน้าเพื่อดูเครดิตล่าสุด</p>
+    <p>รีเฟรชหน้าเพื่อดูข้อมูลล่าสุด (เครดิตอัปเดตเบื้องหลังทุก {CREDIT_POLL_SEC} วินาที)</p>
     """
     return Response(html, mimetype="text/html; charset=utf-8")
 
@@ -673,6 +5089,14 @@ def control_set_voice():
     if not new_voice:
         return "ไม่พบ voice_id"
 
+    # ✅ NEW: เช็คกับ catalog ก่อนบันทึก
+    try:
+        known = is_known_voice(new_voice)
+    except Exception as e:
+        return f"เช็ครายการเสียงไม่สำเร็จ: {e}"
+    if not known:
+        return f"ไม่พบ voice_id นี้ใน MiniMax: {new_voice}"
+
     set_voice_id(new_voice)
 
     return f"""
@@ -681,6 +5105,73 @@ def control_set_voice():
     <a href="/control">⬅ กลับหน้า Control Panel</a>
     """
 
+# =======================
+# ✅ NEW: /metrics
+# =======================
+def _audio_dir_usage(field: str):
+    return audio_index_usage()[field]
+
+
+register_gauge("pea_tts_jobs_inflight", "งานทำเสียงที่อยู่ในคิว/กำลังทำ", lambda: len(_tts_inflight))
+register_gauge("pea_tts_queue_depth", "งานที่รอ TTS worker", lambda: _tts_queue.qsize())
+register_gauge("pea_webhook_queue_depth", "event ที่รอ webhook worker", lambda: _webhook_queue.qsize())
+register_gauge("pea_tts_journal_queue_depth", "op ที่รอ commit ลง journal", lambda: _journal_queue.qsize())
+register_gauge("pea_minimax_breaker_state", "circuit breaker ของ MiniMax (0=closed 1=half_open 2=open)",
+               lambda: CircuitBreaker.STATES[minimax_breaker.state])
+register_gauge("pea_threads", "จำนวน thread ที่ทำงานอยู่", threading.active_count)
+register_gauge("pea_audio_dir_bytes", "ขนาดรวมไฟล์เสียงใน AUDIO_DIR", lambda: _audio_dir_usage("bytes"))
+register_gauge("pea_audio_dir_files", "จำนวนไฟล์เสียงใน AUDIO_DIR", lambda: _audio_dir_usage("files"))
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+# =======================
+# ✅ NEW: /debug/profile (ต้องตั้ง PROFILE_TOKEN ก่อน ไม่งั้นปิดไว้)
+# =======================
+@app.route("/debug/profile", methods=["GET"])
+def debug_profile():
+    token = request.args.get("token", "")
+    if not PROFILE_TOKEN or token != PROFILE_TOKEN:
+        abort(403)
+
+    try:
+        seconds = float(request.args.get("seconds", "10"))
+    except ValueError:
+        abort(400)
+    try:
+        folded = sample_profile(seconds)
+    except RuntimeError as e:
+        return Response(str(e), status=409, mimetype="text/plain; charset=utf-8")
+    return Response(folded, mimetype="text/plain; charset=utf-8")
+
+
+@app.route("/debug/profile/<profile_id>", methods=["GET"])
+def debug_profile_result(profile_id):
+    with _profile_results_lock:
+        entry = _profile_results.get(profile_id)
+    if entry is None:
+        abort(404)
+    expected, folded = entry
+    token = request.args.get("token", "")
+    if not (hmac.compare_digest(token, expected) or (PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN))):
+        abort(403)
+    return Response(folded, mimetype="text/plain; charset=utf-8")
+
+
+# =======================
+# ✅ NEW: resume งานทำเสียงที่ค้างจาก process ก่อนหน้า (ทำเบื้องหลัง ไม่ถ่วงการ start แล้วสแกนซ้ำทุก TTS_JOURNAL_RESUME_SEC)
+# =======================
+if TTS_JOURNAL_PATH:
+    threading.Thread(target=_resume_tts_journal_bg, name="tts-journal-resume", daemon=True).start()
+
+# ✅ NEW: poll ชีตดับไฟเป็นระยะ (ทุก worker เริ่มได้ lease ใน outage_poll_once ให้ทำทีละตัว)
+if OUTAGE_POLL_SEC > 0:
+    threading.Thread(target=_outage_poller_loop, name="outage-poller", daemon=True).start()
+
+
 # =======================
 # Main
 # =======================
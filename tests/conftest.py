@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+
+# bot.py อ่าน ENV ตอน import: ตั้งค่าให้ไม่มี thread เบื้องหลัง / ไม่เขียนไฟล์นอก temp
+_tmp = tempfile.mkdtemp(prefix="pea-test-")
+os.environ.update({
+    "LINE_CHANNEL_ACCESS_TOKEN": "test",
+    "LINE_CHANNEL_SECRET": "test",
+    "MINIMAX_API_KEY": "test",
+    "BASE_URL": "https://example.invalid",
+    "TTS_JOURNAL_PATH": "",
+    "OUTAGE_POLL_SEC": "0",
+    "OUTAGE_WARM": "0",
+    "SETTINGS_PATH": os.path.join(_tmp, "settings.json"),
+    "AUDIO_DIR": os.path.join(_tmp, "audio"),
+})
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,51 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from linebot.models import MessageEvent, SourceUser, TextMessage, UnfollowEvent
+
+import bot
+
+
+@pytest.fixture
+def replies(monkeypatch):
+    sent = []
+    monkeypatch.setattr(bot, "reply_to_event", lambda event, messages: sent.append(messages.text))
+    monkeypatch.setattr(bot, "_profile_job", lambda target_id, seconds: None)
+    return sent
+
+
+def text_event(text, user_id="U1"):
+    return SimpleNamespace(
+        source=SimpleNamespace(type="user", user_id=user_id),
+        message=SimpleNamespace(text=text),
+        reply_token="rt",
+        timestamp=int(time.time() * 1000),
+    )
+
+
+def test_profile_refused_without_admin_list(replies, monkeypatch):
+    monkeypatch.setattr(bot, "ADMIN_USER_IDS", set())
+    bot.handle_message(text_event("/profile 5"))
+    assert replies == ["❌ ต้องตั้ง ADMIN_USER_IDS ก่อนใช้ /profile"]
+
+
+def test_profile_only_for_listed_admins(replies, monkeypatch):
+    monkeypatch.setattr(bot, "ADMIN_USER_IDS", {"Uadmin"})
+    bot.handle_message(text_event("/profile 5", user_id="U1"))
+    bot.handle_message(text_event("/profile 5", user_id="Uadmin"))
+    assert replies[0] == "❌ คำสั่งนี้สำหรับแอดมินเท่านั้น"
+    assert replies[1].startswith("⏳ กำลังจับ profile 5 วินาที")
+
+
+def test_dispatch_event_routes_by_event_and_message_type(replies, monkeypatch):
+    unsubscribed = []
+    monkeypatch.setattr(bot, "set_subscribed", lambda target_id, on: unsubscribed.append((target_id, on)))
+    monkeypatch.setattr(bot, "ADMIN_USER_IDS", set())
+    event = MessageEvent(source=SourceUser(user_id="U1"), reply_token="rt",
+                             timestamp=int(time.time() * 1000), message=TextMessage(text="/profile"))
+    bot.dispatch_event(event)
+    bot.dispatch_event(UnfollowEvent(source=SourceUser(user_id="U2")))
+    bot.dispatch_event(MessageEvent(source=SourceUser(user_id="U1"), message=None))
+    assert replies == ["❌ ต้องตั้ง ADMIN_USER_IDS ก่อนใช้ /profile"]
+    assert unsubscribed == [("U2", False)]
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def client():
+    return bot.app.test_client()
+
+
+def write_audio(name, data=b"ID3audio"):
+    with open(os.path.join(bot.AUDIO_DIR, name), "wb") as f:
+        f.write(data)
+
+
+def test_index_lives_outside_audio_dir():
+    audio_dir = os.path.abspath(bot.AUDIO_DIR)
+    index = os.path.abspath(bot.AUDIO_INDEX_PATH)
+    assert os.path.commonpath([audio_dir, index]) != audio_dir
+
+
+@pytest.mark.parametrize("name", [
+    ".audio_index.sqlite3",
+    "a" * 64 + ".mp3.tmp",
+    "A" * 64 + ".mp3",
+    "a" * 63 + ".mp3",
+    "notes.mp3",
+])
+def test_rejects_non_cache_names(client, name):
+    write_audio(name)
+    assert client.get(f"/audio/{name}").status_code == 404
+    assert client.get(f"/play/{name}").status_code == 404
+
+
+def test_serves_cache_names(client):
+    name = "c" * 64 + ".mp3"
+    write_audio(name)
+    assert client.get(f"/audio/{name}").data == b"ID3audio"
+    assert client.get(f"/play/{name}").status_code == 200
+
+
+def test_play_page_follows_the_file(client):
+    name = "d" * 64 + ".mp3"
+    write_audio(name)
+    assert client.get(f"/play/{name}").status_code == 200
+    first = bot._play_pages[name][0]
+    write_audio(name, b"ID3longer-audio")
+    assert client.get(f"/play/{name}").status_code == 200
+    assert bot._play_pages[name][0] != first
+    # ลบไฟล์ตรงๆ (ไม่ผ่าน audio_delivery_forget) หน้าเก่าใน cache ต้องไม่ถูกเสิร์ฟ
+    os.remove(os.path.join(bot.AUDIO_DIR, name))
+    assert client.get(f"/play/{name}").status_code == 404
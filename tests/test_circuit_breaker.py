@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+import bot
+
+
+def tripped(threshold=3, open_sec=0.05, max_open_sec=0.2):
+    br = bot.CircuitBreaker(threshold, open_sec, max_open_sec)
+    for _ in range(threshold):
+        br.before_call()
+        br.failure()
+    return br
+
+
+def test_opens_after_consecutive_failures():
+    br = bot.CircuitBreaker(3, 30, 300)
+    for _ in range(2):
+        br.failure()
+    assert br.state == "closed"
+    br.before_call()
+    br.failure()
+    assert br.state == "open"
+    assert br.retry_after() > 0
+    with pytest.raises(bot.MiniMaxUnavailable):
+        br.before_call()
+
+
+def test_success_resets_failure_count():
+    br = bot.CircuitBreaker(3, 30, 300)
+    br.failure()
+    br.failure()
+    br.success()
+    br.failure()
+    br.failure()
+    assert br.state == "closed"
+
+
+def test_half_open_allows_single_probe_then_closes():
+    br = tripped()
+    time.sleep(0.06)
+    br.before_call()
+    assert br.state == "half_open"
+    # ระหว่าง probe คำขออื่นยังถูกปฏิเสธ
+    with pytest.raises(bot.MiniMaxUnavailable):
+        br.before_call()
+    br.success()
+    assert br.snapshot() == {"state": "closed", "failures": 0, "open_sec": 0.05}
+    br.before_call()
+
+
+def test_failed_probe_doubles_open_time_up_to_max():
+    br = tripped()
+    for expected in (0.1, 0.2, 0.2):
+        time.sleep(br.open_sec + 0.01)
+        br.before_call()
+        br.failure()
+        assert br.state == "open"
+        assert br.open_sec == pytest.approx(expected)
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    br = bot.CircuitBreaker(2, 30, 300)
+    monkeypatch.setattr(bot, "minimax_breaker", br)
+    monkeypatch.setattr(bot, "MINIMAX_MAX_ATTEMPTS", 1)
+    return br
+
+
+def raising(error):
+    def attempt(read_timeout):
+        raise error
+    return attempt
+
+
+def test_business_error_counts_as_healthy(breaker):
+    breaker.failure()
+    with pytest.raises(bot.MiniMaxError):
+        bot.minimax_call(raising(bot.MiniMaxError("invalid voice", 2054)), 10)
+    assert breaker.failures == 0
+
+
+def test_undecodable_response_counts_as_failure(breaker):
+    for error in (RuntimeError("Failed to decode audio hex"), bot.MiniMaxError("no status")):
+        with pytest.raises(type(error)):
+            bot.minimax_call(raising(error), 10)
+    assert breaker.state == "open"
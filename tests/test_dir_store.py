@@ -0,0 +1,37 @@
+import os
+import time
+
+import bot
+
+
+def store(tmp_path):
+    return bot.DirStore(str(tmp_path))
+
+
+def test_claim_is_exclusive_until_release(tmp_path):
+    s = store(tmp_path)
+    assert s.claim("locks/a", "one", 30)
+    assert not s.claim("locks/a", "two", 30)
+    s.release("locks/a", "two")
+    assert not s.claim("locks/a", "two", 30)
+    s.release("locks/a", "one")
+    assert s.claim("locks/a", "two", 30)
+    assert os.listdir(tmp_path / "locks") == ["a"]
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    s = store(tmp_path)
+    s.put("locks/a", bot._lease_body("one", -1))
+    assert s.claim("locks/a", "two", 30)
+    assert bot._lease_owner(s.get("locks/a")) == "two"
+
+
+def test_unreadable_lease_is_held_until_older_than_ttl(tmp_path):
+    s = store(tmp_path)
+    for raw in (b"", b"{not json"):
+        s.put("locks/a", raw)
+        assert not s.claim("locks/a", "two", 30)
+        old = time.time() - 60
+        os.utime(tmp_path / "locks" / "a", (old, old))
+        assert s.claim("locks/a", "two", 30)
+        s.release("locks/a", "two")
@@ -0,0 +1,62 @@
+import queue
+
+import pytest
+
+import bot
+
+
+def drain(q):
+    return [q.get() for _ in range(q.qsize())]
+
+
+def test_round_robin_between_owners():
+    q = bot.FairQueue(10)
+    for item in ("a1", "a2", "a3"):
+        q.put_nowait(item, "A")
+    q.put_nowait("b1", "B")
+    q.put_nowait("b2", "B")
+    assert drain(q) == ["a1", "b1", "a2", "b2", "a3"]
+
+
+def test_lower_priority_number_first():
+    q = bot.FairQueue(10)
+    q.put_nowait("normal", "A", bot.TTS_PRIORITY_NORMAL)
+    q.put_nowait("admin", "B", bot.TTS_PRIORITY_ADMIN)
+    q.put_nowait("outage", "C", bot.TTS_PRIORITY_OUTAGE)
+    assert drain(q) == ["outage", "admin", "normal"]
+
+
+def test_full_raises():
+    q = bot.FairQueue(2)
+    q.put_nowait("x", "A")
+    q.put_nowait("y", "B")
+    with pytest.raises(queue.Full):
+        q.put_nowait("z", "C")
+    assert q.qsize() == 2
+
+
+def test_promote_moves_waiting_item():
+    q = bot.FairQueue(10)
+    q.put_nowait("a1", "A")
+    q.put_nowait("a2", "A")
+    q.put_nowait("b1", "B")
+    q.promote("a2", "A", bot.TTS_PRIORITY_ADMIN)
+    assert q.qsize() == 3
+    assert drain(q) == ["a2", "a1", "b1"]
+
+
+def test_promote_never_demotes():
+    q = bot.FairQueue(10)
+    q.put_nowait("x", "A", bot.TTS_PRIORITY_OUTAGE)
+    q.put_nowait("y", "B", bot.TTS_PRIORITY_ADMIN)
+    q.promote("x", "A", bot.TTS_PRIORITY_NORMAL)
+    assert drain(q) == ["x", "y"]
+
+
+def test_admission_refund_restores_both_buckets(monkeypatch):
+    monkeypatch.setattr(bot, "TTS_USER_BURST", 1)
+    monkeypatch.setattr(bot, "TTS_TARGET_BURST", 1)
+    assert bot.tts_admission("Gq", "Uq") == 0
+    assert bot.tts_admission("Gq", "Uq") > 0
+    bot.tts_admission_refund("Gq", "Uq")
+    assert bot.tts_admission("Gq", "Uq") == 0
@@ -0,0 +1,32 @@
+import threading
+
+import bot
+
+
+def test_counter_merges_thread_shards():
+    c = bot.Counter("pea_test_counter_total", "test", "kind")
+    c.inc("a")
+    t = threading.Thread(target=lambda: (c.inc("a", 2), c.inc("b")))
+    t.start()
+    t.join()
+    assert c._collect() == {"a": [3], "b": [1]}
+    assert c.render() == ['pea_test_counter_total{kind="a"} 3', 'pea_test_counter_total{kind="b"} 1']
+
+
+def test_histogram_buckets_are_cumulative():
+    h = bot.Histogram("pea_test_seconds", "test", buckets=(0.1, 1))
+    for v in (0.05, 0.5, 5):
+        h.observe(v)
+    assert h.render() == [
+        'pea_test_seconds_bucket{le="0.1"} 1',
+        'pea_test_seconds_bucket{le="1"} 2',
+        'pea_test_seconds_bucket{le="+Inf"} 3',
+        "pea_test_seconds_sum 5.550000",
+        "pea_test_seconds_count 3",
+    ]
+
+
+def test_base_metric_is_usable():
+    m = bot._Metric("pea_test_plain", "test")
+    m._shard()[""] = [4]
+    assert m.render() == ["pea_test_plain 4"]
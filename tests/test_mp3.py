@@ -0,0 +1,80 @@
+import bot
+
+# MPEG1 Layer III 128kbps 32kHz: 576 byte, 1152 sample = 36ms
+FRAME_128K = bytes([0xFF, 0xFB, 0x98, 0x04]) + bytes(572)
+# MPEG2 Layer III 64kbps 24kHz mono: 192 byte, 576 sample = 24ms
+FRAME_M2_64K = bytes([0xFF, 0xF3, 0x84, 0xC4]) + bytes(188)
+
+
+def id3v2(payload_size: int) -> bytes:
+    # ขนาดเป็น syncsafe integer (7 bit ต่อ byte)
+    size = bytes([(payload_size >> s) & 0x7F for s in (21, 14, 7, 0)])
+    return b"ID3\x03\x00\x00" + size + bytes(payload_size)
+
+
+def xing_frame() -> bytes:
+    frame = bytearray(FRAME_128K)
+    frame[36:40] = b"Xing"
+    return bytes(frame)
+
+
+def test_frame_header_mpeg1_layer3():
+    assert bot._mp3_frame_header(FRAME_128K, 0) == (576, 1152, 32000)
+
+
+def test_frame_header_mpeg2_layer3():
+    assert bot._mp3_frame_header(FRAME_M2_64K, 0) == (192, 576, 24000)
+
+
+def test_frame_header_padding_adds_one_byte():
+    padded = bytes([0xFF, 0xFB, 0x9A, 0x04])
+    assert bot._mp3_frame_header(padded, 0)[0] == 577
+
+
+def test_frame_header_rejects_invalid():
+    assert bot._mp3_frame_header(b"\x00\x00\x00\x00", 0) is None
+    # bitrate index 15 (bad) / sample rate index 3 (reserved) / version 1 (reserved)
+    assert bot._mp3_frame_header(bytes([0xFF, 0xFB, 0xF8, 0x04]), 0) is None
+    assert bot._mp3_frame_header(bytes([0xFF, 0xFB, 0x9C, 0x04]), 0) is None
+    assert bot._mp3_frame_header(bytes([0xFF, 0xEB, 0x98, 0x04]), 0) is None
+    # ข้อมูลไม่ครบ 4 byte
+    assert bot._mp3_frame_header(FRAME_128K[:3], 0) is None
+
+
+def test_skip_id3():
+    assert bot._mp3_skip_id3(id3v2(100) + FRAME_128K) == 110
+    assert bot._mp3_skip_id3(FRAME_128K) == 0
+
+
+def test_duration():
+    assert bot.mp3_duration_ms(FRAME_128K * 10) == 360
+    assert bot.mp3_duration_ms(FRAME_M2_64K * 10) == 240
+    assert bot.mp3_duration_ms(b"") == 0
+
+
+def test_frames_skip_id3_xing_and_id3v1():
+    data = id3v2(64) + xing_frame() + FRAME_128K * 3 + b"TAG" + bytes(125)
+    frames = list(bot.mp3_frames(data))
+    assert [start for start, _, _, _ in frames] == [74 + 576 * i for i in range(1, 4)]
+    assert bot.mp3_duration_ms(data) == 108
+
+
+def test_frames_skip_fake_sync_in_junk():
+    # ขยะที่หน้าตาเหมือน header แต่ตำแหน่ง frame ถัดไปไม่ใช่ header ต้องไม่ถูกนับ
+    junk = b"\x00" + FRAME_128K[:4] + b"junk"
+    frames = list(bot.mp3_frames(junk + FRAME_128K * 4))
+    assert [start for start, _, _, _ in frames] == [len(junk) + 576 * i for i in range(4)]
+
+
+def test_concat_keeps_only_audio_frames():
+    a = id3v2(32) + xing_frame() + FRAME_128K * 2
+    b = id3v2(16) + FRAME_128K * 3
+    out = bot.mp3_concat([a, b])
+    assert out == FRAME_128K * 5
+    assert bot.mp3_duration_ms(out) == 180
+
+
+def test_concat_mixed_formats():
+    out = bot.mp3_concat([FRAME_128K * 2, FRAME_M2_64K * 3])
+    assert len(out) == 576 * 2 + 192 * 3
+    assert bot.mp3_duration_ms(out) == 72 + 72
@@ -0,0 +1,84 @@
+from datetime import date, timedelta
+
+import pytest
+
+import bot
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("2026-02-12", date(2026, 2, 12)),
+    ("2026-02-12T08:30:00", date(2026, 2, 12)),
+    ("12/2/2569", date(2026, 2, 12)),
+    ("12-02-2026", date(2026, 2, 12)),
+    ("12 ก.พ. 2569", date(2026, 2, 12)),
+    ("วันพฤหัสบดีที่ 12 กุมภาพันธ์ 2569", date(2026, 2, 12)),
+    ("๑๒/๒/๒๕๖๙", date(2026, 2, 12)),
+])
+def test_parse_outage_date(raw, expected):
+    assert bot.parse_outage_date(raw) == expected
+
+
+def test_parse_outage_date_two_digit_year_picks_closest():
+    year = bot.outage_today().year
+    assert bot.parse_outage_date(f"1 ม.ค. {year % 100:02d}") == date(year, 1, 1)
+    assert bot.parse_outage_date(f"1 ม.ค. {(year + 543) % 100:02d}") == date(year, 1, 1)
+
+
+@pytest.mark.parametrize("raw", ["", "abc", "31/2/2026", "12 ฟ้า 2569", "2026-13-01"])
+def test_parse_outage_date_invalid(raw):
+    assert bot.parse_outage_date(raw) is None
+
+
+def row(day, area, start="08:30", detail="", status="active"):
+    return {"date": day.isoformat(), "start": start, "end": "16:00", "area": area, "detail": detail, "status": status}
+
+
+def test_diff_outages_added_changed_cancelled():
+    soon = bot.outage_today() + timedelta(days=2)
+    first = bot.OutageIndex([row(soon, "บ้านเหนือ"), row(soon, "บ้านใต้"), row(soon, "บ้านกลาง")])
+    state, added, changed, cancelled = bot.diff_outages({}, first)
+    assert len(added) == 3 and not changed and not cancelled
+
+    second = bot.OutageIndex([
+        row(soon, "บ้านเหนือ"),
+        row(soon, "บ้านใต้", detail="เลื่อนเวลา"),
+        row(soon, "บ้านใหม่"),
+    ])
+    _, added, changed, cancelled = bot.diff_outages(state, second)
+    assert [body for _, body in added] == [second.by_id[f"{soon}|08:30|บ้านใหม่"].body]
+    assert len(changed) == 1 and "เลื่อนเวลา" in changed[0][1]
+    assert len(cancelled) == 1 and "บ้านกลาง" in cancelled[0][1]
+
+
+def test_diff_outages_unchanged_is_empty():
+    soon = bot.outage_today() + timedelta(days=1)
+    index = bot.OutageIndex([row(soon, "บ้านเหนือ")])
+    state, _, _, _ = bot.diff_outages({}, index)
+    new_state, added, changed, cancelled = bot.diff_outages(state, index)
+    assert new_state == state
+    assert (added, changed, cancelled) == ([], [], [])
+
+
+def test_diff_outages_ignores_past_days():
+    past = bot.outage_today() - timedelta(days=1)
+    index = bot.OutageIndex([row(past, "บ้านเหนือ")])
+    state, added, _, _ = bot.diff_outages({}, index)
+    assert added == []
+    # รายการที่ผ่านไปแล้วหายจากชีต ไม่นับเป็นยกเลิก
+    _, _, _, cancelled = bot.diff_outages(state, bot.OutageIndex([]))
+    assert cancelled == []
+
+
+def test_diff_outages_skips_inactive_rows():
+    soon = bot.outage_today() + timedelta(days=1)
+    index = bot.OutageIndex([row(soon, "บ้านเหนือ", status="cancelled")])
+    assert bot.diff_outages({}, index)[1] == []
+
+
+def test_relative_day_reply_follows_the_date(monkeypatch):
+    today = bot.outage_today()
+    index = bot.OutageIndex([row(today, "บ้านเหนือ"), row(today + timedelta(days=1), "บ้านใต้")])
+    assert "บ้านเหนือ" in bot.outage_reply_messages(index, "วันนี้")[0]
+    monkeypatch.setattr(bot, "outage_today", lambda: today + timedelta(days=1))
+    reply = bot.outage_reply_messages(index, "วันนี้")[0]
+    assert "บ้านใต้" in reply and "บ้านเหนือ" not in reply
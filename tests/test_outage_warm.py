@@ -0,0 +1,45 @@
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    monkeypatch.setattr(bot, "OUTAGE_WARM_MIN_CREDIT", 100.0)
+    monkeypatch.setattr(bot, "OUTAGE_WARM_MAX_CHARS_PER_DAY", 1000)
+    monkeypatch.setitem(bot._warm_state, "day", None)
+
+
+def credit(monkeypatch, value, samples=1):
+    monkeypatch.setattr(bot, "credit_snapshot", lambda: {"credit": value, "samples": samples})
+
+
+def test_budget_needs_credit_above_floor(budget, monkeypatch):
+    credit(monkeypatch, "150")
+    assert bot._warm_take_budget(600)
+    assert not bot._warm_take_budget(600)
+    bot._warm_refund_budget(600)
+    assert bot._warm_take_budget(600)
+    credit(monkeypatch, "99.5")
+    assert not bot._warm_take_budget(1)
+
+
+def test_budget_samples_once_then_refuses_unknown_credit(budget, monkeypatch):
+    sampled = []
+    monkeypatch.setattr(bot, "sample_credit", lambda: sampled.append(1))
+    credit(monkeypatch, None, samples=0)
+    assert not bot._warm_take_budget(1)
+    assert sampled == [1]
+    credit(monkeypatch, "เช็คไม่ได้: timeout")
+    assert not bot._warm_take_budget(1)
+
+
+def test_background_lookup_is_not_a_cache_hit():
+    key = "d" * 64
+    with open(bot.tts_cache_path(key), "wb") as f:
+        f.write(b"ID3")
+    before = bot.tts_cache_stats()["hit"]
+    assert bot.tts_cache_lookup(key, record_miss=False, record_hit=False)
+    assert bot.tts_cache_stats()["hit"] == before
+    assert bot.tts_cache_lookup(key)
+    assert bot.tts_cache_stats()["hit"] == before + 1
@@ -0,0 +1,90 @@
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from linebot.models.error import Error
+
+import bot
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    calls = []
+    monkeypatch.setattr(bot, "_call_line", lambda func, *args, **kwargs: calls.append((func.__name__, args, kwargs)))
+    return calls
+
+
+def event(age_sec: float, reply_token="rt"):
+    return SimpleNamespace(reply_token=reply_token, timestamp=int((time.time() - age_sec) * 1000))
+
+
+def texts(n):
+    return [bot.TextSendMessage(text=str(i)) for i in range(n)]
+
+
+def test_empty_messages(sent):
+    bot.send_messages("U1", [])
+    assert sent == []
+
+
+def test_single_message_is_wrapped(sent):
+    bot.send_messages("U1", bot.TextSendMessage(text="x"))
+    assert [(name, len(args[1])) for name, args, _ in sent] == [("push_message", 1)]
+
+
+def test_fresh_reply_token_takes_first_batch(sent):
+    bot.send_messages("U1", texts(12), event(1))
+    assert [(name, args[0], len(args[1])) for name, args, _ in sent] == [
+        ("reply_message", "rt", 5), ("push_message", "U1", 5), ("push_message", "U1", 2)]
+    assert "retry_key" not in sent[0][2]
+
+
+def test_expired_reply_token_pushes_everything(sent):
+    bot.send_messages("U1", texts(3), event(bot.REPLY_TOKEN_TTL_SEC + 5))
+    assert [name for name, _, _ in sent] == ["push_message"]
+
+
+def test_each_push_gets_uuid_retry_key(sent):
+    bot.send_messages("U1", texts(6))
+    keys = [kwargs["retry_key"] for _, _, kwargs in sent]
+    assert len(set(keys)) == 2
+    assert all(uuid.UUID(k) for k in keys)
+
+
+def test_no_target_only_replies(sent):
+    bot.send_messages(None, texts(7), event(1))
+    assert [name for name, _, _ in sent] == ["reply_message"]
+
+
+def test_call_line_retries_after_429(monkeypatch):
+    waits = []
+    monkeypatch.setattr(bot._line_bucket, "pause", waits.append)
+    attempts = []
+
+    def flaky(*args, **kwargs):
+        attempts.append((args, kwargs))
+        if len(attempts) == 1:
+            raise bot.LineBotApiError(429, {"Retry-After": "2"}, error=Error(message="rate limited"))
+
+    bot._call_line(flaky, "U1", retry_key="k")
+    assert waits == [2.0]
+    assert attempts == [(("U1",), {"retry_key": "k"})] * 2
+
+
+def test_call_line_raises_other_errors(monkeypatch):
+    def broken(*args, **kwargs):
+        raise bot.LineBotApiError(400, {}, error=Error(message="bad request"))
+
+    with pytest.raises(bot.LineBotApiError):
+        bot._call_line(broken)
+
+
+def test_retry_keys_are_stable_across_resends(sent):
+    key = str(uuid.uuid4())
+    bot.send_messages("U1", texts(11), retry_key=key)
+    bot.send_messages("U1", texts(11), retry_key=key)
+    keys = [kwargs["retry_key"] for _, _, kwargs in sent]
+    assert keys[0] == key
+    assert keys[:3] == keys[3:]
+    assert len(set(keys)) == 3
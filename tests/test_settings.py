@@ -0,0 +1,43 @@
+import json
+import os
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def settings_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "settings.json")
+    monkeypatch.setattr(bot, "SETTINGS_PATH", path)
+    monkeypatch.setattr(bot, "SETTINGS_CHECK_SEC", 3600)
+    monkeypatch.setitem(bot._settings_cache, "data", None)
+    monkeypatch.setattr(bot, "invalidate_outage_warm", lambda: None)
+    return path
+
+
+def write(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+def test_set_voice_keeps_profiles_written_by_another_worker(settings_path):
+    write(settings_path, {"voice_id": "v1"})
+    assert bot.get_voice_id() == "v1"
+    # worker อื่นตั้ง profile หลังเรา cache ไว้ (cache ยังไม่หมดอายุ)
+    write(settings_path, {"voice_id": "v1", "audio_profiles": {"U1": "voice-mono-32k"}})
+    bot.set_voice_id("v2")
+    with open(settings_path, encoding="utf-8") as f:
+        assert json.load(f) == {"voice_id": "v2", "audio_profiles": {"U1": "voice-mono-32k"}}
+
+
+def test_set_profile_keeps_voice_written_by_another_worker(settings_path):
+    write(settings_path, {"voice_id": "v1"})
+    assert bot.get_audio_profile("U1") == bot.DEFAULT_AUDIO_PROFILE
+    write(settings_path, {"voice_id": "v2"})
+    bot.set_audio_profile("U1", "voice-mono-64k")
+    bot.set_audio_profile("U2", "voice-mono-32k")
+    bot.set_audio_profile("U1")
+    assert bot.get_voice_id() == "v2"
+    assert bot._load_settings()["audio_profiles"] == {"U2": "voice-mono-32k"}
+    assert sorted(os.listdir(os.path.dirname(settings_path))) == ["settings.json", "settings.json.lock"]
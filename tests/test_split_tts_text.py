@@ -0,0 +1,49 @@
+import bot
+
+split = bot.split_tts_text
+
+
+def test_short_text_is_one_chunk():
+    assert split("  สวัสดีครับ  ", 50) == ["สวัสดีครับ"]
+
+
+def test_empty_text():
+    assert split("", 10) == []
+    assert split("   \n ", 10) == []
+
+
+def test_exact_limit_is_not_split():
+    text = "ก" * 20
+    assert split(text, 20) == [text]
+
+
+def test_prefers_newlines():
+    text = "บรรทัดหนึ่ง ยาวหน่อย\nบรรทัดสอง ยาวหน่อย"
+    assert split(text, 25) == ["บรรทัดหนึ่ง ยาวหน่อย", "บรรทัดสอง ยาวหน่อย"]
+
+
+def test_splits_at_sentence_end_before_spaces():
+    text = "Hello there. General Kenobi!"
+    assert split(text, 15) == ["Hello there.", "General Kenobi!"]
+
+
+def test_falls_back_to_spaces():
+    text = "aaaa bbbb cccc dddd"
+    assert split(text, 9) == ["aaaa bbbb", "cccc dddd"]
+
+
+def test_hard_cut_without_spaces():
+    text = "ก" * 25
+    assert split(text, 10) == ["ก" * 10, "ก" * 10, "ก" * 5]
+
+
+def test_merges_small_pieces_up_to_limit():
+    text = "\n".join(["ab"] * 6)
+    assert split(text, 8) == ["ab ab ab", "ab ab ab"]
+
+
+def test_chunks_respect_limit_and_keep_words():
+    text = ("ประกาศดับไฟ พื้นที่ตำบลบ้านใหม่ ตั้งแต่เวลา 08:30 ถึง 16:00 น. " * 30).strip()
+    chunks = split(text, 100)
+    assert all(0 < len(c) <= 100 for c in chunks)
+    assert " ".join(chunks).split() == text.split()